@@ -5,20 +5,42 @@ This module provides the application factory pattern for creating Flask app inst
 Routes are organized in separate blueprint modules in the routes package.
 """
 
+import os
 from flask import Flask
-from database import init_database, add_sample_data
+from flask.json.provider import DefaultJSONProvider
+from records import Record
+from database import init_database, add_sample_data, checkout_connection, release_connection
 from routes import register_blueprints
+from cli import register_commands
+from services.payment_queue_service import start_payment_queue, PAYMENT_WORKERS
 
 
-def create_app():
+class LibraryJSONProvider(DefaultJSONProvider):
+    """JSON provider that also serializes Book and Loan records, as objects."""
+    
+    @staticmethod
+    def default(o):
+        if isinstance(o, Record):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
+
+
+def create_app(test_config=None):
     """
     Application factory function to create and configure Flask app.
     
+    Args:
+        test_config: Config overriding the defaults, e.g. {'TESTING': True}
+    
     Returns:
         Flask: Configured Flask application instance
     """
     app = Flask(__name__)
     app.secret_key = "super secret key"
+    app.json = LibraryJSONProvider(app)
+    app.config['PAYMENT_WORKERS'] = int(os.environ.get('PAYMENT_WORKERS', PAYMENT_WORKERS))
+    if test_config:
+        app.config.update(test_config)
     
     # Initialize the database
     init_database()
@@ -29,6 +51,24 @@ def create_app():
     # Register all route blueprints
     register_blueprints(app)
     
+    # Register command line tools (flask import-books, ...)
+    register_commands(app)
+    
+    # Each request checks out one pooled database connection and returns it when done
+    @app.before_request
+    def checkout_request_connection():
+        checkout_connection()
+    
+    app.teardown_request(release_connection)
+    
+    # Run queued payment jobs, including any left from before a restart, once the app serves its first
+    # request. CLI commands don't start workers: some point database.DATABASE at other files while
+    # they run. Tests run jobs themselves; PAYMENT_WORKERS=0 leaves them to other processes.
+    if app.config['PAYMENT_WORKERS'] > 0 and not app.testing:
+        @app.before_request
+        def start_payment_workers():
+            start_payment_queue(app.config['PAYMENT_WORKERS'])
+    
     return app
 
 
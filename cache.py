@@ -0,0 +1,83 @@
+"""
+Cache module for Library Management System
+Bounded, thread-safe in-process LRU cache used in front of hot database lookups.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """
+    Least-recently-used cache with hit/miss statistics.
+
+    Every invalidation bumps a generation counter. A reader that loads a value from
+    the database passes the generation it saw before loading to put(), so a value
+    read before a concurrent write is never stored after that write invalidated it.
+
+    Args:
+        capacity: Maximum number of entries kept before the least recently used is evicted
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get a cached value and mark it recently used, or default on a miss."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return self._entries[key]
+            self._misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any, generation: Optional[int] = None):
+        """
+        Store a value, evicting the least recently used entry if the cache is full.
+
+        Args:
+            key: Cache key
+            value: Value to store
+            generation: Generation read before loading value; the put is dropped if anything was invalidated since
+        """
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, key: Hashable):
+        """Drop one entry, if cached."""
+        with self._lock:
+            self.generation += 1
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Drop every entry. Statistics are kept."""
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        """Get hit/miss statistics: hits, misses, evictions, size, capacity and hit_rate."""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'size': len(self._entries),
+                'capacity': self.capacity,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else 0.0
+            }
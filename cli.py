@@ -0,0 +1,273 @@
+"""
+CLI Commands - Flask command line tools for the Library Management System
+Run with `flask --app app <command> --help` for usage.
+"""
+
+import os
+import json
+import asyncio
+import click
+from contextlib import nullcontext
+from flask import current_app
+from services.import_service import import_books, IMPORT_FORMATS, IMPORT_BATCH_SIZE
+from services.payment_service import AsyncPaymentGateway
+from services.reconciliation_service import (
+    reconcile_payments, RECONCILE_BATCH_SIZE, RECONCILE_CONCURRENCY, RECONCILE_RATE_LIMIT
+)
+from services.dataset_service import generate_dataset, DEFAULT_SEED, DATASET_BATCH_SIZE
+from services.benchmark_service import (
+    run_benchmarks, compare_results, BENCHMARK_ITERATIONS, BENCHMARK_WARMUP, BENCHMARK_DATA_DIR, REGRESSION_THRESHOLD
+)
+from services.library_service import settle_payment_request
+from services.loadtest_service import (
+    run_load_test, local_app_server, parse_mix, DEFAULT_MIX, LOAD_TEST_CLIENTS, LOAD_TEST_DURATION, REQUEST_TIMEOUT
+)
+from database import (
+    rebuild_patron_loan_counts, get_payment_discrepancies, init_database, reset_database, get_unsettled_payment_requests
+)
+
+
+def register_commands(app):
+    """Register all CLI commands with the Flask app."""
+    app.cli.add_command(import_books_command)
+    app.cli.add_command(rebuild_loan_counts_command)
+    app.cli.add_command(reconcile_payments_command)
+    app.cli.add_command(settle_payment_command)
+    app.cli.add_command(generate_dataset_command)
+    app.cli.add_command(benchmark_command)
+    app.cli.add_command(load_test_command)
+
+
+@click.command('import-books')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'import_format', type=click.Choice(IMPORT_FORMATS),
+              help='File format (defaults to the file extension).')
+@click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True, help='Books inserted per transaction.')
+@click.option('--workers', default=1, show_default=True, help='Processes used to validate rows.')
+def import_books_command(path, import_format, batch_size, workers):
+    """Bulk-import books from a CSV or JSON Lines file at PATH."""
+    if import_format is None:
+        extension = os.path.splitext(path)[1].lower().lstrip('.')
+        import_format = 'jsonl' if extension in ('jsonl', 'ndjson') else 'csv'
+    
+    with open(path, newline='', encoding='utf-8') as f:
+        result = import_books(f, import_format, batch_size, workers)
+    
+    for error in result['errors']:
+        click.echo(f"Row {error['row']} (ISBN {error['isbn']}): {error['error']}", err=True)
+    click.echo(f"Imported {result['imported']} books, {result['failed']} rows failed.")
+
+
+@click.command('rebuild-loan-counts')
+def rebuild_loan_counts_command():
+    """Recompute every patron's active loan counter from the borrow records."""
+    patrons = rebuild_patron_loan_counts()
+    click.echo(f"Rebuilt active loan counters, {patrons} patrons have books out.")
+
+
+@click.command('reconcile-payments')
+@click.option('--gateway-url', envvar='PAYMENT_GATEWAY_URL', default='https://api.payment-gateway.example.com',
+              show_default=True, help='Payment gateway API root (or set PAYMENT_GATEWAY_URL).')
+@click.option('--api-key', envvar='PAYMENT_GATEWAY_API_KEY', default='test_key_12345',
+              help='Payment gateway API key (or set PAYMENT_GATEWAY_API_KEY).')
+@click.option('--concurrency', default=RECONCILE_CONCURRENCY, show_default=True, help='Status checks in flight at once.')
+@click.option('--rate-limit', default=RECONCILE_RATE_LIMIT, show_default=True,
+              help='Status checks started per second (0 for no limit).')
+@click.option('--batch-size', default=RECONCILE_BATCH_SIZE, show_default=True, help='Payments checked between checkpoints.')
+@click.option('--full', is_flag=True, help='Recheck every recorded payment, not only those since the last run.')
+def reconcile_payments_command(gateway_url, api_key, concurrency, rate_limit, batch_size, full):
+    """Verify recorded late fee payments against the gateway, resuming an interrupted run.
+
+    Charges missing from the fee ledger are recorded once the gateway confirms them.
+    """
+    gateway = AsyncPaymentGateway(api_key=api_key, base_url=gateway_url, max_concurrency=concurrency)
+    try:
+        run = reconcile_payments(gateway, batch_size, concurrency, rate_limit or None, full)
+    finally:
+        asyncio.run(gateway.close())
+
+    for discrepancy in get_payment_discrepancies(run['id']):
+        click.echo(f"{discrepancy['transaction_id']} (patron {discrepancy['patron_id']}): "
+                   f"{discrepancy['kind']} - {discrepancy['detail']}", err=True)
+    resumed = " (resumed)" if run['resumed'] else ""
+    click.echo(f"Reconciliation run {run['id']}{resumed}: checked {run['checked']} payments, "
+               f"found {run['discrepancies']} discrepancies.")
+    unsettled = len(get_unsettled_payment_requests())
+    if unsettled:
+        click.echo(f"{unsettled} payments or refunds have an unknown outcome; see `flask settle-payment`.", err=True)
+
+
+@click.command('settle-payment')
+@click.argument('idempotency_key', required=False)
+@click.option('--processed/--not-processed', default=None,
+              help='Whether the gateway processed the request, as checked with the gateway.')
+@click.option('--transaction-id', help='Transaction ID of the charge, for a payment that was processed.')
+def settle_payment_command(idempotency_key, processed, transaction_id):
+    """List payments and refunds with an unknown outcome, or settle the one stored under IDEMPOTENCY_KEY.
+
+    The gateway didn't confirm whether these went through, so until they are settled the patron
+    can't be charged again, or the payment refunded again.
+    """
+    if idempotency_key is None:
+        requests = get_unsettled_payment_requests()
+        for request in requests:
+            if request['request_type'] == 'refund':
+                subject = f"refund of ${request['amount']:.2f} on {request['transaction_id']}"
+            else:
+                subject = f"payment by patron {request['patron_id']}" + \
+                    (f" for book {request['book_id']}" if request['book_id'] is not None else " of all fees")
+            click.echo(f"{request['idempotency_key']}: {subject}, since {request['updated_at']}")
+        click.echo(f"{len(requests)} requests with an unknown outcome.")
+        return
+
+    if processed is None:
+        raise click.UsageError("Give --processed or --not-processed.")
+    success, message = settle_payment_request(idempotency_key, processed, transaction_id)
+    if not success:
+        raise click.ClickException(message)
+    click.echo(message)
+
+
+@click.command('generate-dataset')
+@click.option('--books', default=10000, show_default=True, help='Books in the catalog.')
+@click.option('--patrons', default=1000, show_default=True, help='Patrons (at most 900,000).')
+@click.option('--loans', default=100000, show_default=True, help='Borrow records, active and returned.')
+@click.option('--seed', default=DEFAULT_SEED, show_default=True, help='Random seed, for reproducible datasets.')
+@click.option('--history-days', default=365, show_default=True, help='Days of loan history.')
+@click.option('--batch-size', default=DATASET_BATCH_SIZE, show_default=True, help='Rows inserted per transaction.')
+@click.option('--reset', is_flag=True, help='Empty the existing database first.')
+def generate_dataset_command(books, patrons, loans, seed, history_days, batch_size, reset):
+    """Fill an empty database with a synthetic catalog, patrons and loan history."""
+    if reset:
+        reset_database()  # Emptied in place, so a running app's open connections stay valid.
+    else:
+        init_database()
+
+    def progress(stage, done, total):
+        click.echo(f"\r{stage}: {done:,}/{total:,}", nl=done == total)
+
+    try:
+        result = generate_dataset(books, patrons, loans, seed, history_days, batch_size=batch_size, progress=progress)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Generated {result['books']:,} books, {result['patrons']:,} patrons and {result['loans']:,} loans "
+               f"({result['active_loans']:,} out, {result['overdue_loans']:,} overdue, "
+               f"{result['fee_entries']:,} fee ledger entries) in {result['seconds']}s.")
+
+
+@click.command('benchmark')
+@click.option('--size', 'sizes', multiple=True, default=['small'], show_default=True,
+              help='Dataset size: small, medium, large or BOOKSxPATRONSxLOANS. Repeat for several.')
+@click.option('--iterations', default=BENCHMARK_ITERATIONS, show_default=True, help='Timed calls per operation.')
+@click.option('--warmup', default=BENCHMARK_WARMUP, show_default=True, help='Untimed calls before the timed ones.')
+@click.option('--seed', default=DEFAULT_SEED, show_default=True, help='Seed for the datasets and call arguments.')
+@click.option('--data-dir', default=BENCHMARK_DATA_DIR, show_default=True, type=click.Path(file_okay=False),
+              help='Where seeded databases are kept between runs.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write the results to this JSON file.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Compare with a saved results file.')
+@click.option('--threshold', default=REGRESSION_THRESHOLD, show_default=True,
+              help='Fraction slower than the baseline that counts as a regression.')
+def benchmark_command(sizes, iterations, warmup, seed, data_dir, output, baseline, threshold):
+    """Time the library service hot paths against seeded databases of increasing size."""
+    try:
+        report = run_benchmarks(sizes, iterations, warmup, seed, data_dir, progress=click.echo)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    for size, result in report['results'].items():
+        click.echo(f"\n{size}: " + ", ".join(f"{count:,} {table}" for table, count in result['dataset'].items()))
+        click.echo(f"  {'operation':<22}{'ops/sec':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+        for operation, stats in result['operations'].items():
+            click.echo(f"  {operation:<22}{stats['ops_per_sec']:>10,.1f}{stats['p50_ms']:>10.3f}"
+                       f"{stats['p95_ms']:>10.3f}{stats['p99_ms']:>10.3f}{stats['errors']:>8}")
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        click.echo(f"\nResults written to {output}.")
+
+    if baseline:
+        with open(baseline, encoding='utf-8') as f:
+            regressions = compare_results(report, json.load(f), threshold)
+        for regression in regressions:
+            click.echo(f"REGRESSION {regression['size']} {regression['operation']} {regression['metric']}: "
+                       f"{regression['baseline']} -> {regression['current']} ({regression['change']:+.0%})", err=True)
+        if regressions:
+            raise SystemExit(1)
+        click.echo(f"No regressions beyond {threshold:.0%} against {baseline}.")
+
+
+def _echo_histogram(buckets, indent='    ', width=40):
+    """Print a latency histogram as text bars, skipping empty buckets at either end."""
+    filled = [index for index, (_, count) in enumerate(buckets) if count]
+    if not filled:
+        return
+    peak = max(count for _, count in buckets)
+    total = sum(count for _, count in buckets)
+    for bound, count in buckets[filled[0]:filled[-1] + 1]:
+        label = f"<= {bound} ms" if bound is not None else f"> {buckets[-2][0]} ms"
+        bar = '#' * max(1 if count else 0, round(count / peak * width))
+        click.echo(f"{indent}{label:>12} {count:>8} {count / total:>6.1%} {bar}")
+
+
+@click.command('load-test')
+@click.option('--url', help='Root URL of a running app to load. Without it the app is served locally in this process.')
+@click.option('--clients', 'client_counts', multiple=True, type=int, default=[LOAD_TEST_CLIENTS], show_default=True,
+              help='Concurrent clients. Repeat to run at several counts, each from a fresh reset.')
+@click.option('--duration', default=LOAD_TEST_DURATION, show_default=True, help='Seconds per run.')
+@click.option('--requests', 'max_requests', type=int, help='Stop each run after this many requests.')
+@click.option('--mix', default=','.join(f"{route}={weight}" for route, weight in DEFAULT_MIX.items()),
+              show_default=True, help='Routes and their relative weights.')
+@click.option('--seed', default=DEFAULT_SEED, show_default=True, help="Seed for the clients' requests.")
+@click.option('--timeout', default=REQUEST_TIMEOUT, show_default=True, help='Seconds before a request counts as failed.')
+@click.option('--histograms', is_flag=True, help='Print a latency histogram per route, not only overall.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write the results to this JSON file.')
+def load_test_command(url, client_counts, duration, max_requests, mix, seed, timeout, histograms, output):
+    """Load the web routes with concurrent HTTP clients and report throughput, latency and errors.
+
+    The app is reset to the sample data through /api/test/reset-db before each run, so don't point
+    this at a database you want to keep. The local server shares this process with the clients;
+    to size worker counts, start the app under its production server and pass --url.
+    """
+    try:
+        weights = parse_mix(mix)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    runs = []
+    server = nullcontext(url) if url else local_app_server(current_app._get_current_object())
+    with server as base_url:
+        for clients in client_counts:
+            click.echo(f"Running {clients} clients against {base_url} for "
+                       + (f"{max_requests:,} requests" if max_requests else f"{duration:g}s"))
+            try:
+                result = run_load_test(base_url, clients, weights, duration if not max_requests else float('inf'),
+                                       max_requests, seed, timeout)
+            except (ValueError, OSError) as e:
+                raise click.ClickException(f"Could not load {base_url}: {e}")
+            runs.append(result)
+
+            click.echo(f"\n{clients} clients: {result['requests']:,} requests in {result['seconds']}s, "
+                       f"{result['requests_per_sec']:,.1f} req/s, {result['error_rate']:.2%} errors")
+            click.echo(f"  {'route':<12}{'requests':>10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}"
+                       f"{'p99 ms':>10}{'max ms':>10}{'errors':>9}")
+            for route, stats in result['routes'].items():
+                click.echo(f"  {route:<12}{stats['calls']:>10,}{stats['requests_per_sec']:>10,.1f}"
+                           f"{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}"
+                           f"{stats['max_ms']:>10.2f}{stats['error_rate']:>9.2%}")
+                failures = {status: count for status, count in stats['status_codes'].items()
+                            if not status.isdigit() or int(status) >= 500}
+                if failures:
+                    click.echo("    failures: " + ", ".join(f"{status} x{count}" for status, count in failures.items()),
+                               err=True)
+            click.echo("  latency, all routes:")
+            _echo_histogram(result['histogram'])
+            if histograms:
+                for route, stats in result['routes'].items():
+                    click.echo(f"  latency, {route}:")
+                    _echo_histogram(stats['histogram'])
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump({'mix': weights, 'seed': seed, 'runs': runs}, f, indent=2)
+        click.echo(f"\nResults written to {output}.")
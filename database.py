@@ -3,23 +3,187 @@ Database module for Library Management System
 Handles all database operations and connections
 """
 
+import base64
+import json
+import queue
 import sqlite3
+import threading
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from cache import LRUCache
+from records import Book, Loan, ReturnedLoan, to_epoch, from_epoch
 
 # Database configuration
 DATABASE = 'library.db'
+POOL_SIZE = 5  # Idle connections kept open per database file.
+CATALOG_PAGE_SIZE = 50  # Default number of books per catalog page.
+MAX_CATALOG_PAGE_SIZE = 200
+
+BOOK_CACHE_SIZE = 10000  # Books kept in the in-process lookup cache.
+EXPORT_CHUNK_SIZE = 1000  # Rows fetched per round trip when streaming exports.
+
+# Columns written by the streaming exports, in output order.
+BOOK_COLUMNS = Book._fields
+LOAN_COLUMNS = ('id', 'patron_id', 'book_id', 'borrow_date', 'due_date', 'return_date', 'late_fee')
+_LOAN_DATE_COLUMNS = ('borrow_date', 'due_date', 'return_date')
+
+# Catalog sort options: sort name -> (ORDER BY key, column the cursor remembers).
+CATALOG_SORTS = {
+    'title': ('title COLLATE NOCASE', 'title'),
+    'author': ('author COLLATE NOCASE', 'author'),
+    'id': (None, None),  # Insertion order, the cursor is just the id.
+}
+
+# Applied once to every new connection, not on every checkout.
+CONNECTION_PRAGMAS = (
+    ('journal_mode', 'WAL'),  # Readers no longer block the single writer.
+    ('synchronous', 'NORMAL'),  # Safe with WAL, avoids an fsync per commit.
+    ('busy_timeout', 5000),  # Milliseconds to wait on a locked database.
+    ('cache_size', -16000),  # Negative means KiB, so 16 MB of page cache.
+    ('mmap_size', 134217728),  # 128 MB memory-mapped reads.
+)
+
 
 def get_db_connection():
-    """Get a database connection."""
-    conn = sqlite3.connect(DATABASE)
+    """Open a new, unpooled database connection with the standard PRAGMAs applied."""
+    conn = sqlite3.connect(DATABASE, check_same_thread=False, isolation_level=None)
     conn.row_factory = sqlite3.Row  # This enables column access by name
+    for name, value in CONNECTION_PRAGMAS:
+        conn.execute(f'PRAGMA {name} = {value}')
     return conn
 
-def init_database():
-    """Initialize the database with required tables."""
-    conn = get_db_connection()
-    
+
+class ConnectionPool:
+    """
+    Keeps long-lived connections to one database file so helpers don't pay for
+    sqlite3.connect() on every call. Connections run in autocommit mode
+    (isolation_level=None); multi-statement writes go through transaction().
+
+    Args:
+        database: Path of the SQLite database file
+        size: Maximum number of idle connections kept open
+    """
+
+    def __init__(self, database: str, size: int = POOL_SIZE):
+        self.database = database
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._closed = False
+
+    def acquire(self) -> sqlite3.Connection:
+        """Take an idle connection, opening a new one if none is free."""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return get_db_connection()
+
+    def release(self, conn: sqlite3.Connection):
+        """Hand a connection back, closing it if the pool is full or closed."""
+        if conn.in_transaction:
+            conn.rollback()  # Never hand out a connection mid-transaction.
+        if self._closed or self._idle.qsize() >= self.size:
+            conn.close()
+            return
+        self._idle.put(conn)
+
+    def close(self):
+        """Close every idle connection. Checked-out ones are closed on release."""
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+_local = threading.local()  # Holds the connection pinned to the current thread, if any.
+
+
+def get_pool() -> ConnectionPool:
+    """Get the pool for the current DATABASE, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.database != DATABASE:
+            if _pool is not None:
+                _pool.close()
+            _pool = ConnectionPool(DATABASE, POOL_SIZE)
+        return _pool
+
+
+def close_pool():
+    """Close all pooled connections, e.g. before the database file is replaced."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+def checkout_connection() -> sqlite3.Connection:
+    """
+    Pin one pooled connection to the current thread until release_connection().
+    Used per Flask request so every helper called during it shares one connection.
+    """
+    pinned = getattr(_local, 'pinned', None)
+    if pinned is not None:
+        return pinned[1]
+    pool = get_pool()
+    _local.pinned = (pool, pool.acquire())
+    return _local.pinned[1]
+
+
+def release_connection(exc: Optional[BaseException] = None):
+    """Return the connection pinned by checkout_connection() to its pool."""
+    pinned = getattr(_local, 'pinned', None)
+    if pinned is not None:
+        _local.pinned = None
+        pool, conn = pinned
+        pool.release(conn)
+
+
+@contextmanager
+def connection() -> Iterator[sqlite3.Connection]:
+    """Borrow a connection: the thread's pinned one if any, otherwise one from the pool."""
+    pool = get_pool()
+    pinned = getattr(_local, 'pinned', None)
+    if pinned is not None and pinned[0] is pool:
+        yield pinned[1]
+        return
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+@contextmanager
+def transaction(immediate: bool = False) -> Iterator[sqlite3.Connection]:
+    """
+    Run a block of statements as one transaction on a borrowed connection.
+
+    Args:
+        immediate: Take the write lock up front (BEGIN IMMEDIATE) for read-then-write blocks
+    """
+    with connection() as conn:
+        if conn.in_transaction:  # Nested use joins the outer transaction.
+            yield conn
+            return
+        conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+# Schema Migrations
+
+def _create_base_tables(conn: sqlite3.Connection):
+    """Create the books and borrow_records tables."""
     # Create books table
     conn.execute('''
         CREATE TABLE IF NOT EXISTS books (
@@ -31,7 +195,7 @@ def init_database():
             available_copies INTEGER NOT NULL
         )
     ''')
-    
+
     # Create borrow_records table
     conn.execute('''
         CREATE TABLE IF NOT EXISTS borrow_records (
@@ -44,189 +208,1591 @@ def init_database():
             FOREIGN KEY (book_id) REFERENCES books (id)
         )
     ''')
-    
-    conn.commit()
-    conn.close()
+
+def _add_late_fee_column(conn: sqlite3.Connection):
+    """Add the late fee recorded when a book is returned."""
+    columns = [row['name'] for row in conn.execute('PRAGMA table_info(borrow_records)')]
+    if 'late_fee' not in columns:  # Databases from before versioning may already have it.
+        conn.execute('ALTER TABLE borrow_records ADD COLUMN late_fee REAL')
+
+def _add_lookup_indexes(conn: sqlite3.Connection):
+    """Index patron loan lookups and catalog ordering so they stop scanning whole tables."""
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_borrow_records_patron_return 
+        ON borrow_records (patron_id, return_date)
+    ''')
+    # Partial index: only active loans, which is what borrow limits and returns look up.
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_borrow_records_active 
+        ON borrow_records (patron_id, book_id) WHERE return_date IS NULL
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_borrow_records_book 
+        ON borrow_records (book_id)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_books_title_nocase 
+        ON books (title COLLATE NOCASE)
+    ''')
+
+def _add_books_search_index(conn: sqlite3.Connection):
+    """Trigram FTS5 index over book titles and authors, kept in sync with books by triggers."""
+    # External-content table: stores only the index, rows are read back from books.
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+            title, author, content='books', content_rowid='id', tokenize='trigram'
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+            INSERT INTO books_fts (rowid, title, author) VALUES (new.id, new.title, new.author);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+            INSERT INTO books_fts (books_fts, rowid, title, author) VALUES ('delete', old.id, old.title, old.author);
+        END
+    ''')
+    # Only title/author changes touch the index, not every borrow and return.
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title, author ON books BEGIN
+            INSERT INTO books_fts (books_fts, rowid, title, author) VALUES ('delete', old.id, old.title, old.author);
+            INSERT INTO books_fts (rowid, title, author) VALUES (new.id, new.title, new.author);
+        END
+    ''')
+    conn.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")  # Index books that already exist.
+
+def _add_author_index(conn: sqlite3.Connection):
+    """Index author ordering so the catalog can be paged by author."""
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_books_author_nocase 
+        ON books (author COLLATE NOCASE)
+    ''')
+
+def _add_due_date_index(conn: sqlite3.Connection):
+    """Partial index on due dates of active loans, for library-wide overdue reports."""
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_borrow_records_active_due 
+        ON borrow_records (due_date) WHERE return_date IS NULL
+    ''')
+
+def _add_fee_ledger(conn: sqlite3.Connection):
+    """Fee ledger entries plus a maintained outstanding balance per patron, seeded from recorded late fees."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS fee_ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            patron_id TEXT NOT NULL,
+            book_id INTEGER NOT NULL,
+            borrow_record_id INTEGER,
+            entry_type TEXT NOT NULL CHECK (entry_type IN ('assessed', 'paid', 'refunded')),
+            amount REAL NOT NULL CHECK (amount > 0),
+            transaction_id TEXT,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (borrow_record_id) REFERENCES borrow_records (id)
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_fee_ledger_patron_book 
+        ON fee_ledger (patron_id, book_id)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_fee_ledger_loan 
+        ON fee_ledger (borrow_record_id)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_fee_ledger_transaction 
+        ON fee_ledger (transaction_id) WHERE transaction_id IS NOT NULL
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS patrons (
+            patron_id TEXT PRIMARY KEY,
+            outstanding_fees REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    # Fees already recorded on returned loans become the opening ledger entries.
+    conn.execute('''
+        INSERT INTO fee_ledger (patron_id, book_id, borrow_record_id, entry_type, amount, created_at)
+        SELECT patron_id, book_id, id, 'assessed', late_fee, return_date 
+        FROM borrow_records WHERE late_fee > 0
+    ''')
+    conn.execute('''
+        INSERT INTO patrons (patron_id, outstanding_fees)
+        SELECT patron_id, SUM(amount) FROM fee_ledger GROUP BY patron_id
+    ''')
+
+def _add_active_loan_counters(conn: sqlite3.Connection):
+    """Active loan counter per patron, so borrow limit checks don't count borrow_records."""
+    conn.execute('ALTER TABLE patrons ADD COLUMN active_loans INTEGER NOT NULL DEFAULT 0')
+    _rebuild_active_loans(conn)
+
+def _rebuild_active_loans(conn: sqlite3.Connection):
+    """Recompute every patron's active loan counter from borrow_records, inside an open transaction."""
+    conn.execute('UPDATE patrons SET active_loans = 0 WHERE active_loans != 0')
+    conn.execute('''
+        INSERT INTO patrons (patron_id, active_loans)
+        SELECT patron_id, COUNT(*) FROM borrow_records WHERE return_date IS NULL GROUP BY patron_id
+        ON CONFLICT (patron_id) DO UPDATE SET active_loans = excluded.active_loans
+    ''')
+
+def _store_loan_dates_as_epoch(conn: sqlite3.Connection):
+    """
+    Rebuild borrow_records with INTEGER date columns (a TEXT column would store the numbers
+    back as text), converting existing ISO dates to epoch seconds, and recreate its indexes.
+    """
+    conn.execute('''
+        CREATE TABLE borrow_records_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            patron_id TEXT NOT NULL,
+            book_id INTEGER NOT NULL,
+            borrow_date INTEGER NOT NULL,
+            due_date INTEGER NOT NULL,
+            return_date INTEGER,
+            late_fee REAL,
+            FOREIGN KEY (book_id) REFERENCES books (id)
+        )
+    ''')
+    # strftime('%s') reads the naive ISO text as UTC, which is exactly the storage convention.
+    conn.execute('''
+        INSERT INTO borrow_records_new (id, patron_id, book_id, borrow_date, due_date, return_date, late_fee)
+        SELECT id, patron_id, book_id, 
+               CAST(strftime('%s', borrow_date) AS INTEGER), 
+               CAST(strftime('%s', due_date) AS INTEGER), 
+               CAST(strftime('%s', return_date) AS INTEGER), 
+               late_fee 
+        FROM borrow_records
+    ''')
+    conn.execute('DROP TABLE borrow_records')
+    conn.execute('ALTER TABLE borrow_records_new RENAME TO borrow_records')
+    _add_lookup_indexes(conn)
+    _add_due_date_index(conn)
+
+def _add_payment_jobs(conn: sqlite3.Connection):
+    """Queue of late fee payments and refunds, worked through by background threads."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS payment_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_type TEXT NOT NULL CHECK (job_type IN ('payment', 'refund')),
+            patron_id TEXT,
+            book_id INTEGER,
+            transaction_id TEXT,
+            amount REAL,
+            status TEXT NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'succeeded', 'failed')),
+            message TEXT,
+            result_transaction_id TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    ''')
+    # Partial index: workers only ever look for the oldest queued job.
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_payment_jobs_queued 
+        ON payment_jobs (id) WHERE status = 'queued'
+    ''')
+
+def _add_reconciliation_tables(conn: sqlite3.Connection):
+    """Reconciliation runs with their resume checkpoint, and the discrepancies they find."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS reconciliation_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            status TEXT NOT NULL DEFAULT 'running' CHECK (status IN ('running', 'completed')),
+            start_after INTEGER NOT NULL,
+            checkpoint INTEGER NOT NULL,
+            checked INTEGER NOT NULL DEFAULT 0,
+            discrepancies INTEGER NOT NULL DEFAULT 0,
+            started_at TEXT NOT NULL,
+            finished_at TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS payment_discrepancies (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_id INTEGER NOT NULL,
+            transaction_id TEXT NOT NULL,
+            patron_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            recorded_amount REAL,
+            gateway_amount REAL,
+            gateway_status TEXT,
+            detail TEXT,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (run_id) REFERENCES reconciliation_runs (id)
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_payment_discrepancies_run 
+        ON payment_discrepancies (run_id)
+    ''')
+
+def _add_payments(conn: sqlite3.Connection):
+    """Payment and refund requests with their gateway results, keyed by the client's idempotency key."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS payments (
+            idempotency_key TEXT PRIMARY KEY,
+            request_type TEXT NOT NULL CHECK (request_type IN ('payment', 'refund')),
+            patron_id TEXT,
+            book_id INTEGER,
+            transaction_id TEXT,
+            amount REAL,
+            status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'succeeded', 'failed')),
+            message TEXT,
+            result_transaction_id TEXT,
+            items TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_payments_result_transaction 
+        ON payments (result_transaction_id)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_payments_transaction 
+        ON payments (transaction_id)
+    ''')
+    # Retried API requests with the same key reuse the job instead of queueing another.
+    conn.execute('ALTER TABLE payment_jobs ADD COLUMN idempotency_key TEXT')
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_payment_jobs_idempotency_key 
+        ON payment_jobs (idempotency_key)
+    ''')
+
+def _add_unknown_payment_status(conn: sqlite3.Connection):
+    """
+    Rebuild payments so a request can be stored with an 'unknown' outcome (the gateway may or
+    may not have processed it), and index those for the check made before each new charge.
+    """
+    conn.execute('''
+        CREATE TABLE payments_new (
+            idempotency_key TEXT PRIMARY KEY,
+            request_type TEXT NOT NULL CHECK (request_type IN ('payment', 'refund')),
+            patron_id TEXT,
+            book_id INTEGER,
+            transaction_id TEXT,
+            amount REAL,
+            status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'succeeded', 'failed', 'unknown')),
+            message TEXT,
+            result_transaction_id TEXT,
+            items TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    ''')
+    conn.execute('INSERT INTO payments_new SELECT * FROM payments')
+    conn.execute('DROP TABLE payments')
+    conn.execute('ALTER TABLE payments_new RENAME TO payments')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_payments_result_transaction 
+        ON payments (result_transaction_id)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_payments_transaction 
+        ON payments (transaction_id)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_payments_unknown 
+        ON payments (patron_id, transaction_id) WHERE status = 'unknown'
+    ''')
+
+# Ordered (version, description, step). Only ever append: applied steps are never re-run.
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, 'Create books and borrow_records tables', _create_base_tables),
+    (2, 'Record late fee on borrow_records', _add_late_fee_column),
+    (3, 'Indexes for patron loans and title ordering', _add_lookup_indexes),
+    (4, 'Trigram full-text search index on books', _add_books_search_index),
+    (5, 'Index for catalog ordering by author', _add_author_index),
+    (6, 'Index active loans by due date', _add_due_date_index),
+    (7, 'Fee ledger and per-patron outstanding balances', _add_fee_ledger),
+    (8, 'Per-patron active loan counters', _add_active_loan_counters),
+    (9, 'Store loan dates as integer epoch seconds', _store_loan_dates_as_epoch),
+    (10, 'Persisted payment job queue', _add_payment_jobs),
+    (11, 'Payment reconciliation runs and discrepancies', _add_reconciliation_tables),
+    (12, 'Payments keyed by idempotency key', _add_payments),
+    (13, 'Unknown outcome status for payments', _add_unknown_payment_status),
+]
+
+def get_schema_version() -> int:
+    """Get the highest migration version applied to the database (0 if none)."""
+    with connection() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TEXT NOT NULL
+            )
+        ''')
+        return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+def migrate_database() -> int:
+    """
+    Apply every pending migration in order, each in its own transaction.
+
+    Returns:
+        int: Schema version after migrating
+    """
+    get_schema_version()  # Ensures the schema_version table exists.
+    for version, description, step in MIGRATIONS:
+        with transaction(immediate=True) as conn:
+            # Re-checked under the write lock in case another process migrated first.
+            applied = conn.execute('SELECT 1 FROM schema_version WHERE version = ?', (version,)).fetchone()
+            if applied:
+                continue
+            step(conn)
+            conn.execute('''
+                INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)
+            ''', (version, description, datetime.now().isoformat()))
+
+    with connection() as conn:
+        conn.execute('PRAGMA optimize')  # Refresh planner statistics for the new indexes.
+    return get_schema_version()
+
+def init_database():
+    """Initialize the database with required tables."""
+    close_pool()  # The file may have been deleted or replaced since the pool was opened.
+    invalidate_book_cache()
+    migrate_database()
+
+def reset_database():
+    """
+    Empty every table and restart the ID sequences in one transaction, keeping the schema.
+    Use this rather than deleting the database file: pooled connections, or another process
+    such as a running app, may still have the file and its -wal/-shm files open, and deleting
+    them underneath an open connection corrupts the database.
+    """
+    migrate_database()  # Creates the schema if the file is new.
+    with transaction(immediate=True) as conn:
+        # The FTS index follows books through its delete trigger, so its own tables are left alone.
+        tables = [row['name'] for row in conn.execute('''
+            SELECT name FROM sqlite_master
+            WHERE type = 'table' AND name NOT LIKE 'sqlite_%' AND name NOT LIKE 'books_fts%'
+              AND name != 'schema_version'
+        ''')]
+        for table in tables:
+            conn.execute(f'DELETE FROM {table}')
+        conn.execute('DELETE FROM sqlite_sequence')
+    invalidate_book_cache()
 
 def add_sample_data():
     """Add sample data to the database if it's empty."""
-    conn = get_db_connection()
-    book_count = conn.execute('SELECT COUNT(*) as count FROM books').fetchone()['count']
-    
-    if book_count == 0:
-        # Add sample books
-        sample_books = [
-            ('The Great Gatsby', 'F. Scott Fitzgerald', '9780743273565', 3),
-            ('To Kill a Mockingbird', 'Harper Lee', '9780061120084', 2),
-            ('1984', 'George Orwell', '9780451524935', 1)
-        ]
-        
-        for title, author, isbn, copies in sample_books:
+    with transaction() as conn:
+        book_count = conn.execute('SELECT COUNT(*) as count FROM books').fetchone()['count']
+
+        if book_count == 0:
+            # Add sample books
+            sample_books = [
+                ('The Great Gatsby', 'F. Scott Fitzgerald', '9780743273565', 3),
+                ('To Kill a Mockingbird', 'Harper Lee', '9780061120084', 2),
+                ('1984', 'George Orwell', '9780451524935', 1)
+            ]
+
+            for title, author, isbn, copies in sample_books:
+                conn.execute('''
+                    INSERT INTO books (title, author, isbn, total_copies, available_copies)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (title, author, isbn, copies, copies))
+
+            # Make 1984 unavailable by adding a borrow record
             conn.execute('''
-                INSERT INTO books (title, author, isbn, total_copies, available_copies)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (title, author, isbn, copies, copies))
-        
-        # Make 1984 unavailable by adding a borrow record
-        conn.execute('''
-            INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
-            VALUES (?, ?, ?, ?)
-        ''', ('123456', 3, 
-              (datetime.now() - timedelta(days=5)).isoformat(),
-              (datetime.now() + timedelta(days=9)).isoformat()))
-        
-        # Update available copies for 1984
-        conn.execute('UPDATE books SET available_copies = 0 WHERE id = 3')
-        
-        conn.commit()
-    
-    conn.close()
+                INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
+                VALUES (?, ?, ?, ?)
+            ''', ('123456', 3,
+                  to_epoch(datetime.now() - timedelta(days=5)),
+                  to_epoch(datetime.now() + timedelta(days=9))))
+            _adjust_active_loans(conn, '123456', 1)
+
+            # Update available copies for 1984
+            conn.execute('UPDATE books SET available_copies = 0 WHERE id = 3')
+
+    invalidate_book_cache()
 
 # Helper Functions for Database Operations
 
-def get_all_books() -> List[Dict]:
+# Column lists matching the Book and Loan field order, for their row factories.
+_BOOK_SELECT = ', '.join(f'b.{column}' for column in BOOK_COLUMNS)
+_LOAN_SELECT = 'br.book_id, b.title, b.author, br.borrow_date, br.due_date, br.return_date'
+
+def _fetch_records(conn: sqlite3.Connection, record_type, sql: str, params=()) -> List:
+    """Run a query whose columns are in record_type's field order and build records directly from the rows."""
+    cursor = conn.cursor()
+    cursor.row_factory = record_type.row_factory
+    try:
+        return cursor.execute(sql, params).fetchall()
+    finally:
+        cursor.close()
+
+def get_all_books() -> List[Book]:
     """Get all books from the database."""
-    conn = get_db_connection()
-    books = conn.execute('SELECT * FROM books ORDER BY title').fetchall()
-    conn.close()
-    return [dict(book) for book in books]
+    with connection() as conn:
+        return _fetch_records(conn, Book, f'SELECT {_BOOK_SELECT} FROM books b ORDER BY b.title COLLATE NOCASE, b.id')
+
+def _encode_cursor(key, book_id: int) -> str:
+    """Pack the last row's sort key and id into an opaque, URL-safe page cursor."""
+    return base64.urlsafe_b64encode(json.dumps([key, book_id]).encode()).decode()
+
+def _decode_cursor(cursor: str) -> Tuple:
+    """Unpack a page cursor made by _encode_cursor(). Raises ValueError if it is malformed."""
+    try:
+        key, book_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid catalog page cursor.") from e
+    if not isinstance(book_id, int):
+        raise ValueError("Invalid catalog page cursor.")
+    return key, book_id
+
+def get_books_page(after: Optional[str] = None, limit: int = CATALOG_PAGE_SIZE,
+                   sort: str = 'title') -> Tuple[List[Book], Optional[str]]:
+    """
+    Get one page of the catalog using keyset pagination on (sort key, id), so
+    later pages cost the same as the first one.
+
+    Args:
+        after: Cursor returned with the previous page (None for the first page)
+        limit: Number of books per page, capped at MAX_CATALOG_PAGE_SIZE
+        sort: "title", "author" or "id"
 
-def get_book_by_id(book_id: int) -> Optional[Dict]:
+    Returns:
+        tuple: (books: list of Book, next_cursor: Optional[str]), next_cursor is None on the last page
+
+    Raises:
+        ValueError: If the sort option or cursor is invalid
+    """
+    if sort not in CATALOG_SORTS:
+        raise ValueError(f"Cannot sort catalog by {sort!r}.")
+    order_key, cursor_column = CATALOG_SORTS[sort]
+    limit = max(1, min(limit, MAX_CATALOG_PAGE_SIZE))
+
+    where, params = '', []
+    if after:
+        key, last_id = _decode_cursor(after)
+        if order_key:
+            # Same as (sort key, id) > (?, ?), spelled out so SQLite seeks the index.
+            where = f'WHERE {order_key} >= ? AND ({order_key} > ? OR id > ?)'
+            params = [key, key, last_id]
+        else:
+            where, params = 'WHERE id > ?', [last_id]
+    order_by = f'{order_key}, id' if order_key else 'id'
+
+    with connection() as conn:
+        # One extra row tells us whether there is a next page.
+        books = _fetch_records(conn, Book, f'''
+            SELECT {_BOOK_SELECT} FROM books b {where} ORDER BY {order_by} LIMIT ?
+        ''', params + [limit + 1])
+
+    next_cursor = None
+    if len(books) > limit:
+        del books[limit:]
+        last = books[-1]
+        next_cursor = _encode_cursor(last[cursor_column] if cursor_column else None, last['id'])
+    return books, next_cursor
+
+def search_books(search_term: str, field: str, limit: Optional[int] = None, offset: int = 0) -> List[Book]:
+    """
+    Case-insensitive substring search of one book column, ordered like the catalog.
+
+    Args:
+        search_term: Substring to look for (empty matches every book)
+        field: Column to search, "title" or "author"
+        limit: Maximum number of books to return (None for no limit)
+        offset: Number of matching books to skip
+
+    Returns:
+        list: Matching books
+    """
+    if field not in ('title', 'author'):
+        raise ValueError(f"Cannot search books by {field!r}.")
+
+    paging = (-1 if limit is None else limit, offset)  # LIMIT -1 is unlimited in SQLite.
+    with connection() as conn:
+        if not search_term:
+            return _fetch_records(conn, Book, f'''
+                SELECT {_BOOK_SELECT} FROM books b ORDER BY b.title COLLATE NOCASE, b.id LIMIT ? OFFSET ?
+            ''', paging)
+        elif len(search_term) >= 3:
+            # A quoted phrase of trigrams matches the term anywhere in the column.
+            query = f'{field} : "{search_term.replace(chr(34), chr(34) * 2)}"'
+            return _fetch_records(conn, Book, f'''
+                SELECT {_BOOK_SELECT} FROM books_fts f JOIN books b ON b.id = f.rowid 
+                WHERE books_fts MATCH ? 
+                ORDER BY b.title COLLATE NOCASE, b.id LIMIT ? OFFSET ?
+            ''', (query,) + paging)
+        else:
+            # Terms shorter than one trigram can't use the index.
+            return _fetch_records(conn, Book, f'''
+                SELECT {_BOOK_SELECT} FROM books b WHERE instr(lower(b.{field}), lower(?)) > 0 
+                ORDER BY b.title COLLATE NOCASE, b.id LIMIT ? OFFSET ?
+            ''', (search_term,) + paging)
+
+def _iter_query(sql: str, chunk_size: int) -> Iterator[Dict]:
+    """Yield rows of a query one at a time, fetching chunk_size rows per round trip."""
+    with connection() as conn:
+        cursor = conn.execute(sql)
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(row)
+        finally:
+            cursor.close()  # Also runs if the consumer stops early, e.g. a client disconnect.
+
+def iter_books(chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[Dict]:
+    """Stream every book in id order without loading the catalog into memory."""
+    return _iter_query(f'SELECT {", ".join(BOOK_COLUMNS)} FROM books ORDER BY id', chunk_size)
+
+def iter_loans(chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[Dict]:
+    """Stream every borrow record in id order without loading the table into memory. Dates are ISO 8601 text."""
+    columns = ", ".join(
+        f"strftime('%Y-%m-%dT%H:%M:%S', {column}, 'unixepoch') AS {column}" if column in _LOAN_DATE_COLUMNS else column
+        for column in LOAN_COLUMNS
+    )
+    return _iter_query(f'SELECT {columns} FROM borrow_records ORDER BY id', chunk_size)
+
+# Read-through cache for single-book lookups. Books are cached by id; ISBNs map to ids
+# (an ISBN never changes), so invalidating a book by id covers both lookups.
+_book_cache = LRUCache(BOOK_CACHE_SIZE)
+_isbn_ids = LRUCache(BOOK_CACHE_SIZE)
+
+def invalidate_book_cache(book_id: Optional[int] = None):
+    """
+    Drop a book from the lookup cache after it changes. Every write to the books
+    table must call this once committed.
+
+    Args:
+        book_id: Book that changed (None clears the whole cache)
+    """
+    if book_id is None:
+        _book_cache.clear()
+        _isbn_ids.clear()
+    else:
+        _book_cache.invalidate(book_id)
+
+def get_book_cache_stats() -> Dict:
+    """Get hit/miss statistics of the book lookup cache."""
+    return _book_cache.stats()
+
+def _load_book(column: str, value) -> Optional[Book]:
+    """Read one book by a unique column and cache it, unless a write invalidated it meanwhile."""
+    generation = _book_cache.generation
+    with connection() as conn:
+        books = _fetch_records(conn, Book, f'SELECT {_BOOK_SELECT} FROM books b WHERE b.{column} = ?', (value,))
+        cacheable = not conn.in_transaction  # Uncommitted rows could still be rolled back.
+    if not books:
+        return None
+    book = books[0]
+    if cacheable:
+        _book_cache.put(book.id, book, generation)
+        _isbn_ids.put(book.isbn, book.id)
+    return book.copy()
+
+def get_book_by_id(book_id: int) -> Optional[Book]:
     """Get a specific book by ID."""
-    conn = get_db_connection()
-    book = conn.execute('SELECT * FROM books WHERE id = ?', (book_id,)).fetchone()
-    conn.close()
-    return dict(book) if book else None
+    book = _book_cache.get(book_id)
+    if book is not None:
+        return book.copy()  # A copy, so callers can't change the cached book.
+    return _load_book('id', book_id)
 
-def get_book_by_isbn(isbn: str) -> Optional[Dict]:
+def get_book_by_isbn(isbn: str) -> Optional[Book]:
     """Get a specific book by ISBN."""
-    conn = get_db_connection()
-    book = conn.execute('SELECT * FROM books WHERE isbn = ?', (isbn,)).fetchone()
-    conn.close()
-    return dict(book) if book else None
+    book_id = _isbn_ids.get(isbn)
+    book = _book_cache.get(book_id) if book_id is not None else None
+    if book is not None:
+        return book.copy()
+    return _load_book('isbn', isbn)
 
-def get_patron_borrowed_books(patron_id: str) -> List[Dict]:
+def get_patron_borrowed_books(patron_id: str) -> List[Loan]:
     """Get currently borrowed books for a patron."""
-    conn = get_db_connection()
-    records = conn.execute('''
-        SELECT br.*, b.title, b.author 
-        FROM borrow_records br 
-        JOIN books b ON br.book_id = b.id 
-        WHERE br.patron_id = ? AND br.return_date IS NULL
-        ORDER BY br.borrow_date
-    ''', (patron_id,)).fetchall()
-    conn.close()
-    
-    borrowed_books = []
-    for record in records:
-        borrowed_books.append({
-            'book_id': record['book_id'],
-            'title': record['title'],
-            'author': record['author'],
-            'borrow_date': datetime.fromisoformat(record['borrow_date']),
-            'due_date': datetime.fromisoformat(record['due_date']),
-            'is_overdue': datetime.now() > datetime.fromisoformat(record['due_date'])
-        })
-    
-    return borrowed_books
+    with connection() as conn:
+        return _fetch_records(conn, Loan, f'''
+            SELECT {_LOAN_SELECT}, br.due_date < ? AS is_overdue 
+            FROM borrow_records br 
+            JOIN books b ON br.book_id = b.id 
+            WHERE br.patron_id = ? AND br.return_date IS NULL
+            ORDER BY br.borrow_date
+        ''', (to_epoch(datetime.now()), patron_id))
 
 def get_patron_borrow_count(patron_id: str) -> int:
     """Get the number of books currently borrowed by a patron."""
-    conn = get_db_connection()
-    count = conn.execute('''
-        SELECT COUNT(*) as count FROM borrow_records 
-        WHERE patron_id = ? AND return_date IS NULL
-    ''', (patron_id,)).fetchone()['count']
-    conn.close()
-    return count
+    with connection() as conn:
+        return _count_active_loans(conn, patron_id)
+
+def rebuild_patron_loan_counts() -> int:
+    """
+    Recompute every patron's active loan counter from borrow_records, e.g. after
+    borrow records were edited outside the application.
+
+    Returns:
+        int: Number of patrons with at least one active loan
+    """
+    with transaction(immediate=True) as conn:
+        _rebuild_active_loans(conn)
+        return conn.execute('SELECT COUNT(*) FROM patrons WHERE active_loans > 0').fetchone()[0]
 
 def insert_book(title: str, author: str, isbn: str, total_copies: int, available_copies: int) -> bool:
     """Insert a new book into the database."""
-    conn = get_db_connection()
-    try:
-        conn.execute('''
-            INSERT INTO books (title, author, isbn, total_copies, available_copies)
+    with connection() as conn:
+        try:
+            cursor = conn.execute('''
+                INSERT INTO books (title, author, isbn, total_copies, available_copies)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (title, author, isbn, total_copies, available_copies))
+            invalidate_book_cache(cursor.lastrowid)
+            return True
+        except Exception as e:
+            return False
+
+def insert_dataset_batch(books: List[Tuple] = (), loans: List[Tuple] = (), ledger_entries: List[Tuple] = ()):
+    """
+    Insert one batch of a generated dataset in one transaction, with ids chosen by the generator.
+    Counters derived from the rows (available copies, patron totals) are set by finish_dataset.
+
+    Args:
+        books: (id, title, author, isbn, total_copies) tuples
+        loans: (id, patron_id, book_id, borrow_date, due_date, return_date, late_fee) tuples, dates as epoch seconds
+        ledger_entries: (patron_id, book_id, borrow_record_id, entry_type, amount, transaction_id, created_at) tuples
+    """
+    with transaction(immediate=True) as conn:
+        conn.executemany('''
+            INSERT INTO books (id, title, author, isbn, total_copies, available_copies) VALUES (?, ?, ?, ?, ?, ?)
+        ''', (book + (book[4],) for book in books))
+        conn.executemany('''
+            INSERT INTO borrow_records (id, patron_id, book_id, borrow_date, due_date, return_date, late_fee)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', loans)
+        conn.executemany('''
+            INSERT INTO fee_ledger (patron_id, book_id, borrow_record_id, entry_type, amount, transaction_id, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', ledger_entries)
+
+def finish_dataset(patrons: List[Tuple[str, float, int]], checked_out: List[Tuple[int, int]]):
+    """
+    Set the maintained counters for a generated dataset and refresh planner statistics.
+
+    Args:
+        patrons: (patron_id, outstanding_fees, active_loans) tuples
+        checked_out: (book_id, copies on active loans) tuples for books with copies out
+    """
+    with transaction(immediate=True) as conn:
+        conn.executemany('''
+            INSERT INTO patrons (patron_id, outstanding_fees, active_loans) VALUES (?, ?, ?)
+            ON CONFLICT (patron_id) DO UPDATE 
+            SET outstanding_fees = excluded.outstanding_fees, active_loans = excluded.active_loans
+        ''', patrons)
+        conn.executemany('''
+            UPDATE books SET available_copies = total_copies - ? WHERE id = ?
+        ''', ((copies, book_id) for book_id, copies in checked_out))
+    with connection() as conn:
+        conn.execute('ANALYZE')  # Full statistics; the planner's choices at scale are what benchmarks measure.
+    invalidate_book_cache()
+
+def get_active_loan_keys(limit: Optional[int] = None) -> List[Tuple[str, int]]:
+    """Get (patron_id, book_id) of active loans, oldest first, e.g. to pick realistic benchmark arguments."""
+    with connection() as conn:
+        rows = conn.execute('''
+            SELECT patron_id, book_id FROM borrow_records WHERE return_date IS NULL ORDER BY id LIMIT ?
+        ''', (-1 if limit is None else limit,)).fetchall()
+    return [(row['patron_id'], row['book_id']) for row in rows]
+
+def count_rows(table: str) -> int:
+    """Count the rows in one of the library's tables."""
+    if table not in ('books', 'borrow_records', 'patrons', 'fee_ledger'):
+        raise ValueError(f"Unknown table {table!r}.")
+    with connection() as conn:
+        return conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+def insert_books_bulk(books: List[Tuple[str, str, str, int]]) -> List[int]:
+    """
+    Insert many already-validated books in one transaction with executemany.
+    Books whose ISBN is already in the catalog (or earlier in the same batch) are skipped.
+
+    Args:
+        books: (title, author, isbn, total_copies) tuples
+
+    Returns:
+        list: Positions in books that were skipped as duplicate ISBNs
+    """
+    with transaction(immediate=True) as conn:
+        # One query for the whole batch, the ISBNs are passed as a single JSON array.
+        existing = {row['isbn'] for row in conn.execute('''
+            SELECT isbn FROM books WHERE isbn IN (SELECT value FROM json_each(?))
+        ''', (json.dumps([book[2] for book in books]),))}
+
+        skipped, rows = [], []
+        for position, (title, author, isbn, total_copies) in enumerate(books):
+            if isbn in existing:
+                skipped.append(position)
+                continue
+            existing.add(isbn)
+            rows.append((title, author, isbn, total_copies, total_copies))
+
+        # OR IGNORE leaves the ISBN UNIQUE constraint as the final guard against duplicates.
+        conn.executemany('''
+            INSERT OR IGNORE INTO books (title, author, isbn, total_copies, available_copies)
             VALUES (?, ?, ?, ?, ?)
-        ''', (title, author, isbn, total_copies, available_copies))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        conn.close()
-        return False
+        ''', rows)
+    return skipped
 
 def insert_borrow_record(patron_id: str, book_id: int, borrow_date: datetime, due_date: datetime) -> bool:
     """Insert a new borrow record into the database."""
-    conn = get_db_connection()
     try:
-        conn.execute('''
-            INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
-            VALUES (?, ?, ?, ?)
-        ''', (patron_id, book_id, borrow_date.isoformat(), due_date.isoformat()))
-        conn.commit()
-        conn.close()
+        with transaction() as conn:
+            conn.execute('''
+                INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
+                VALUES (?, ?, ?, ?)
+            ''', (patron_id, book_id, to_epoch(borrow_date), to_epoch(due_date)))
+            _adjust_active_loans(conn, patron_id, 1)
         return True
     except Exception as e:
-        conn.close()
         return False
 
 def update_book_availability(book_id: int, change: int) -> bool:
     """Update the available copies of a book by a given amount (+1 for return, -1 for borrow)."""
-    conn = get_db_connection()
+    with connection() as conn:
+        try:
+            conn.execute('''
+                UPDATE books SET available_copies = available_copies + ? WHERE id = ?
+            ''', (change, book_id))
+            invalidate_book_cache(book_id)
+            return True
+        except Exception as e:
+            return False
+
+def update_borrow_record_return_date(patron_id: str, book_id: int, return_date: datetime) -> bool:
+    """Update the return date for a borrow record."""
     try:
-        conn.execute('''
-            UPDATE books SET available_copies = available_copies + ? WHERE id = ?
-        ''', (change, book_id))
-        conn.commit()
-        conn.close()
+        with transaction() as conn:
+            returned = conn.execute('''
+                UPDATE borrow_records 
+                SET return_date = ? 
+                WHERE patron_id = ? AND book_id = ? AND return_date IS NULL
+            ''', (to_epoch(return_date), patron_id, book_id)).rowcount
+            _adjust_active_loans(conn, patron_id, -returned)
         return True
     except Exception as e:
-        conn.close()
         return False
 
-def update_borrow_record_return_date(patron_id: str, book_id: int, return_date: datetime) -> bool:
-    """Update the return date for a borrow record."""
-    conn = get_db_connection()
-    try:
+def _count_active_loans(conn: sqlite3.Connection, patron_id: str) -> int:
+    """Get a patron's active loan counter on an open connection."""
+    row = conn.execute('SELECT active_loans FROM patrons WHERE patron_id = ?', (patron_id,)).fetchone()
+    return row['active_loans'] if row else 0
+
+def _adjust_active_loans(conn: sqlite3.Connection, patron_id: str, change: int):
+    """Add change to a patron's active loan counter, inside the transaction that borrows or returns."""
+    if change:
         conn.execute('''
-            UPDATE borrow_records 
-            SET return_date = ? 
+            INSERT INTO patrons (patron_id, active_loans) VALUES (?, ?)
+            ON CONFLICT (patron_id) DO UPDATE SET active_loans = active_loans + excluded.active_loans
+        ''', (patron_id, change))
+
+def _borrow_in_transaction(conn: sqlite3.Connection, patron_id: str, book_id: int, borrow_date: datetime,
+                           due_date: datetime, at_limit: bool) -> Tuple[str, Optional[Book]]:
+    """Borrow one book inside an already open write transaction."""
+    books = _fetch_records(conn, Book, f'SELECT {_BOOK_SELECT} FROM books b WHERE b.id = ?', (book_id,))
+    if not books:
+        return 'not_found', None
+    book = books[0]
+
+    if book['available_copies'] <= 0:
+        return 'unavailable', book
+
+    if at_limit:
+        return 'limit_reached', book
+
+    # Guarded decrement, never lets available_copies go below zero.
+    updated = conn.execute('''
+        UPDATE books SET available_copies = available_copies - 1 
+        WHERE id = ? AND available_copies > 0
+    ''', (book_id,)).rowcount
+    if updated == 0:
+        return 'unavailable', book
+
+    conn.execute('''
+        INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
+        VALUES (?, ?, ?, ?)
+    ''', (patron_id, book_id, to_epoch(borrow_date), to_epoch(due_date)))
+    _adjust_active_loans(conn, patron_id, 1)
+    book['available_copies'] -= 1
+    return 'borrowed', book
+
+def borrow_books_transaction(patron_id: str, book_ids: List[int], borrow_date: datetime, due_date: datetime,
+                             max_borrowed: int) -> List[Tuple[str, Optional[Book]]]:
+    """
+    Borrow several books for one patron in a single write transaction. The patron's
+    active loans are counted once; books past the limit are refused individually.
+
+    Args:
+        patron_id: 6-digit library card ID
+        book_ids: IDs of the books to borrow, processed in order
+        borrow_date: Date the books are borrowed
+        due_date: Date the books are due back
+        max_borrowed: Maximum number of books a patron may have out at once
+
+    Returns:
+        list: One (status: str, book: Optional[Book]) per book ID where status is one of
+        'borrowed', 'not_found', 'unavailable', 'limit_reached' or 'error'
+    """
+    try:
+        with transaction(immediate=True) as conn:  # Write lock up front, so no other borrow can interleave.
+            count = _count_active_loans(conn, patron_id)
+            results = []
+            for book_id in book_ids:
+                status, book = _borrow_in_transaction(conn, patron_id, book_id, borrow_date, due_date,
+                                                      count >= max_borrowed)
+                if status == 'borrowed':
+                    count += 1
+                results.append((status, book))
+    except sqlite3.Error:
+        return [('error', None)] * len(book_ids)  # Rolled back, nothing was borrowed.
+
+    for book_id, (status, _) in zip(book_ids, results):
+        if status == 'borrowed':
+            invalidate_book_cache(book_id)
+    return results
+
+def borrow_book_transaction(patron_id: str, book_id: int, borrow_date: datetime, due_date: datetime,
+                            max_borrowed: int) -> Tuple[str, Optional[Book]]:
+    """
+    Borrow a book in a single write transaction: availability check, borrow limit check,
+    guarded decrement and borrow record insert either all happen or none do.
+
+    Args:
+        patron_id: 6-digit library card ID
+        book_id: ID of the book to borrow
+        borrow_date: Date the book is borrowed
+        due_date: Date the book is due back
+        max_borrowed: Maximum number of books a patron may have out at once
+
+    Returns:
+        tuple: (status: str, book: Optional[Book]) where status is one of
+        'borrowed', 'not_found', 'unavailable', 'limit_reached' or 'error'
+    """
+    return borrow_books_transaction(patron_id, [book_id], borrow_date, due_date, max_borrowed)[0]
+
+# Fee ledger: 'assessed' entries add to what a patron owes and 'paid' entries take it away.
+# A 'refunded' entry reverses a payment charged in error: the money goes back and the fee it
+# paid is waived, so it leaves the outstanding balance unchanged.
+_BALANCE_EFFECT = {'assessed': 1, 'paid': -1, 'refunded': 0}
+
+def _add_ledger_entry(conn: sqlite3.Connection, patron_id: str, book_id: int, borrow_record_id: Optional[int],
+                      entry_type: str, amount: float, transaction_id: Optional[str] = None):
+    """Append a fee ledger entry and apply it to the patron's outstanding balance, inside an open transaction."""
+    amount = round(amount, 2)
+    if amount <= 0:
+        return
+    conn.execute('''
+        INSERT INTO fee_ledger (patron_id, book_id, borrow_record_id, entry_type, amount, transaction_id, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (patron_id, book_id, borrow_record_id, entry_type, amount, transaction_id, datetime.now().isoformat()))
+    conn.execute('''
+        INSERT INTO patrons (patron_id, outstanding_fees) VALUES (?, ?)
+        ON CONFLICT (patron_id) DO UPDATE SET outstanding_fees = ROUND(outstanding_fees + excluded.outstanding_fees, 2)
+    ''', (patron_id, _BALANCE_EFFECT[entry_type] * amount))
+
+def _assess_loan_fee(conn: sqlite3.Connection, patron_id: str, book_id: int, borrow_record_id: Optional[int],
+                     fee_to_date: float):
+    """
+    Bring the fee assessed on a loan up to fee_to_date. Only the difference from what was
+    already assessed is added, so a loan's fee is never charged twice.
+    """
+    assessed = 0.0
+    if borrow_record_id is not None:
+        assessed = conn.execute('''
+            SELECT COALESCE(SUM(amount), 0) FROM fee_ledger 
+            WHERE borrow_record_id = ? AND entry_type = 'assessed'
+        ''', (borrow_record_id,)).fetchone()[0]
+    _add_ledger_entry(conn, patron_id, book_id, borrow_record_id, 'assessed', fee_to_date - assessed)
+
+def _return_in_transaction(conn: sqlite3.Connection, patron_id: str, book_id: int, return_date: datetime,
+                           assess_late_fee: Callable[[datetime, datetime], Dict]) -> Tuple[str, Optional[Dict]]:
+    """Return one book inside an already open write transaction."""
+    loan = conn.execute('''
+        SELECT id, due_date FROM borrow_records 
+        WHERE patron_id = ? AND book_id = ? AND return_date IS NULL
+        ORDER BY borrow_date, id LIMIT 1
+    ''', (patron_id, book_id)).fetchone()
+    if not loan:
+        has_loans = _count_active_loans(conn, patron_id) > 0
+        return ('not_borrowed' if has_loans else 'no_active_loans'), None
+
+    fee = assess_late_fee(from_epoch(loan['due_date']), return_date)
+    conn.execute('''
+        UPDATE borrow_records SET return_date = ?, late_fee = ? WHERE id = ?
+    ''', (to_epoch(return_date), fee['fee_amount'], loan['id']))
+    _assess_loan_fee(conn, patron_id, book_id, loan['id'], fee['fee_amount'])
+    conn.execute('''
+        UPDATE books SET available_copies = available_copies + 1 WHERE id = ?
+    ''', (book_id,))
+    _adjust_active_loans(conn, patron_id, -1)
+    return 'returned', fee
+
+def return_books_transaction(patron_id: str, book_ids: List[int], return_date: datetime,
+                             assess_late_fee: Callable[[datetime, datetime], Dict]) -> List[Tuple[str, Optional[Dict]]]:
+    """
+    Return several books for one patron in a single write transaction.
+
+    Args:
+        patron_id: 6-digit library card ID
+        book_ids: IDs of the books being returned, processed in order
+        return_date: Date the books are returned
+        assess_late_fee: Called as assess_late_fee(due_date, return_date), returns a dict with 'fee_amount'
+
+    Returns:
+        list: One (status: str, fee: Optional[Dict]) per book ID where status is one of
+        'returned', 'no_active_loans', 'not_borrowed' or 'error'
+    """
+    try:
+        with transaction(immediate=True) as conn:
+            results = [_return_in_transaction(conn, patron_id, book_id, return_date, assess_late_fee)
+                       for book_id in book_ids]
+    except sqlite3.Error:
+        return [('error', None)] * len(book_ids)  # Rolled back, nothing was returned.
+
+    for book_id, (status, _) in zip(book_ids, results):
+        if status == 'returned':
+            invalidate_book_cache(book_id)
+    return results
+
+def return_book_transaction(patron_id: str, book_id: int, return_date: datetime,
+                            assess_late_fee: Callable[[datetime, datetime], Dict]) -> Tuple[str, Optional[Dict]]:
+    """
+    Return a book in a single write transaction: find the patron's oldest active loan of the
+    book, stamp its return date and assessed late fee, and put the copy back on the shelf.
+
+    Args:
+        patron_id: 6-digit library card ID
+        book_id: ID of the book being returned
+        return_date: Date the book is returned
+        assess_late_fee: Called as assess_late_fee(due_date, return_date), returns a dict with 'fee_amount'
+
+    Returns:
+        tuple: (status: str, fee: Optional[Dict]) where status is one of
+        'returned', 'no_active_loans', 'not_borrowed' or 'error'
+    """
+    return return_books_transaction(patron_id, [book_id], return_date, assess_late_fee)[0]
+
+def get_patron_loans(patron_id: str, as_of: Optional[datetime] = None) -> List[Loan]:
+    """
+    Get every borrow record of a patron, active and returned, in one indexed query.
+
+    Args:
+        patron_id: 6-digit library card ID
+        as_of: Date active loans are checked against for being overdue (defaults to now)
+
+    Returns:
+        list: Loans ordered by borrow date, each with book_id, title, author, borrow_date,
+        due_date and return_date as datetimes. Books still out are Loans with is_overdue (past
+        due as_of); returned ones are ReturnedLoans with was_overdue (returned after the due date).
+    """
+    with connection() as conn:
+        return _fetch_records(conn, Loan, f'''
+            SELECT {_LOAN_SELECT}, COALESCE(br.return_date, ?) > br.due_date AS is_overdue 
+            FROM borrow_records br 
+            JOIN books b ON br.book_id = b.id 
+            WHERE br.patron_id = ?
+            ORDER BY br.borrow_date
+        ''', (to_epoch(as_of or datetime.now()), patron_id))
+
+def get_overdue_fee_totals(as_of: datetime, first_week_rate: float, daily_rate: float, max_fee: float,
+                           patron_id: Optional[str] = None, limit: Optional[int] = None,
+                           offset: int = 0) -> Tuple[Dict, List[Dict]]:
+    """
+    Compute days overdue and capped late fees for every active overdue loan in SQL, in a single
+    set-based pass, and total them per patron. The fee formula mirrors assess_late_fee.
+
+    Args:
+        as_of: Date to measure lateness against
+        first_week_rate: Fee per day for the first 7 days overdue
+        daily_rate: Fee per day after the first 7 days
+        max_fee: Cap on the fee per loan
+        patron_id: Only include this patron's loans (None for the whole library)
+        limit: Maximum number of patrons to return (None for all)
+        offset: Number of patrons to skip
+
+    Returns:
+        tuple: (summary: dict with 'overdue_loans', 'patrons' and 'total_fees',
+        patrons: list of dict with 'patron_id', 'overdue_loans', 'max_days_overdue' and 'total_fees',
+        highest total first)
+    """
+    params = {
+        'as_of': to_epoch(as_of), 'patron_id': patron_id, 'first_week_rate': first_week_rate,
+        'daily_rate': daily_rate, 'max_fee': max_fee, 'limit': -1 if limit is None else limit, 'offset': offset
+    }
+    # Whole days overdue, floored like timedelta.days (both sides are positive whole seconds).
+    overdue_fees = '''
+        WITH overdue AS (
+            SELECT patron_id, (:as_of - due_date) / 86400 AS days
+            FROM borrow_records 
+            WHERE return_date IS NULL AND due_date < :as_of 
+              AND (:patron_id IS NULL OR patron_id = :patron_id)
+        ), fees AS (
+            SELECT patron_id, days,
+                   CASE WHEN days <= 0 THEN 0.0
+                        WHEN days <= 7 THEN days * :first_week_rate
+                        ELSE MIN(7 * :first_week_rate + (days - 7) * :daily_rate, :max_fee) END AS fee
+            FROM overdue
+        )
+    '''
+    with connection() as conn:
+        summary = conn.execute(overdue_fees + '''
+            SELECT COUNT(*) AS overdue_loans, COUNT(DISTINCT patron_id) AS patrons, 
+                   COALESCE(SUM(fee), 0.0) AS total_fees 
+            FROM fees
+        ''', params).fetchone()
+        patrons = conn.execute(overdue_fees + '''
+            SELECT patron_id, COUNT(*) AS overdue_loans, MAX(days) AS max_days_overdue, SUM(fee) AS total_fees 
+            FROM fees 
+            GROUP BY patron_id 
+            ORDER BY total_fees DESC, patron_id 
+            LIMIT :limit OFFSET :offset
+        ''', params).fetchall()
+
+    summary = dict(summary, total_fees=round(summary['total_fees'], 2))
+    return summary, [dict(row, total_fees=round(row['total_fees'], 2)) for row in patrons]
+
+def get_book_fee_balance(patron_id: str, book_id: int) -> Dict:
+    """
+    Get what a patron's fee ledger says about one book.
+
+    Returns:
+        dict: {'outstanding': float owed on the book's ledger entries,
+        'active_loan_id': Optional[int] of the loan still out, 'assessed_on_active': float already assessed on it}
+    """
+    with connection() as conn:
+        outstanding = conn.execute('''
+            SELECT COALESCE(SUM(CASE entry_type WHEN 'assessed' THEN amount WHEN 'paid' THEN -amount ELSE 0 END), 0) 
+            FROM fee_ledger WHERE patron_id = ? AND book_id = ?
+        ''', (patron_id, book_id)).fetchone()[0]
+        loan = conn.execute('''
+            SELECT id FROM borrow_records 
             WHERE patron_id = ? AND book_id = ? AND return_date IS NULL
-        ''', (return_date.isoformat(), patron_id, book_id))
-        conn.commit()
-        conn.close()
+            ORDER BY borrow_date, id LIMIT 1
+        ''', (patron_id, book_id)).fetchone()
+        assessed_on_active = 0.0
+        if loan:
+            assessed_on_active = conn.execute('''
+                SELECT COALESCE(SUM(amount), 0) FROM fee_ledger 
+                WHERE borrow_record_id = ? AND entry_type = 'assessed'
+            ''', (loan['id'],)).fetchone()[0]
+    return {
+        'outstanding': round(outstanding, 2),
+        'active_loan_id': loan['id'] if loan else None,
+        'assessed_on_active': round(assessed_on_active, 2)
+    }
+
+def record_fee_payment(patron_id: str, book_id: int, accrued_fee: float, amount: float, transaction_id: str) -> bool:
+    """
+    Record a successful late fee payment in the ledger, in one transaction. The fee accrued so far
+    on the book's active loan (if any) is assessed first, so the payment has something to settle.
+
+    Args:
+        patron_id: 6-digit library card ID
+        book_id: ID of the book the fees were for
+        accrued_fee: Late fee accrued to date on the active loan (0 if returned)
+        amount: Amount charged
+        transaction_id: Payment gateway transaction ID
+
+    Returns:
+        bool: True if recorded
+    """
+    try:
+        with transaction(immediate=True) as conn:
+            loan = conn.execute('''
+                SELECT id FROM borrow_records 
+                WHERE patron_id = ? AND book_id = ? AND return_date IS NULL
+                ORDER BY borrow_date, id LIMIT 1
+            ''', (patron_id, book_id)).fetchone()
+            _assess_loan_fee(conn, patron_id, book_id, loan['id'] if loan else None, accrued_fee)
+            _add_ledger_entry(conn, patron_id, book_id, loan['id'] if loan else None, 'paid', amount, transaction_id)
         return True
-    except Exception as e:
-        conn.close()
+    except sqlite3.Error:
+        return False
+
+def get_unpaid_fee_sources(patron_id: str, as_of: datetime) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Get everything a patron could owe late fees on, for paying them all at once.
+
+    Args:
+        patron_id: 6-digit library card ID
+        as_of: Date active loans are checked against for being overdue
+
+    Returns:
+        tuple: (balances: list of dict with 'book_id', 'title' and 'outstanding' for books with unpaid
+        ledger entries, overdue_loans: list of dict with 'loan_id', 'book_id', 'title', 'due_date' (datetime)
+        and 'assessed' (fee already in the ledger) for loans still out past their due date)
+    """
+    with connection() as conn:
+        balances = conn.execute('''
+            SELECT l.book_id, b.title, 
+                   ROUND(SUM(CASE l.entry_type WHEN 'assessed' THEN l.amount WHEN 'paid' THEN -l.amount ELSE 0 END), 2) AS outstanding 
+            FROM fee_ledger l JOIN books b ON b.id = l.book_id 
+            WHERE l.patron_id = ? 
+            GROUP BY l.book_id HAVING outstanding > 0 
+            ORDER BY l.book_id
+        ''', (patron_id,)).fetchall()
+        overdue_loans = conn.execute('''
+            SELECT br.id AS loan_id, br.book_id, b.title, br.due_date, 
+                   (SELECT COALESCE(SUM(l.amount), 0) FROM fee_ledger l 
+                    WHERE l.borrow_record_id = br.id AND l.entry_type = 'assessed') AS assessed 
+            FROM borrow_records br JOIN books b ON b.id = br.book_id 
+            WHERE br.patron_id = ? AND br.return_date IS NULL AND br.due_date < ? 
+            ORDER BY br.borrow_date, br.id
+        ''', (patron_id, to_epoch(as_of))).fetchall()
+    return ([dict(row) for row in balances],
+            [dict(row, due_date=from_epoch(row['due_date'])) for row in overdue_loans])
+
+def record_fee_payment_allocations(patron_id: str, loan_fees: List[Tuple[int, int, float]],
+                                   allocations: List[Tuple[int, Optional[int], float]], transaction_id: str) -> bool:
+    """
+    Record one gateway charge that paid the fees of several books, in one transaction.
+
+    Args:
+        patron_id: 6-digit library card ID
+        loan_fees: (loan_id, book_id, fee_to_date) for active loans whose accrued fee is assessed first
+        allocations: (book_id, loan_id or None, amount) share of the charge paid against each book
+        transaction_id: Payment gateway transaction ID
+
+    Returns:
+        bool: True if recorded
+    """
+    try:
+        with transaction(immediate=True) as conn:
+            for loan_id, book_id, fee_to_date in loan_fees:
+                _assess_loan_fee(conn, patron_id, book_id, loan_id, fee_to_date)
+            for book_id, loan_id, amount in allocations:
+                _add_ledger_entry(conn, patron_id, book_id, loan_id, 'paid', amount, transaction_id)
+        return True
+    except sqlite3.Error:
+        return False
+
+def get_fee_payment(transaction_id: str) -> Optional[Dict]:
+    """
+    Get a recorded fee payment by gateway transaction ID. A payment can cover several books.
+
+    Returns:
+        dict: {'patron_id', 'amount', 'refunded'}, or None if not in the ledger
+    """
+    with connection() as conn:
+        payment = conn.execute('''
+            SELECT patron_id, SUM(amount) AS amount FROM fee_ledger 
+            WHERE transaction_id = ? AND entry_type = 'paid' 
+            GROUP BY patron_id
+        ''', (transaction_id,)).fetchone()
+        if not payment:
+            return None
+        refunded = conn.execute('''
+            SELECT COALESCE(SUM(amount), 0) FROM fee_ledger 
+            WHERE transaction_id = ? AND entry_type = 'refunded'
+        ''', (transaction_id,)).fetchone()[0]
+    return dict(payment, amount=round(payment['amount'], 2), refunded=round(refunded, 2))
+
+def record_fee_refund(transaction_id: str, amount: float) -> bool:
+    """
+    Record a refund of a fee payment in the ledger, against the payment's first book.
+
+    Returns:
+        bool: True if recorded, False if the payment isn't in the ledger or the write failed
+    """
+    try:
+        with transaction(immediate=True) as conn:
+            payment = conn.execute('''
+                SELECT patron_id, book_id, borrow_record_id FROM fee_ledger 
+                WHERE transaction_id = ? AND entry_type = 'paid' 
+                ORDER BY id LIMIT 1
+            ''', (transaction_id,)).fetchone()
+            if not payment:
+                return False
+            _add_ledger_entry(conn, payment['patron_id'], payment['book_id'], payment['borrow_record_id'],
+                              'refunded', amount, transaction_id)
+        return True
+    except sqlite3.Error:
         return False
 
+def get_patron_balance(patron_id: str) -> float:
+    """Get a patron's outstanding late fee balance from the maintained total (no ledger scan)."""
+    with connection() as conn:
+        row = conn.execute('SELECT outstanding_fees FROM patrons WHERE patron_id = ?', (patron_id,)).fetchone()
+    return round(row['outstanding_fees'], 2) if row else 0.0
+
+def get_patron_assessed_fees(patron_id: str) -> Tuple[float, Dict[int, float]]:
+    """
+    Get a patron's outstanding balance from the maintained total, and the fees already assessed in
+    the ledger on each book still out, so callers can add only what those loans accrued since.
+
+    Returns:
+        tuple: (outstanding: float, assessed: dict of book_id -> fee assessed on its active loan)
+    """
+    with connection() as conn:
+        row = conn.execute('SELECT outstanding_fees FROM patrons WHERE patron_id = ?', (patron_id,)).fetchone()
+        assessed = conn.execute('''
+            SELECT br.book_id, SUM(l.amount) AS assessed 
+            FROM borrow_records br JOIN fee_ledger l ON l.borrow_record_id = br.id AND l.entry_type = 'assessed' 
+            WHERE br.patron_id = ? AND br.return_date IS NULL 
+            GROUP BY br.book_id
+        ''', (patron_id,)).fetchall()
+    return (round(row['outstanding_fees'], 2) if row else 0.0,
+            {loan['book_id']: round(loan['assessed'], 2) for loan in assessed})
+
+def get_fee_ledger(patron_id: str) -> List[Dict]:
+    """Get a patron's fee ledger entries, oldest first."""
+    with connection() as conn:
+        entries = conn.execute('''
+            SELECT id, book_id, borrow_record_id, entry_type, amount, transaction_id, created_at 
+            FROM fee_ledger WHERE patron_id = ? ORDER BY id
+        ''', (patron_id,)).fetchall()
+    return [dict(entry) for entry in entries]
+
+def insert_payment_job(job_type: str, patron_id: Optional[str] = None, book_id: Optional[int] = None,
+                       transaction_id: Optional[str] = None, amount: Optional[float] = None,
+                       idempotency_key: Optional[str] = None) -> int:
+    """
+    Queue a payment or refund job.
+
+    Args:
+        job_type: "payment" (patron_id and book_id) or "refund" (transaction_id and amount)
+        idempotency_key: Client-supplied key; a job already queued with it for the same request is returned instead
+
+    Returns:
+        int: ID of the queued job
+
+    Raises:
+        ValueError: If the key was already used for a job with different fields
+        sqlite3.IntegrityError: If the job is invalid, e.g. an unknown job_type
+    """
+    now = datetime.now().isoformat()
+    request = (job_type, patron_id, book_id, transaction_id, amount)
+    with transaction(immediate=True) as conn:
+        # Only a reused key is skipped; other constraint violations (e.g. job_type) still raise.
+        cursor = conn.execute('''
+            INSERT INTO payment_jobs 
+                (job_type, patron_id, book_id, transaction_id, amount, idempotency_key, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (idempotency_key) DO NOTHING
+        ''', request + (idempotency_key, now, now))
+        if cursor.rowcount:
+            return cursor.lastrowid
+        job = conn.execute('''
+            SELECT id, job_type, patron_id, book_id, transaction_id, amount FROM payment_jobs WHERE idempotency_key = ?
+        ''', (idempotency_key,)).fetchone()
+    if tuple(job)[1:] != request:
+        raise ValueError("Idempotency key was already used for a different request.")
+    return job['id']
+
+def claim_payment_job() -> Optional[Dict]:
+    """
+    Take the oldest queued job and mark it running, atomically, so each job is handed to one worker.
+
+    Returns:
+        dict: The claimed job, or None if nothing is queued
+    """
+    with transaction(immediate=True) as conn:
+        job = conn.execute('''
+            SELECT * FROM payment_jobs WHERE status = 'queued' ORDER BY id LIMIT 1
+        ''').fetchone()
+        if not job:
+            return None
+        now = datetime.now().isoformat()
+        conn.execute('''
+            UPDATE payment_jobs SET status = 'running', updated_at = ? WHERE id = ?
+        ''', (now, job['id']))
+    return dict(job, status='running', updated_at=now)
+
+def finish_payment_job(job_id: int, succeeded: bool, message: str, result_transaction_id: Optional[str] = None):
+    """Record the outcome of a running job."""
+    with connection() as conn:
+        conn.execute('''
+            UPDATE payment_jobs SET status = ?, message = ?, result_transaction_id = ?, updated_at = ? 
+            WHERE id = ?
+        ''', ('succeeded' if succeeded else 'failed', message, result_transaction_id,
+              datetime.now().isoformat(), job_id))
+
+def recover_stale_payment_jobs(older_than: datetime) -> Tuple[int, int]:
+    """
+    Recover jobs still marked running since before older_than, left by a worker that crashed or was killed.
+    Jobs with an idempotency key are queued again: their stored payment request stops a second charge.
+    Jobs without one are failed, as the gateway may or may not have taken the payment.
+
+    Payment requests still pending since before older_than were claimed by a process that died
+    before storing the outcome, so it's unknown whether the gateway processed them. They are
+    marked unknown, which stops a second charge (or refund) until they are settled, rather than
+    leaving their key pending, which would answer every retry with "still being processed".
+
+    Returns:
+        tuple: (requeued: int, failed: int)
+    """
+    cutoff, now = older_than.isoformat(), datetime.now().isoformat()
+    with transaction(immediate=True) as conn:
+        conn.execute('''
+            UPDATE payments SET status = 'unknown', updated_at = ?, 
+                message = 'Interrupted before the outcome was recorded. It must be settled before another charge or refund is made.' 
+            WHERE status = 'pending' AND updated_at < ?
+        ''', (now, cutoff))
+        requeued = conn.execute('''
+            UPDATE payment_jobs SET status = 'queued', updated_at = ? 
+            WHERE status = 'running' AND updated_at < ? AND idempotency_key IS NOT NULL
+        ''', (now, cutoff)).rowcount
+        failed = conn.execute('''
+            UPDATE payment_jobs SET status = 'failed', updated_at = ?, 
+                message = 'Interrupted before the outcome was recorded. Check the payment before trying again.' 
+            WHERE status = 'running' AND updated_at < ?
+        ''', (now, cutoff)).rowcount
+    return requeued, failed
+
+def get_payment_job(job_id: int) -> Optional[Dict]:
+    """Get a payment job by ID."""
+    with connection() as conn:
+        job = conn.execute('SELECT * FROM payment_jobs WHERE id = ?', (job_id,)).fetchone()
+    return dict(job) if job else None
+
+def begin_payment_request(idempotency_key: str, request_type: str, patron_id: Optional[str] = None,
+                          book_id: Optional[int] = None, transaction_id: Optional[str] = None,
+                          amount: Optional[float] = None) -> Optional[Dict]:
+    """
+    Claim an idempotency key for a payment or refund request, as pending.
+
+    Args:
+        idempotency_key: Client-supplied key identifying the request across retries
+        request_type: "payment" (patron_id, book_id None for all books) or "refund" (transaction_id, amount)
+
+    Returns:
+        dict: The request already stored under the key, or None if the key was free and is now claimed
+    """
+    now = datetime.now().isoformat()
+    with transaction(immediate=True) as conn:
+        cursor = conn.execute('''
+            INSERT OR IGNORE INTO payments 
+                (idempotency_key, request_type, patron_id, book_id, transaction_id, amount, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (idempotency_key, request_type, patron_id, book_id, transaction_id, amount, now, now))
+        if cursor.rowcount:
+            return None
+        payment = conn.execute('SELECT * FROM payments WHERE idempotency_key = ?', (idempotency_key,)).fetchone()
+    return _payment_from_row(payment)
+
+def finish_payment_request(idempotency_key: str, succeeded: bool, message: str,
+                           result_transaction_id: Optional[str] = None, amount: Optional[float] = None,
+                           items: Optional[List[Dict]] = None):
+    """
+    Store the outcome of a claimed payment or refund request, so retries get the same answer.
+
+    Args:
+        idempotency_key: Key the request was claimed with
+        succeeded: Whether the gateway call succeeded
+        message: Message returned to the client
+        result_transaction_id: Gateway transaction ID of a payment
+        amount: Amount charged (payments; refunds keep the amount requested)
+        items: Per-book breakdown of a payment of all fees
+    """
+    with connection() as conn:
+        conn.execute('''
+            UPDATE payments 
+            SET status = ?, message = ?, result_transaction_id = ?, amount = COALESCE(?, amount), items = ?, updated_at = ? 
+            WHERE idempotency_key = ?
+        ''', ('succeeded' if succeeded else 'failed', message, result_transaction_id, amount,
+              json.dumps(items) if items is not None else None, datetime.now().isoformat(), idempotency_key))
+
+def mark_payment_request_unknown(idempotency_key: str, message: str):
+    """
+    Store that a claimed request's outcome is unknown: the gateway call failed in a way that
+    doesn't say whether it was processed (e.g. a timeout). It stays unknown until settled.
+    """
+    with connection() as conn:
+        conn.execute('''
+            UPDATE payments SET status = 'unknown', message = ?, updated_at = ? 
+            WHERE idempotency_key = ? AND status = 'pending'
+        ''', (message, datetime.now().isoformat(), idempotency_key))
+
+def get_unsettled_payment_requests(patron_id: Optional[str] = None, transaction_id: Optional[str] = None) -> List[Dict]:
+    """
+    Get requests whose outcome is unknown, oldest first: a patron's payments, refunds of a
+    transaction, or every one if neither is given.
+    """
+    with connection() as conn:
+        payments = conn.execute('''
+            SELECT * FROM payments 
+            WHERE status = 'unknown' AND (? IS NULL OR patron_id = ?) AND (? IS NULL OR transaction_id = ?) 
+            ORDER BY created_at
+        ''', (patron_id, patron_id, transaction_id, transaction_id)).fetchall()
+    return [_payment_from_row(payment) for payment in payments]
+
+def release_payment_request(idempotency_key: str):
+    """Drop a pending request that ended without a result (e.g. an unexpected error), so it can be retried."""
+    with connection() as conn:
+        conn.execute("DELETE FROM payments WHERE idempotency_key = ? AND status = 'pending'", (idempotency_key,))
+
+def get_payment_request(idempotency_key: str) -> Optional[Dict]:
+    """Get a payment or refund request by idempotency key."""
+    with connection() as conn:
+        payment = conn.execute('SELECT * FROM payments WHERE idempotency_key = ?', (idempotency_key,)).fetchone()
+    return _payment_from_row(payment)
+
+def _payment_from_row(payment: Optional[sqlite3.Row]) -> Optional[Dict]:
+    if not payment:
+        return None
+    payment = dict(payment)
+    payment['items'] = json.loads(payment['items']) if payment['items'] else None
+    return payment
+
+def get_local_payment_status(transaction_id: str) -> Optional[Dict]:
+    """
+    Get a payment's status from what was recorded here, in the shape the gateway's
+    verify_payment_status returns. The fee ledger is used if it has the payment, otherwise the
+    payments table (a charge made but not recorded in the ledger).
+
+    Returns:
+        dict: {'transaction_id', 'status', 'amount', 'refunded', 'patron_id', 'timestamp'},
+        or None if the transaction isn't recorded here
+    """
+    with connection() as conn:
+        status = conn.execute('''
+            SELECT patron_id, ROUND(SUM(CASE entry_type WHEN 'paid' THEN amount ELSE 0 END), 2) AS amount, 
+                   ROUND(SUM(CASE entry_type WHEN 'refunded' THEN amount ELSE 0 END), 2) AS refunded, 
+                   MIN(created_at) AS timestamp 
+            FROM fee_ledger WHERE transaction_id = ? 
+            GROUP BY patron_id HAVING SUM(entry_type = 'paid') > 0
+        ''', (transaction_id,)).fetchone()
+        if not status:
+            status = conn.execute('''
+                SELECT p.patron_id, p.amount, p.updated_at AS timestamp, 
+                       (SELECT ROUND(COALESCE(SUM(r.amount), 0), 2) FROM payments r 
+                        WHERE r.request_type = 'refund' AND r.status = 'succeeded' 
+                          AND r.transaction_id = p.result_transaction_id) AS refunded 
+                FROM payments p 
+                WHERE p.result_transaction_id = ? AND p.request_type = 'payment' AND p.status = 'succeeded'
+            ''', (transaction_id,)).fetchone()
+    if not status:
+        return None
+    return dict(status, transaction_id=transaction_id, status='completed')
+
+def start_reconciliation_run(full: bool = False) -> Tuple[Dict, bool]:
+    """
+    Resume the unfinished reconciliation run, or start a new one. A new run picks up after the
+    last payment the previous completed run checked, unless full is set.
+
+    Returns:
+        tuple: (run: dict, resumed: bool)
+    """
+    with transaction(immediate=True) as conn:
+        run = conn.execute('''
+            SELECT * FROM reconciliation_runs WHERE status = 'running' ORDER BY id DESC LIMIT 1
+        ''').fetchone()
+        if run:
+            return dict(run), True
+        start_after = 0
+        if not full:
+            start_after = conn.execute('''
+                SELECT COALESCE(MAX(checkpoint), 0) FROM reconciliation_runs WHERE status = 'completed'
+            ''').fetchone()[0]
+        run_id = conn.execute('''
+            INSERT INTO reconciliation_runs (start_after, checkpoint, started_at) VALUES (?, ?, ?)
+        ''', (start_after, start_after, datetime.now().isoformat())).lastrowid
+        run = conn.execute('SELECT * FROM reconciliation_runs WHERE id = ?', (run_id,)).fetchone()
+    return dict(run), False
+
+def get_recorded_payments(after: int, limit: int) -> List[Dict]:
+    """
+    Get recorded gateway payments in the order they were made, one per transaction ID,
+    with the total paid and refunded under it.
+
+    Args:
+        after: Only payments first recorded after this fee_ledger id (a run's checkpoint)
+        limit: Maximum number of payments
+
+    Returns:
+        list: dicts with 'ledger_id' (the checkpoint to store once checked), 'transaction_id',
+        'patron_id', 'amount' and 'refunded'
+    """
+    with connection() as conn:
+        payments = conn.execute('''
+            SELECT p.id AS ledger_id, p.transaction_id, p.patron_id, 
+                   (SELECT ROUND(SUM(t.amount), 2) FROM fee_ledger t 
+                    WHERE t.transaction_id = p.transaction_id AND t.entry_type = 'paid') AS amount, 
+                   (SELECT ROUND(COALESCE(SUM(t.amount), 0), 2) FROM fee_ledger t 
+                    WHERE t.transaction_id = p.transaction_id AND t.entry_type = 'refunded') AS refunded 
+            FROM fee_ledger p 
+            WHERE p.entry_type = 'paid' AND p.transaction_id IS NOT NULL AND p.id > ? 
+              AND NOT EXISTS (SELECT 1 FROM fee_ledger e 
+                              WHERE e.transaction_id = p.transaction_id AND e.entry_type = 'paid' AND e.id < p.id) 
+            ORDER BY p.id LIMIT ?
+        ''', (after, limit)).fetchall()
+    return [dict(payment) for payment in payments]
+
+def get_unrecorded_payments() -> List[Dict]:
+    """
+    Get charges the gateway made that are missing from the fee ledger: payment requests stored as
+    succeeded whose transaction has no 'paid' entry, because recording it failed.
+
+    Returns:
+        list: dicts with 'transaction_id', 'patron_id', 'book_id' (None for a payment of all fees),
+        'amount' and 'refunded' (by refunds stored in the payments table), oldest first
+    """
+    with connection() as conn:
+        payments = conn.execute('''
+            SELECT p.result_transaction_id AS transaction_id, p.patron_id, p.book_id, p.amount, 
+                   (SELECT ROUND(COALESCE(SUM(r.amount), 0), 2) FROM payments r 
+                    WHERE r.request_type = 'refund' AND r.status = 'succeeded' 
+                      AND r.transaction_id = p.result_transaction_id) AS refunded 
+            FROM payments p 
+            WHERE p.request_type = 'payment' AND p.status = 'succeeded' AND p.result_transaction_id IS NOT NULL 
+              AND NOT EXISTS (SELECT 1 FROM fee_ledger l 
+                              WHERE l.transaction_id = p.result_transaction_id AND l.entry_type = 'paid') 
+            ORDER BY p.created_at
+        ''').fetchall()
+    return [dict(payment) for payment in payments]
+
+def record_reconciliation_batch(run_id: int, checkpoint: int, checked: int, discrepancies: List[Dict]):
+    """
+    Store a checked batch's discrepancies and move the run's checkpoint past it, in one
+    transaction, so a resumed run neither skips nor repeats payments.
+
+    Args:
+        run_id: Reconciliation run ID
+        checkpoint: ledger_id of the last payment in the batch
+        checked: Number of payments in the batch
+        discrepancies: dicts with 'transaction_id', 'patron_id', 'kind', 'recorded_amount',
+            'gateway_amount', 'gateway_status' and 'detail'
+    """
+    now = datetime.now().isoformat()
+    with transaction(immediate=True) as conn:
+        conn.executemany('''
+            INSERT INTO payment_discrepancies 
+                (run_id, transaction_id, patron_id, kind, recorded_amount, gateway_amount, gateway_status, detail, created_at)
+            VALUES (:run_id, :transaction_id, :patron_id, :kind, :recorded_amount, :gateway_amount, :gateway_status, :detail, :created_at)
+        ''', [dict(discrepancy, run_id=run_id, created_at=now) for discrepancy in discrepancies])
+        conn.execute('''
+            UPDATE reconciliation_runs 
+            SET checkpoint = ?, checked = checked + ?, discrepancies = discrepancies + ? 
+            WHERE id = ?
+        ''', (checkpoint, checked, len(discrepancies), run_id))
+
+def finish_reconciliation_run(run_id: int) -> Dict:
+    """Mark a reconciliation run completed. Returns the finished run."""
+    with connection() as conn:
+        conn.execute('''
+            UPDATE reconciliation_runs SET status = 'completed', finished_at = ? WHERE id = ?
+        ''', (datetime.now().isoformat(), run_id))
+    return get_reconciliation_run(run_id)
+
+def get_reconciliation_run(run_id: int) -> Optional[Dict]:
+    """Get a reconciliation run with its checkpoint and counts."""
+    with connection() as conn:
+        run = conn.execute('SELECT * FROM reconciliation_runs WHERE id = ?', (run_id,)).fetchone()
+    return dict(run) if run else None
+
+def get_payment_discrepancies(run_id: Optional[int] = None) -> List[Dict]:
+    """Get discrepancies found by one reconciliation run (None for every run), oldest first."""
+    with connection() as conn:
+        discrepancies = conn.execute('''
+            SELECT * FROM payment_discrepancies WHERE ? IS NULL OR run_id = ? ORDER BY id
+        ''', (run_id, run_id)).fetchall()
+    return [dict(discrepancy) for discrepancy in discrepancies]
+
 # Implemented for A2. 
-def get_patron_borrowing_history(patron_id: str) -> List[Dict]:
+def get_patron_borrowing_history(patron_id: str) -> List[ReturnedLoan]:
     """Get borrowing history for a patron including ONLY previously returned books."""
-    conn = get_db_connection()
-    records = conn.execute('''
-        SELECT br.*, b.title, b.author 
-        FROM borrow_records br 
-        JOIN books b ON br.book_id = b.id 
-        WHERE br.patron_id = ? AND br.return_date IS NOT NULL
-        ORDER BY br.borrow_date
-    ''', (patron_id,)).fetchall()
-    conn.close()
-    
-    history = []
-    for record in records:
-        borrow_date = datetime.fromisoformat(record['borrow_date'])
-        due_date = datetime.fromisoformat(record['due_date'])
-        return_date = datetime.fromisoformat(record['return_date'])
-
-        history.append({
-            'book_id': record['book_id'],
-            'title': record['title'],
-            'author': record['author'],
-            'borrow_date': borrow_date,
-            'due_date': due_date,
-            'return_date': return_date,
-            'was_overdue': return_date > due_date
-        })
-    
-    return history
+    with connection() as conn:
+        return _fetch_records(conn, Loan, f'''
+            SELECT {_LOAN_SELECT}, br.return_date > br.due_date AS was_overdue 
+            FROM borrow_records br 
+            JOIN books b ON br.book_id = b.id 
+            WHERE br.patron_id = ? AND br.return_date IS NOT NULL
+            ORDER BY br.borrow_date
+        ''', (patron_id,))
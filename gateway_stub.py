@@ -0,0 +1,186 @@
+"""
+Stand-in payment gateway server for Library Management System
+A small local HTTP server speaking the gateway's JSON API (charges, refunds, status), so the
+HTTP gateway clients can be tested, benchmarked and load tested without the real service.
+Latency and failures can be injected to exercise timeouts, retries and the circuit breaker.
+
+Run standalone with `python gateway_stub.py [port]`.
+"""
+
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+MAX_CHARGE = 1000.00  # Same limit the simulated PaymentGateway declines above.
+
+
+class _GatewayRequestHandler(BaseHTTPRequestHandler):
+    """Routes one HTTP request to the StubGatewayServer that owns the socket server."""
+
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real gateway.
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def _handle(self, method: str):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        stub = self.server.stub
+        try:
+            payload = json.loads(body) if body else {}
+        except ValueError:
+            payload = None
+        status, response = stub.handle(method, self.path, self.headers.get('Authorization'), payload)
+        data = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # Quiet; tests and benchmarks make thousands of requests.
+
+
+class StubGatewayServer:
+    """
+    In-memory payment gateway served over HTTP on a background thread.
+
+    Args:
+        host: Interface to listen on
+        port: Port to listen on (0 picks a free one)
+        latency: Seconds each request takes before answering
+        failure_rate: Fraction of requests (0-1) answered with 503, chosen at random
+        seed: Seed for the failure sampling, for repeatable runs
+
+    Attributes you can change while it runs: latency, failure_rate and fail_next (the next
+    fail_next requests get a 503). requests counts requests handled and max_in_flight the
+    most handled at the same time.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0, failure_rate: float = 0.0,
+                 seed: Optional[int] = None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.fail_next = 0
+        self.requests = 0
+        self.max_in_flight = 0
+        self.charges: Dict[str, Dict] = {}
+        self._in_flight = 0
+        self._sequence = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _GatewayRequestHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        """Start serving on a background thread. Returns the base URL."""
+        self._thread = threading.Thread(target=self._server.serve_forever, name='gateway-stub', daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        """Stop serving and close the socket."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def handle(self, method: str, path: str, authorization: Optional[str], payload) -> Tuple[int, Dict]:
+        """Answer one request: (HTTP status, JSON body)."""
+        with self._lock:
+            self.requests += 1
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+            fail = self.fail_next > 0 or self._random.random() < self.failure_rate
+            if self.fail_next > 0:
+                self.fail_next -= 1
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            if fail:
+                return 503, {'error': 'Gateway temporarily unavailable'}
+            if not authorization or not authorization.startswith('Bearer '):
+                return 401, {'error': 'Missing API key'}
+            if payload is None:
+                return 400, {'error': 'Malformed JSON body'}
+            if method == 'POST' and path == '/charges':
+                return self._charge(payload)
+            if method == 'POST' and path == '/refunds':
+                return self._refund(payload)
+            if method == 'GET' and path.startswith('/charges/'):
+                return self._status(path[len('/charges/'):])
+            return 404, {'error': 'Not found'}
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def _charge(self, payload: Dict) -> Tuple[int, Dict]:
+        customer_id, amount = str(payload.get('customer_id', '')), payload.get('amount')
+        if not isinstance(amount, (int, float)) or amount <= 0:
+            return 400, {'error': 'Invalid amount: must be greater than 0'}
+        if amount > MAX_CHARGE:
+            return 402, {'error': 'Payment declined: amount exceeds limit'}
+        if len(customer_id) != 6:
+            return 400, {'error': 'Invalid patron ID format'}
+        with self._lock:
+            self._sequence += 1
+            transaction_id = f"txn_{customer_id}_{int(time.time())}_{self._sequence}"
+            self.charges[transaction_id] = {
+                'transaction_id': transaction_id, 'status': 'completed', 'amount': round(amount, 2),
+                'refunded': 0.0, 'description': payload.get('description', ''), 'timestamp': time.time()
+            }
+        return 200, {'id': transaction_id, 'message': f"Payment of ${amount:.2f} processed successfully"}
+
+    def _refund(self, payload: Dict) -> Tuple[int, Dict]:
+        transaction_id, amount = str(payload.get('transaction_id', '')), payload.get('amount')
+        if not transaction_id.startswith('txn_'):
+            return 400, {'error': 'Invalid transaction ID'}
+        if not isinstance(amount, (int, float)) or amount <= 0:
+            return 400, {'error': 'Invalid refund amount'}
+        with self._lock:
+            charge = self.charges.get(transaction_id)
+            if charge:
+                charge['refunded'] = round(charge['refunded'] + amount, 2)
+            self._sequence += 1
+            refund_id = f"refund_{transaction_id}_{self._sequence}"
+        return 200, {'id': refund_id,
+                     'message': f"Refund of ${amount:.2f} processed successfully. Refund ID: {refund_id}"}
+
+    def _status(self, transaction_id: str) -> Tuple[int, Dict]:
+        with self._lock:
+            charge = self.charges.get(transaction_id)
+            charge = dict(charge) if charge else None
+        if not charge:
+            return 404, {'status': 'not_found', 'message': 'Transaction not found'}
+        charge.pop('description')
+        return 200, charge
+
+
+if __name__ == '__main__':
+    server = StubGatewayServer(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8900)
+    print(f"Stand-in payment gateway listening on {server.start()}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
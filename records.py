@@ -0,0 +1,161 @@
+"""
+Records module for Library Management System
+Compact record types for book and loan rows. They are built straight from query results by a
+cursor row_factory and behave like read/write dictionaries, so templates and existing callers
+can keep using book['title'] while large result sets avoid a dict per row.
+"""
+
+import calendar
+from collections.abc import MutableMapping
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+# Loan dates are stored as integer seconds since 1970-01-01 of the naive local wall-clock time
+# (the time treated as if it were UTC), so SQL date arithmetic matches naive datetime arithmetic
+# exactly, with no DST shifts.
+_EPOCH = datetime(1970, 1, 1)
+
+
+def to_epoch(value: datetime) -> int:
+    """Convert a naive datetime to the stored integer loan date (whole seconds)."""
+    return calendar.timegm(value.timetuple())
+
+
+def from_epoch(seconds: Optional[int]) -> Optional[datetime]:
+    """Convert a stored integer loan date back to a naive datetime (None stays None)."""
+    return None if seconds is None else _EPOCH + timedelta(seconds=seconds)
+
+
+class Record(MutableMapping):
+    """
+    Base for slotted records with a dictionary view over their fields.
+
+    Subclasses list their public field names in _fields and declare their storage in __slots__.
+    Fields can be read and changed like dictionary keys but not added or removed.
+    """
+
+    __slots__ = ()
+    _fields = ()
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self._fields:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        raise TypeError(f"{type(self).__name__} fields can't be removed.")
+
+    def __contains__(self, key):
+        return key in self._fields
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __repr__(self):
+        fields = ", ".join(f"{field}={getattr(self, field)!r}" for field in self._fields)
+        return f"{type(self).__name__}({fields})"
+
+    def copy(self):
+        """Get a shallow copy of the record."""
+        clone = object.__new__(type(self))
+        for cls in type(self).__mro__:
+            for slot in getattr(cls, '__slots__', ()):
+                setattr(clone, slot, getattr(self, slot))
+        return clone
+
+    def to_dict(self) -> Dict:
+        """Get the fields as a plain dictionary, e.g. for JSON."""
+        return {field: getattr(self, field) for field in self._fields}
+
+    @classmethod
+    def row_factory(cls, cursor, row):
+        """sqlite3 row_factory building a record from a row whose columns are in _fields order."""
+        return cls(*row)
+
+
+class Book(Record):
+    """A row of the books table."""
+
+    __slots__ = _fields = ('id', 'title', 'author', 'isbn', 'total_copies', 'available_copies')
+
+    def __init__(self, id: int, title: str, author: str, isbn: str, total_copies: int, available_copies: int):
+        self.id = id
+        self.title = title
+        self.author = author
+        self.isbn = isbn
+        self.total_copies = total_copies
+        self.available_copies = available_copies
+
+
+class Loan(Record):
+    """
+    A borrow record joined with its book's title and author.
+
+    Dates are kept as the stored epoch seconds and only turned into datetimes when read.
+    is_overdue means past due. Rows with a return date are built as ReturnedLoan instead.
+    """
+
+    __slots__ = ('book_id', 'title', 'author', '_borrow_date', '_due_date', '_return_date', 'is_overdue')
+    _fields = ('book_id', 'title', 'author', 'borrow_date', 'due_date', 'return_date', 'is_overdue')
+
+    def __init__(self, book_id: int, title: str, author: str, borrow_date: int, due_date: int,
+                 return_date: Optional[int], is_overdue):
+        self.book_id = book_id
+        self.title = title
+        self.author = author
+        self._borrow_date = borrow_date
+        self._due_date = due_date
+        self._return_date = return_date
+        self.is_overdue = bool(is_overdue)
+
+    @classmethod
+    def row_factory(cls, cursor, row):
+        """Build a Loan, or a ReturnedLoan if the row has a return date."""
+        return (ReturnedLoan if row[5] is not None else cls)(*row)
+
+    @property
+    def borrow_date(self) -> datetime:
+        return from_epoch(self._borrow_date)
+
+    @borrow_date.setter
+    def borrow_date(self, value: datetime):
+        self._borrow_date = to_epoch(value)
+
+    @property
+    def due_date(self) -> datetime:
+        return from_epoch(self._due_date)
+
+    @due_date.setter
+    def due_date(self, value: datetime):
+        self._due_date = to_epoch(value)
+
+    @property
+    def return_date(self) -> Optional[datetime]:
+        return from_epoch(self._return_date)
+
+    @return_date.setter
+    def return_date(self, value: Optional[datetime]):
+        self._return_date = None if value is None else to_epoch(value)
+
+
+class ReturnedLoan(Loan):
+    """A returned loan, as in a patron's borrowing history: was_overdue means it was returned late."""
+
+    __slots__ = ()
+    _fields = Loan._fields[:-1] + ('was_overdue',)
+
+    @property
+    def was_overdue(self) -> bool:
+        return self.is_overdue
+
+    @was_overdue.setter
+    def was_overdue(self, value: bool):
+        self.is_overdue = bool(value)
@@ -2,13 +2,28 @@
 API Routes - JSON API endpoints
 """
 
-from flask import Blueprint, jsonify, request
-from services.library_service import calculate_late_fee_for_book, search_books_in_catalog
-import os  # Clear old Docker layers if needed. 
-from database import DATABASE, init_database, add_sample_data
+from flask import Blueprint, jsonify, request, Response, url_for
+from services.library_service import (
+    calculate_late_fee_for_book, search_books_in_catalog, SEARCH_PAGE_SIZE, MAX_SEARCH_PAGE_SIZE,
+    borrow_books_by_patron, return_books_by_patron, get_patron_status_report, get_overdue_report,
+    OVERDUE_REPORT_PAGE_SIZE, get_payment_status, IDEMPOTENCY_KEY_REUSED
+)
+from database import (
+    reset_database, add_sample_data, get_books_page, CATALOG_PAGE_SIZE,
+    iter_books, iter_loans, BOOK_COLUMNS, LOAN_COLUMNS, get_patron_balance, get_fee_ledger, get_payment_job
+)
+from services.export_service import stream_export, EXPORT_FORMATS
+from services.import_service import import_books, IMPORT_FORMATS
+from services.payment_queue_service import submit_late_fee_payment, submit_late_fee_refund
+from services.payment_service import get_gateway_breaker
+import codecs
+from datetime import datetime
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+IDEMPOTENCY_KEY_ERROR = f'Idempotency-Key header must be 1 to {MAX_IDEMPOTENCY_KEY_LENGTH} characters'
+
 @api_bp.route('/late_fee/<patron_id>/<int:book_id>')
 def get_late_fee(patron_id, book_id):
     """
@@ -18,6 +33,57 @@ def get_late_fee(patron_id, book_id):
     result = calculate_late_fee_for_book(patron_id, book_id)
     return jsonify(result), 501 if 'not implemented' in result.get('status', '') else 200
 
+@api_bp.route('/patron/<patron_id>/status')
+def get_patron_status(patron_id):
+    """
+    Get a patron's current loans, late fees owed and borrowing history.
+    API endpoint for R7: Patron Status Report
+    """
+    report = get_patron_status_report(patron_id)
+    if not report:
+        return jsonify({'error': 'Invalid patron ID. Must be exactly 6 digits.'}), 400
+    
+    # Dates as ISO 8601 strings rather than jsonify's default HTTP date format
+    for loan in report['current_borrowed'] + report['borrow_history']:
+        for key in ('borrow_date', 'due_date', 'return_date'):
+            if loan.get(key) is not None:
+                loan[key] = loan[key].isoformat()
+    
+    return jsonify(dict(report, patron_id=patron_id)), 200
+
+@api_bp.route('/patron/<patron_id>/balance')
+def get_patron_fee_balance(patron_id):
+    """
+    Get a patron's outstanding late fee balance and fee ledger (assessed, paid and refunded entries).
+    """
+    if not patron_id.isdigit() or len(patron_id) != 6:
+        return jsonify({'error': 'Invalid patron ID. Must be exactly 6 digits.'}), 400
+    
+    return jsonify({
+        'patron_id': patron_id,
+        'outstanding_fees': get_patron_balance(patron_id),
+        'ledger': get_fee_ledger(patron_id)
+    }), 200
+
+@api_bp.route('/overdue')
+def get_overdue():
+    """
+    Report late fees owed across the library, totalled per patron (highest first).
+    Optional query parameters: as_of (ISO 8601 date), patron_id, limit, offset.
+    API endpoint for R5: Late Fee Calculation, library-wide
+    """
+    try:
+        as_of = datetime.fromisoformat(request.args['as_of']) if request.args.get('as_of') else None
+    except ValueError:
+        return jsonify({'error': 'as_of must be an ISO 8601 date'}), 400
+    patron_id = request.args.get('patron_id') or None
+    limit = max(1, request.args.get('limit', OVERDUE_REPORT_PAGE_SIZE, type=int))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    
+    report = get_overdue_report(as_of, patron_id, limit, offset)
+    report['as_of'] = report['as_of'].isoformat()
+    return jsonify(report), 200
+
 @api_bp.route('/search')
 def search_books_api():
     """
@@ -26,30 +92,224 @@ def search_books_api():
     """
     search_term = request.args.get('q', '').strip()
     search_type = request.args.get('type', 'title')
+    limit = max(1, min(request.args.get('limit', SEARCH_PAGE_SIZE, type=int), MAX_SEARCH_PAGE_SIZE))
+    offset = max(0, request.args.get('offset', 0, type=int))
     
     if not search_term:
         return jsonify({'error': 'Search term is required'}), 400
     
     # Use business logic function
-    books = search_books_in_catalog(search_term, search_type)
+    books = search_books_in_catalog(search_term, search_type, limit, offset)
     
     return jsonify({
         'search_term': search_term,
         'search_type': search_type,
         'results': books,
-        'count': len(books)
+        'count': len(books),
+        'limit': limit,
+        'offset': offset
+    })
+
+@api_bp.route('/books')
+def list_books_api():
+    """
+    List the catalog one page at a time via API endpoint.
+    Pass the returned `next` cursor as `after` to get the following page.
+    API interface for R2: Book Catalog Display
+    """
+    after = request.args.get('after') or None
+    limit = request.args.get('limit', CATALOG_PAGE_SIZE, type=int)
+    sort = request.args.get('sort', 'title')
+    
+    try:
+        books, next_cursor = get_books_page(after, limit, sort)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'books': books,
+        'count': len(books),
+        'sort': sort,
+        'next': next_cursor
     })
 
+def _export_response(rows, columns, name):
+    """Stream rows as an NDJSON (default) or CSV file download, picked by the `format` query parameter."""
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f'Format must be one of: {", ".join(EXPORT_FORMATS)}'}), 400
+    
+    return Response(
+        stream_export(rows, columns, export_format),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={'Content-Disposition': f'attachment; filename={name}.{export_format}'}
+    )
+
+@api_bp.route('/export/books')
+def export_books():
+    """
+    Export the whole catalog as NDJSON or CSV.
+    Rows are streamed from the database in chunks, so memory use doesn't grow with the catalog.
+    """
+    return _export_response(iter_books(), BOOK_COLUMNS, 'books')
+
+@api_bp.route('/export/loans')
+def export_loans():
+    """
+    Export every borrow record as NDJSON or CSV.
+    Rows are streamed from the database in chunks, so memory use doesn't grow with the table.
+    """
+    return _export_response(iter_loans(), LOAN_COLUMNS, 'loans')
+
+@api_bp.route('/books/import', methods=['POST'])
+def import_books_api():
+    """
+    Bulk-import books from CSV or JSON Lines, uploaded as the `file` form field or sent as the raw body.
+    Rows are validated with the R1 rules; the response lists the rows that failed.
+    """
+    import_format = request.args.get('format', 'csv')
+    if import_format not in IMPORT_FORMATS:
+        return jsonify({'error': f'Format must be one of: {", ".join(IMPORT_FORMATS)}'}), 400
+    
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+    result = import_books(codecs.iterdecode(stream, 'utf-8'), import_format)  # Decoded line by line, never held whole.
+    
+    return jsonify(result), 200
+
+def _batch_request():
+    """Read {"patron_id": str, "book_ids": [int, ...]} from the JSON body, or None if malformed."""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return None
+    patron_id, book_ids = data.get('patron_id'), data.get('book_ids')
+    if not isinstance(patron_id, str) or not isinstance(book_ids, list):
+        return None
+    if not all(isinstance(book_id, int) and not isinstance(book_id, bool) for book_id in book_ids):
+        return None
+    return patron_id.strip(), book_ids
+
+def _batch_response(success, message, results):
+    """JSON body shared by the batch endpoints. Per-book failures still return 200 with their results."""
+    body = {'success': success, 'message': message, 'results': results}
+    return jsonify(body), 200 if results else 400
+
+@api_bp.route('/borrow/batch', methods=['POST'])
+def borrow_batch():
+    """
+    Borrow several books for one patron in one request, e.g. from a self-checkout kiosk.
+    Batch API interface for R3: Book Borrowing
+    """
+    batch = _batch_request()
+    if batch is None:
+        return jsonify({'error': 'Expected JSON with patron_id (string) and book_ids (list of integers)'}), 400
+    
+    return _batch_response(*borrow_books_by_patron(*batch))
+
+@api_bp.route('/return/batch', methods=['POST'])
+def return_batch():
+    """
+    Return several books for one patron in one request, e.g. from a self-checkout kiosk.
+    Batch API interface for R4: Book Return Processing
+    """
+    batch = _batch_request()
+    if batch is None:
+        return jsonify({'error': 'Expected JSON with patron_id (string) and book_ids (list of integers)'}), 400
+    
+    return _batch_response(*return_books_by_patron(*batch))
+
+def _idempotency_key():
+    """The request's Idempotency-Key header: None if absent, False if unusable."""
+    key = request.headers.get('Idempotency-Key')
+    if key is None:
+        return None
+    key = key.strip()
+    return key if 0 < len(key) <= MAX_IDEMPOTENCY_KEY_LENGTH else False
+
+def _job_response(success, message, job_id):
+    """
+    202 with the job to poll, or 400 if the request was rejected before queueing
+    (422 if its Idempotency-Key was already used for a different request).
+    """
+    if not success:
+        return jsonify({'error': message}), 422 if message == IDEMPOTENCY_KEY_REUSED else 400
+    return jsonify({'job_id': job_id, 'status': 'queued', 'message': message,
+                    'status_url': url_for('api.get_payment_job_status', job_id=job_id)}), 202
+
+@api_bp.route('/patron/<patron_id>/pay', methods=['POST'])
+def pay_fees(patron_id):
+    """
+    Queue payment of a patron's late fees for one book. Expects JSON {"book_id": int}.
+    Returns a job ID straight away; poll /api/payments/<job_id> for the result.
+    """
+    data = request.get_json(silent=True)
+    book_id = data.get('book_id') if isinstance(data, dict) else None
+    if not isinstance(book_id, int) or isinstance(book_id, bool):
+        return jsonify({'error': 'Expected JSON with book_id (integer)'}), 400
+    key = _idempotency_key()
+    if key is False:
+        return jsonify({'error': IDEMPOTENCY_KEY_ERROR}), 400
+    
+    return _job_response(*submit_late_fee_payment(patron_id, book_id, key))
+
+@api_bp.route('/patron/<patron_id>/pay-all', methods=['POST'])
+def pay_all_fees(patron_id):
+    """
+    Queue payment of all a patron's late fees as one itemized charge.
+    Returns a job ID straight away; poll /api/payments/<job_id> for the result.
+    """
+    key = _idempotency_key()
+    if key is False:
+        return jsonify({'error': IDEMPOTENCY_KEY_ERROR}), 400
+    return _job_response(*submit_late_fee_payment(patron_id, None, key))
+
+@api_bp.route('/refunds', methods=['POST'])
+def refund_fees():
+    """
+    Queue a refund of a late fee payment. Expects JSON {"transaction_id": str, "amount": number}.
+    Returns a job ID straight away; poll /api/payments/<job_id> for the result.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected JSON with transaction_id (string) and amount (number)'}), 400
+    transaction_id, amount = data.get('transaction_id'), data.get('amount')
+    if not isinstance(transaction_id, str) or not isinstance(amount, (int, float)) or isinstance(amount, bool):
+        return jsonify({'error': 'Expected JSON with transaction_id (string) and amount (number)'}), 400
+    key = _idempotency_key()
+    if key is False:
+        return jsonify({'error': IDEMPOTENCY_KEY_ERROR}), 400
+    
+    return _job_response(*submit_late_fee_refund(transaction_id, float(amount), key))
+
+@api_bp.route('/payments/<int:job_id>')
+def get_payment_job_status(job_id):
+    """Get the status of a queued payment or refund: queued, running, succeeded or failed."""
+    job = get_payment_job(job_id)
+    if not job:
+        return jsonify({'error': 'Payment job not found'}), 404
+    return jsonify(job), 200
+
+@api_bp.route('/transactions/<transaction_id>')
+def get_transaction_status(transaction_id):
+    """Get a late fee payment's status, from local records when it was recorded here."""
+    status = get_payment_status(transaction_id)
+    if status.get('status') == 'not_found':
+        return jsonify(status), 404
+    return jsonify(status), 200
+
+@api_bp.route('/gateway/status')
+def get_gateway_status():
+    """Get the payment gateway circuit breaker's state and call counts, for monitoring."""
+    return jsonify(get_gateway_breaker().metrics()), 200
+
 @api_bp.route('/test/reset-db')
 def test_reset_db():
     """
     Reset the internal SQLite database.
     Used ONLY for E2E tests (locally and inside Docker).
     """
-   # Remove DB file if exists
-    if os.path.exists(DATABASE):
-        os.remove(DATABASE)
-    init_database()
+    # Emptied in place: other workers' connections to the file stay valid
+    reset_database()
     add_sample_data()
 
     return jsonify({"status": "Database reset successful"}), 200
@@ -3,7 +3,7 @@ Catalog Routes - Book catalog related endpoints
 """
 
 from flask import Blueprint, render_template, request, redirect, url_for, flash
-from database import get_all_books
+from database import get_books_page, CATALOG_PAGE_SIZE, CATALOG_SORTS
 from services.library_service import add_book_to_catalog
 
 catalog_bp = Blueprint('catalog', __name__)
@@ -16,11 +16,23 @@ def index():
 @catalog_bp.route('/catalog')
 def catalog():
     """
-    Display all books in the catalog.
+    Display the books in the catalog, one page at a time.
     Implements R2: Book Catalog Display
     """
-    books = get_all_books()
-    return render_template('catalog.html', books=books)
+    after = request.args.get('after') or None
+    limit = request.args.get('limit', CATALOG_PAGE_SIZE, type=int)
+    sort = request.args.get('sort', 'title')
+    if sort not in CATALOG_SORTS:
+        sort = 'title'
+    
+    try:
+        books, next_cursor = get_books_page(after, limit, sort)
+    except ValueError:
+        flash('Invalid catalog page.', 'error')
+        return redirect(url_for('catalog.catalog', sort=sort))
+    
+    return render_template('catalog.html', books=books, next_cursor=next_cursor, limit=limit, sort=sort,
+                           is_first_page=after is None)
 
 @catalog_bp.route('/add_book', methods=['GET', 'POST'])
 def add_book():
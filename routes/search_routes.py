@@ -3,7 +3,7 @@ Search Routes - Book search functionality
 """
 
 from flask import Blueprint, render_template, request, flash
-from services.library_service import search_books_in_catalog
+from services.library_service import search_books_in_catalog, SEARCH_PAGE_SIZE, MAX_SEARCH_PAGE_SIZE
 
 search_bp = Blueprint('search', __name__)
 
@@ -15,14 +15,17 @@ def search_books():
     """
     search_term = request.args.get('q', '').strip()
     search_type = request.args.get('type', 'title')
+    limit = max(1, min(request.args.get('limit', SEARCH_PAGE_SIZE, type=int), MAX_SEARCH_PAGE_SIZE))
+    offset = max(0, request.args.get('offset', 0, type=int))
     
     if not search_term:
         return render_template('search.html', books=[], search_term='', search_type=search_type)
     
     # Use business logic function
-    books = search_books_in_catalog(search_term, search_type)
+    books = search_books_in_catalog(search_term, search_type, limit, offset)
     
     if not books:
         flash('Search functionality is not yet implemented.', 'error')
     
-    return render_template('search.html', books=books, search_term=search_term, search_type=search_type)
+    return render_template('search.html', books=books, search_term=search_term, search_type=search_type,
+                           limit=limit, offset=offset)
@@ -0,0 +1,253 @@
+"""
+Benchmark Service Module - Timing the library service hot paths at scale
+Runs borrowing, returning, late fee, search and status report calls against seeded databases
+of increasing size and reports ops/sec and latency percentiles. Results are saved as JSON and
+can be compared with a saved baseline to flag regressions after storage changes.
+
+Run with `flask --app app benchmark --help`.
+"""
+
+import math
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import database
+from database import init_database, close_pool, get_active_loan_keys, get_book_by_id, invalidate_book_cache
+from services.dataset_service import generate_dataset, DEFAULT_SEED, PATRON_ID_START, TITLE_WORDS, LAST_NAMES
+from services.library_service import (
+    borrow_book_by_patron, return_book_by_patron, calculate_late_fee_for_book, search_books_in_catalog,
+    get_patron_status_report, SEARCH_PAGE_SIZE
+)
+
+# name -> (books, patrons, loans). Sizes can also be given as "BOOKSxPATRONSxLOANS".
+DATASET_SIZES = {
+    'small': (1000, 200, 10000),
+    'medium': (100000, 10000, 1000000),
+    'large': (1000000, 100000, 10000000),
+}
+BENCHMARK_ITERATIONS = 200  # Timed calls per operation and size.
+BENCHMARK_WARMUP = 20  # Untimed calls first, to fill caches.
+BENCHMARK_DATA_DIR = 'benchmark_data'  # Seeded databases are generated once and kept here.
+REGRESSION_THRESHOLD = 0.10  # Slower by more than this fraction counts as a regression.
+DATABASE_ERROR = "Database error"  # Start of the service messages for failed database writes.
+
+
+def parse_size(size: str) -> Tuple[str, Tuple[int, int, int]]:
+    """
+    Resolve a dataset size name ("small", "medium", "large") or "BOOKSxPATRONSxLOANS".
+
+    Returns:
+        tuple: (name, (books, patrons, loans))
+    """
+    if size in DATASET_SIZES:
+        return size, DATASET_SIZES[size]
+    try:
+        books, patrons, loans = (int(part) for part in size.lower().split('x'))
+    except ValueError:
+        raise ValueError(f"Unknown dataset size {size!r}: use {', '.join(DATASET_SIZES)} or BOOKSxPATRONSxLOANS.")
+    return size, (books, patrons, loans)
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of already sorted values (fraction 0.95 for p95)."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(len(sorted_values) * fraction))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies: List[float], errors: int = 0) -> Dict:
+    """
+    Summarize one operation's call latencies (seconds).
+
+    Returns:
+        dict: 'calls', 'errors', 'ops_per_sec', and 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms'
+    """
+    values = sorted(latencies)
+    total = sum(values)
+    return {
+        'calls': len(values),
+        'errors': errors,
+        'ops_per_sec': round(len(values) / total, 1) if total else 0.0,
+        'mean_ms': round(total / len(values) * 1000, 3) if values else 0.0,
+        'p50_ms': round(percentile(values, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(values, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+        'max_ms': round(values[-1] * 1000, 3) if values else 0.0,
+    }
+
+
+def _time_calls(calls: Iterable[Callable[[], bool]], warmup: int) -> Dict:
+    """Time each call after the first `warmup`. A call returning False counts as an error."""
+    latencies, errors = [], 0
+    for position, call in enumerate(calls):
+        start = time.perf_counter()
+        ok = call()
+        elapsed = time.perf_counter() - start
+        if position < warmup:
+            continue
+        latencies.append(elapsed)
+        errors += not ok
+    return summarize(latencies, errors)
+
+
+def _seeded_database(data_dir: str, dimensions: Tuple[int, int, int], seed: int) -> str:
+    """Path of the seeded database for a size, generating it the first time."""
+    books, patrons, loans = dimensions
+    path = os.path.join(data_dir, f"{books}x{patrons}x{loans}-seed{seed}.db")
+    if os.path.exists(path):
+        return path
+    os.makedirs(data_dir, exist_ok=True)
+    partial = path + '.partial'
+    for leftover in (partial, partial + '-wal', partial + '-shm'):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    database.DATABASE = partial
+    init_database()
+    generate_dataset(books, patrons, loans, seed)
+    close_pool()
+    conn = sqlite3.connect(partial)
+    try:  # Fold the WAL into the file so it can be copied on its own.
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        conn.execute('PRAGMA journal_mode = DELETE')
+    finally:
+        conn.close()
+    os.replace(partial, path)
+    return path
+
+
+def _benchmark_size(dimensions: Tuple[int, int, int], iterations: int, warmup: int, seed: int) -> Dict:
+    """Time every operation against the current DATABASE, seeded with a dataset of these dimensions."""
+    books, patrons, _ = dimensions
+    rng = random.Random(seed)
+    count = iterations + warmup
+    results = {}
+
+    # Borrow books patrons don't have yet, then return exactly those loans. R3 refusals (limit
+    # reached, no copies left) are correct answers, so only database failures count as errors.
+    borrowed = []
+    def borrow(patron_id, book_id):
+        success, message = borrow_book_by_patron(patron_id, book_id)
+        if success:
+            borrowed.append((patron_id, book_id))
+        return success or not message.startswith(DATABASE_ERROR)
+    borrows = [(str(PATRON_ID_START + rng.randrange(patrons)), rng.randint(1, books)) for _ in range(count)]
+    results['borrow_book'] = _time_calls((lambda args=args: borrow(*args) for args in borrows), warmup)
+    returns = borrowed[:count]
+    results['return_book'] = _time_calls(
+        (lambda args=args: not return_book_by_patron(*args)[1].startswith(DATABASE_ERROR) for args in returns),
+        min(warmup, len(returns) // 2)
+    )
+
+    # Late fees for loans that were already out in the dataset, so most have a due date to check.
+    active = get_active_loan_keys() or [(str(PATRON_ID_START), 1)]
+    fee_args = [rng.choice(active) for _ in range(count)]
+    results['calculate_late_fee'] = _time_calls(
+        (lambda args=args: 'fee_amount' in calculate_late_fee_for_book(*args) for args in fee_args), warmup
+    )
+
+    # Searches as the search page makes them: a page of title or author matches, or an exact ISBN.
+    searches = []
+    for _ in range(count):
+        kind = rng.choice(('title', 'title', 'author', 'isbn'))
+        if kind == 'title':
+            term = rng.choice(TITLE_WORDS).lower()
+        elif kind == 'author':
+            term = rng.choice(LAST_NAMES)
+        else:
+            term = get_book_by_id(rng.randint(1, books))['isbn']
+        searches.append((term, kind))
+    results['search_books'] = _time_calls(
+        (lambda args=args: bool(search_books_in_catalog(*args, limit=SEARCH_PAGE_SIZE)) for args in searches), warmup
+    )
+
+    report_patrons = [str(PATRON_ID_START + rng.randrange(patrons)) for _ in range(count)]
+    results['patron_status_report'] = _time_calls(
+        (lambda patron_id=patron_id: bool(get_patron_status_report(patron_id)) for patron_id in report_patrons), warmup
+    )
+    return results
+
+
+def run_benchmarks(sizes: Iterable[str] = ('small',), iterations: int = BENCHMARK_ITERATIONS,
+                   warmup: int = BENCHMARK_WARMUP, seed: int = DEFAULT_SEED, data_dir: str = BENCHMARK_DATA_DIR,
+                   progress: Optional[Callable[[str], None]] = None) -> Dict:
+    """
+    Benchmark the service hot paths against seeded databases of each size.
+    Each size runs on a fresh copy of its seeded database, so runs are comparable; the app's
+    own database is left alone.
+
+    Args:
+        sizes: Size names or "BOOKSxPATRONSxLOANS"
+        iterations: Timed calls per operation and size
+        warmup: Untimed calls before the timed ones
+        seed: Seed for the datasets and the benchmark's choice of arguments
+        data_dir: Directory seeded databases are kept in between runs
+        progress: Called with a short message as each size starts
+
+    Returns:
+        dict: {'created_at', 'environment', 'seed', 'iterations', 'results': {size: {'dataset', 'operations'}}}
+    """
+    sizes = [parse_size(size) for size in sizes]
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'environment': {'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+                        'platform': platform.platform()},
+        'seed': seed,
+        'iterations': iterations,
+        'results': {},
+    }
+    original = database.DATABASE
+    try:
+        for name, dimensions in sizes:
+            if progress:
+                progress(f"Preparing {name} dataset ({dimensions[0]:,} books, {dimensions[1]:,} patrons, {dimensions[2]:,} loans)")
+            seeded = _seeded_database(data_dir, dimensions, seed)
+            working = os.path.join(data_dir, 'benchmark-run.db')
+            close_pool()
+            shutil.copyfile(seeded, working)
+            database.DATABASE = working
+            init_database()
+            if progress:
+                progress(f"Running {name}")
+            report['results'][name] = {
+                'dataset': dict(zip(('books', 'patrons', 'loans'), dimensions)),
+                'operations': _benchmark_size(dimensions, iterations, warmup, seed),
+            }
+            close_pool()
+    finally:
+        close_pool()
+        database.DATABASE = original
+        invalidate_book_cache()
+    return report
+
+
+def compare_results(current: Dict, baseline: Dict, threshold: float = REGRESSION_THRESHOLD) -> List[Dict]:
+    """
+    Compare a benchmark report with a baseline report, for sizes and operations both have.
+    An operation regressed if its p50 or p95 latency grew, or its ops/sec fell, by more than threshold.
+
+    Returns:
+        list: dicts with 'size', 'operation', 'metric', 'baseline', 'current' and 'change' (fraction worse)
+    """
+    regressions = []
+    for size, result in current.get('results', {}).items():
+        baseline_ops = baseline.get('results', {}).get(size, {}).get('operations', {})
+        for operation, stats in result['operations'].items():
+            before = baseline_ops.get(operation)
+            if not before:
+                continue
+            for metric, higher_is_worse in (('p50_ms', True), ('p95_ms', True), ('ops_per_sec', False)):
+                old, new = before.get(metric), stats.get(metric)
+                if not old or new is None:
+                    continue
+                change = (new - old) / old if higher_is_worse else (old - new) / old
+                if change > threshold:
+                    regressions.append({'size': size, 'operation': operation, 'metric': metric,
+                                        'baseline': old, 'current': new, 'change': round(change, 3)})
+    return regressions
@@ -0,0 +1,196 @@
+"""
+Dataset Service Module - Synthetic library data at production scale
+Generates a catalog, patrons and loan history far larger than add_sample_data's three books,
+for reproducing performance problems and benchmarking. Popularity is skewed (a few books and
+patrons account for most loans), most loans are returned on time, some late with fees in the
+fee ledger, and recent loans are still out. The same seed always produces the same data.
+
+Run with `flask --app app generate-dataset --help`.
+"""
+
+import random
+from bisect import bisect
+import time
+from datetime import datetime
+from functools import lru_cache
+from itertools import accumulate
+from typing import Callable, Dict, List, Optional
+
+from database import insert_dataset_batch, finish_dataset, count_rows
+from records import to_epoch, from_epoch
+from services.library_service import assess_late_fee, MAX_BORROWED_BOOKS
+
+DEFAULT_SEED = 327
+DATASET_BATCH_SIZE = 50000  # Rows inserted per transaction.
+PATRON_ID_START = 100000  # Patron IDs are 6 digits, so at most 900,000 patrons.
+LOAN_PERIOD = 14 * 86400  # Seconds, matching the 14-day loans of R3.
+BOOK_POPULARITY_SKEW = 1.0  # Zipf exponent: the rank-r book is borrowed in proportion to 1/r**skew.
+PATRON_ACTIVITY_SKEW = 0.6
+ON_TIME_FRACTION = 0.80  # Loans returned within the loan period.
+VERY_LATE_FRACTION = 0.05  # Loans returned two weeks or more late (most of the rest are a few days late).
+PAID_FRACTION = 0.70  # Late fees already paid.
+
+TITLE_WORDS = (
+    'Silent', 'River', 'Night', 'Garden', 'Empire', 'Shadow', 'Winter', 'Stone', 'Light', 'House',
+    'Secret', 'Ocean', 'Forgotten', 'Crown', 'Road', 'Fire', 'Glass', 'Mountain', 'Storm', 'Song',
+    'Last', 'Broken', 'Golden', 'Iron', 'Hidden', 'City', 'Dream', 'Sea', 'Star', 'Forest',
+    'Memory', 'Island', 'Letter', 'Summer', 'Wolf', 'Bridge', 'Dark', 'Little', 'Long', 'Wild',
+    'Kingdom', 'Journey', 'Mirror', 'Storyteller', 'Orchard', 'Harbor', 'Lantern', 'Machine', 'Atlas', 'Echo',
+)
+FIRST_NAMES = (
+    'James', 'Mary', 'Wei', 'Aisha', 'Carlos', 'Olga', 'Kenji', 'Fatima', 'Liam', 'Priya',
+    'Noah', 'Sofia', 'Mateo', 'Chloe', 'Arjun', 'Zara', 'Ethan', 'Mei', 'Omar', 'Ingrid',
+)
+LAST_NAMES = (
+    'Smith', 'Nguyen', 'Garcia', 'Okafor', 'Kowalski', 'Tanaka', 'Haddad', 'Johansson', 'Patel', 'Brown',
+    'Rossi', 'Kim', 'Martin', 'Silva', 'Murphy', 'Cohen', 'Dubois', 'Singh', 'Muller', 'Lopez',
+)
+
+ProgressCallback = Callable[[str, int, int], None]
+
+
+def _isbn13(number: int) -> str:
+    """A valid ISBN-13 in the 978 prefix, unique per number."""
+    digits = f"978{number:09d}"
+    total = sum(int(digit) * (3 if position % 2 else 1) for position, digit in enumerate(digits))
+    return digits + str((10 - total % 10) % 10)
+
+
+def _zipf_cum_weights(count: int, skew: float) -> List[float]:
+    """Cumulative Zipf weights for ranks 1..count."""
+    return list(accumulate(1.0 / rank ** skew for rank in range(1, count + 1)))
+
+
+def _zipf_rank(rng: random.Random, cum_weights: List[float]) -> int:
+    """Draw a 0-based rank, as random.choices would, but one at a time so batch size doesn't change the draws."""
+    return bisect(cum_weights, rng.random() * cum_weights[-1], 0, len(cum_weights) - 1)
+
+
+@lru_cache(maxsize=None)
+def _fee_for_days_late(days: int) -> float:
+    """The R5 late fee for a book returned `days` whole days late."""
+    due = datetime(2000, 1, 1)
+    return assess_late_fee(due, from_epoch(to_epoch(due) + days * 86400 + 1))['fee_amount']
+
+
+def _return_delay(rng: random.Random) -> int:
+    """Seconds between borrowing and returning a book."""
+    roll = rng.random()
+    if roll < ON_TIME_FRACTION:
+        return rng.randint(3600, LOAN_PERIOD)
+    if roll < 1 - VERY_LATE_FRACTION:
+        return LOAN_PERIOD + rng.randint(3600, 13 * 86400)
+    return LOAN_PERIOD + rng.randint(14 * 86400, 90 * 86400)
+
+
+def generate_dataset(books: int = 10000, patrons: int = 1000, loans: int = 100000, seed: int = DEFAULT_SEED,
+                     history_days: int = 365, as_of: Optional[datetime] = None,
+                     batch_size: int = DATASET_BATCH_SIZE, progress: Optional[ProgressCallback] = None) -> Dict:
+    """
+    Fill an empty database with a synthetic catalog, patrons and loan history.
+
+    Loans are spread over the last history_days. Loans whose return would fall after as_of are
+    still out, as far as copies, the 5-book limit and one copy per patron allow; the rest are
+    returned by as_of. Late returns have their fee assessed in the fee ledger, and most are paid.
+    Books' available copies and patrons' balances and loan counters match the generated loans.
+
+    Args:
+        books: Number of books
+        patrons: Number of patrons (at most 900,000)
+        loans: Number of borrow records, active and returned
+        seed: Random seed; the same seed, sizes and as_of give the same dataset
+        history_days: Days of loan history before as_of
+        as_of: The dataset's "now" (default is the current time)
+        batch_size: Rows inserted per transaction
+        progress: Called with (stage, done, total) after each batch, stage being "books" or "loans"
+
+    Returns:
+        dict: Counts of 'books', 'patrons', 'loans', 'active_loans', 'overdue_loans' and 'fee_entries',
+        and 'seconds' taken
+    """
+    if books < 1 or patrons < 1 or loans < 0:
+        raise ValueError("A dataset needs at least one book and one patron.")
+    if patrons > 1000000 - PATRON_ID_START:
+        raise ValueError(f"At most {1000000 - PATRON_ID_START} patrons fit in 6-digit IDs.")
+    if count_rows('books') or count_rows('borrow_records'):
+        raise ValueError("The database already has books or loans; generate into an empty database.")
+
+    started = time.perf_counter()
+    rng = random.Random(seed)
+    now = to_epoch(as_of or datetime.now())
+
+    # Popularity ranks are shuffled over book IDs so popular books are spread through the catalog.
+    book_by_rank = list(range(1, books + 1))
+    rng.shuffle(book_by_rank)
+    copies = [0] * (books + 1)
+    popular = max(1, books // 100)
+    for rank, book_id in enumerate(book_by_rank):
+        copies[book_id] = rng.randint(3, 8) if rank < popular else rng.randint(1, 3)
+
+    for start in range(1, books + 1, batch_size):
+        batch = []
+        for book_id in range(start, min(start + batch_size, books + 1)):
+            title = ' '.join(rng.sample(TITLE_WORDS, rng.randint(1, 3)))
+            author = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+            batch.append((book_id, f"The {title}", author, _isbn13(book_id), copies[book_id]))
+        insert_dataset_batch(books=batch)
+        if progress:
+            progress('books', min(start + batch_size - 1, books), books)
+
+    book_weights = _zipf_cum_weights(books, BOOK_POPULARITY_SKEW)
+    patron_weights = _zipf_cum_weights(patrons, PATRON_ACTIVITY_SKEW)
+    checked_out = [0] * (books + 1)
+    patron_loans = [0] * patrons
+    outstanding = [0.0] * patrons
+    active_pairs = set()
+    history = history_days * 86400
+    overdue, fee_entries = 0, 0
+
+    for start in range(1, loans + 1, batch_size):
+        size = min(batch_size, loans + 1 - start)
+        batch, ledger = [], []
+        for loan_id in range(start, start + size):
+            book_id = book_by_rank[_zipf_rank(rng, book_weights)]
+            patron = _zipf_rank(rng, patron_weights)
+            patron_id = str(PATRON_ID_START + patron)
+            borrowed = now - rng.randint(0, history)
+            due = borrowed + LOAN_PERIOD
+            returned = borrowed + _return_delay(rng)
+            if returned > now:
+                if (checked_out[book_id] < copies[book_id] and patron_loans[patron] < MAX_BORROWED_BOOKS
+                        and (patron, book_id) not in active_pairs):
+                    checked_out[book_id] += 1
+                    patron_loans[patron] += 1
+                    active_pairs.add((patron, book_id))
+                    overdue += due < now
+                    batch.append((loan_id, patron_id, book_id, borrowed, due, None, None))
+                    continue
+                returned = max(borrowed, now - rng.randint(0, 86400))  # No copy free: returned recently.
+
+            fee = _fee_for_days_late((returned - due) // 86400) if returned > due else 0.0
+            batch.append((loan_id, patron_id, book_id, borrowed, due, returned, fee))
+            if fee > 0:
+                ledger.append((patron_id, book_id, loan_id, 'assessed', fee, None, from_epoch(returned).isoformat()))
+                if rng.random() < PAID_FRACTION:
+                    paid_at = from_epoch(min(now, returned + rng.randint(0, 7 * 86400))).isoformat()
+                    ledger.append((patron_id, book_id, loan_id, 'paid', fee, f"txn_{patron_id}_{loan_id}", paid_at))
+                else:
+                    outstanding[patron] += fee
+        insert_dataset_batch(loans=batch, ledger_entries=ledger)
+        fee_entries += len(ledger)
+        if progress:
+            progress('loans', start + size - 1, loans)
+
+    patron_totals = [(str(PATRON_ID_START + patron), round(outstanding[patron], 2), patron_loans[patron])
+                     for patron in range(patrons)]
+    finish_dataset(patron_totals, [(book_id, count) for book_id, count in enumerate(checked_out) if count])
+
+    return {
+        'books': books,
+        'patrons': patrons,
+        'loans': loans,
+        'active_loans': len(active_pairs),
+        'overdue_loans': overdue,
+        'fee_entries': fee_entries,
+        'seconds': round(time.perf_counter() - started, 2)
+    }
@@ -0,0 +1,86 @@
+"""
+Export Service Module - Streaming data exports
+Serializes catalog and loan rows as NDJSON or CSV a chunk at a time, so exports
+of any size run in constant memory.
+"""
+
+import csv
+import io
+import json
+from typing import Dict, Iterable, Iterator, Sequence
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+ROWS_PER_CHUNK = 500  # Rows serialized into each chunk of the response body.
+
+
+def stream_ndjson(rows: Iterable[Dict], rows_per_chunk: int = ROWS_PER_CHUNK) -> Iterator[str]:
+    """
+    Serialize rows as newline-delimited JSON, one object per line.
+
+    Args:
+        rows: Row dictionaries, typically a database cursor generator
+        rows_per_chunk: Number of rows joined into each yielded string
+
+    Returns:
+        iterator: Chunks of NDJSON text
+    """
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row))
+        if len(lines) >= rows_per_chunk:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def stream_csv(rows: Iterable[Dict], columns: Sequence[str], rows_per_chunk: int = ROWS_PER_CHUNK) -> Iterator[str]:
+    """
+    Serialize rows as CSV with a header line.
+
+    Args:
+        rows: Row dictionaries, typically a database cursor generator
+        columns: Column names, in output order
+        rows_per_chunk: Number of rows written into each yielded string
+
+    Returns:
+        iterator: Chunks of CSV text
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns)
+    writer.writeheader()
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def stream_export(rows: Iterable[Dict], columns: Sequence[str], export_format: str) -> Iterator[str]:
+    """
+    Serialize rows in the requested export format.
+
+    Args:
+        rows: Row dictionaries
+        columns: Column names, in output order (used for CSV)
+        export_format: "ndjson" or "csv"
+
+    Returns:
+        iterator: Chunks of text in the requested format
+
+    Raises:
+        ValueError: If the export format is not supported
+    """
+    if export_format == 'ndjson':
+        return stream_ndjson(rows)
+    if export_format == 'csv':
+        return stream_csv(rows, columns)
+    raise ValueError(f"Unsupported export format {export_format!r}.")
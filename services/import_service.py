@@ -0,0 +1,143 @@
+"""
+Import Service Module - Bulk catalog import
+Streams books from CSV or JSON Lines, validates them with the same R1 rules as
+add_book_to_catalog, and inserts them in large batched transactions.
+"""
+
+import csv
+import json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from database import insert_books_bulk
+from services.library_service import validate_book_fields
+
+IMPORT_FORMATS = ('csv', 'jsonl')
+IMPORT_BATCH_SIZE = 5000  # Books written per transaction.
+MAX_REPORTED_ERRORS = 1000  # Failed rows are still counted past this, just not listed.
+BOOK_FIELDS = ('title', 'author', 'isbn', 'total_copies')
+
+
+def read_book_rows(lines: Iterable[str], import_format: str) -> Iterator[Tuple[int, Optional[Dict]]]:
+    """
+    Parse books from an iterable of text lines, one at a time.
+
+    Args:
+        lines: Lines of a CSV file (with a header) or of a JSON Lines file
+        import_format: "csv" or "jsonl"
+
+    Returns:
+        iterator: (row_number, row) pairs, row is None when the line can't be parsed
+    """
+    if import_format == 'csv':
+        for row_number, row in enumerate(csv.DictReader(lines), start=1):
+            yield row_number, row
+    elif import_format == 'jsonl':
+        row_number = 0
+        for line in lines:
+            if not line.strip():
+                continue
+            row_number += 1
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield row_number, row if isinstance(row, dict) else None
+    else:
+        raise ValueError(f"Unsupported import format {import_format!r}.")
+
+
+def _parse_book(row: Optional[Dict]) -> Tuple[Optional[Tuple[str, str, str, int]], Optional[str]]:
+    """Turn one parsed row into a (title, author, isbn, total_copies) tuple, or an error message."""
+    if row is None:
+        return None, "Row could not be parsed."
+
+    title, author, isbn = (str(row.get(field) or '') for field in BOOK_FIELDS[:3])
+    total_copies = row.get('total_copies')
+    if isinstance(total_copies, str) and total_copies.strip().isdigit():
+        total_copies = int(total_copies)  # CSV values are always text.
+
+    error = validate_book_fields(title, author, isbn.strip(), total_copies)
+    if error:
+        return None, error
+    return (title.strip(), author.strip(), isbn.strip(), total_copies), None
+
+
+def _validate_batch(batch: List[Tuple[int, Optional[Dict]]]) -> List[Tuple]:
+    """
+    Validate a batch of rows into (row_number, raw isbn, book, error) tuples.
+    Module-level so it can run in a worker process.
+    """
+    return [(row_number, (row or {}).get('isbn'), *_parse_book(row)) for row_number, row in batch]
+
+
+def _batches(rows: Iterator, batch_size: int) -> Iterator[List]:
+    """Group an iterator into lists of at most batch_size items."""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _validate_in_pool(batches: Iterator[List], workers: int) -> Iterator[List]:
+    """Validate batches across worker processes, in order, with only a few batches in flight at once."""
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for batch in batches:
+            pending.append(pool.submit(_validate_batch, batch))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def import_books(lines: Iterable[str], import_format: str, batch_size: int = IMPORT_BATCH_SIZE,
+                 workers: int = 1) -> Dict:
+    """
+    Bulk-import books into the catalog.
+
+    Args:
+        lines: Lines of a CSV file (with a title,author,isbn,total_copies header) or of a JSON Lines file
+        import_format: "csv" or "jsonl"
+        batch_size: Number of rows validated and inserted per transaction
+        workers: Worker processes used for validation (1 validates in this process)
+
+    Returns:
+        dict: {'imported': int, 'failed': int, 'errors': list of {'row', 'isbn', 'error'}}
+    """
+    if import_format not in IMPORT_FORMATS:
+        raise ValueError(f"Unsupported import format {import_format!r}.")
+
+    result = {'imported': 0, 'failed': 0, 'errors': []}
+
+    def record_error(row_number, isbn, error):
+        result['failed'] += 1
+        if len(result['errors']) < MAX_REPORTED_ERRORS:
+            result['errors'].append({'row': row_number, 'isbn': isbn, 'error': error})
+
+    batches = _batches(read_book_rows(lines, import_format), batch_size)
+    validated = _validate_in_pool(batches, workers) if workers > 1 else map(_validate_batch, batches)
+
+    for batch in validated:
+        valid = []
+        for row_number, isbn, book, error in batch:
+            if error:
+                record_error(row_number, isbn, error)
+            else:
+                valid.append((row_number, book))
+        if not valid:
+            continue
+
+        skipped = set(insert_books_bulk([book for _, book in valid]))
+        for position, (row_number, book) in enumerate(valid):
+            if position in skipped:
+                record_error(row_number, book[2], "A book with this ISBN already exists.")
+            else:
+                result['imported'] += 1
+
+    return result
@@ -3,53 +3,88 @@ Library Service Module - Business Logic Functions
 Contains all the core business logic for the Library Management System
 """
 
-from services.payment_service import PaymentGateway  # ASSIGNMENT 3. 
+from services.payment_service import PaymentGateway, default_payment_gateway, GatewayError, GatewayUnavailable  # ASSIGNMENT 3. 
 
+import uuid
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 from database import (
     get_book_by_id, get_book_by_isbn, get_patron_borrow_count,
-    insert_book, insert_borrow_record, update_book_availability,
-    update_borrow_record_return_date, get_all_books, get_patron_borrowed_books,
-    get_patron_borrowing_history
+    insert_book, get_patron_borrowed_books, borrow_book_transaction, return_book_transaction,
+    search_books, borrow_books_transaction, return_books_transaction, get_patron_loans,
+    get_overdue_fee_totals, get_book_fee_balance, record_fee_payment, get_fee_payment, record_fee_refund,
+    get_unpaid_fee_sources, record_fee_payment_allocations, begin_payment_request, finish_payment_request,
+    release_payment_request, get_local_payment_status, mark_payment_request_unknown, get_unsettled_payment_requests,
+    get_payment_request, get_patron_assessed_fees
 )
 
+MAX_BORROWED_BOOKS = 5  # R3: Patrons may have at most 5 books out at once.
+SEARCH_PAGE_SIZE = 50  # Default number of search results per page.
+MAX_SEARCH_PAGE_SIZE = 200
+MAX_BATCH_BOOKS = 20  # Most books a kiosk can borrow or return in one batch request.
 
-def add_book_to_catalog(title: str, author: str, isbn: str, total_copies: int) -> Tuple[bool, str]:
+# R5 late fee schedule.
+LATE_FEE_FIRST_WEEK_RATE = 0.50  # Per day, for the first 7 days overdue.
+LATE_FEE_DAILY_RATE = 1.00  # Per day, after the first 7 days.
+MAX_LATE_FEE = 15.00  # Per book.
+OVERDUE_REPORT_PAGE_SIZE = 100  # Patrons per page of the overdue report.
+IDEMPOTENCY_KEY_REUSED = "Idempotency key was already used for a different request."
+OUTCOME_UNKNOWN = ("The payment gateway did not confirm whether this went through. "
+                   "It must be settled before another charge or refund is made.")
+UNSETTLED_PAYMENT = "An earlier payment for this patron has an unknown outcome. No new charge can be made until it is settled."
+UNSETTLED_REFUND = "An earlier refund of this payment has an unknown outcome. No new refund can be made until it is settled."
+
+
+def validate_book_fields(title: str, author: str, isbn: str, total_copies: int) -> Optional[str]:
     """
-    Add a new book to the catalog.
-    Implements R1: Book Catalog Management.
+    Check a book's fields against the R1 rules, without touching the database.
+    Shared by add_book_to_catalog and the bulk importer.
     
-    Args:
-        title: Book title (max 200 chars)
-        author: Book author (max 100 chars)
-        isbn: 13-digit ISBN
-        total_copies: Number of copies (positive integer)
-        
     Returns:
-        tuple: (success: bool, message: str)
+        str: Error message for the first rule broken, or None if the book is valid
     """
-    # Input validation
     if not title or not title.strip():
-        return False, "Title is required."
+        return "Title is required."
     
     if len(title.strip()) > 200:
-        return False, "Title must be less than 200 characters."
+        return "Title must be less than 200 characters."
     
     if not author or not author.strip():
-        return False, "Author is required."
+        return "Author is required."
     
     if len(author.strip()) > 100:
-        return False, "Author must be less than 100 characters."
+        return "Author must be less than 100 characters."
     
     if not isbn or not isbn.isdigit():
-        return False, "ISBN must be exactly 13 number-only digits."  # A2: New check for invalid input. 
+        return "ISBN must be exactly 13 number-only digits."  # A2: New check for invalid input. 
 
     if len(isbn) != 13:
-        return False, "ISBN must be exactly 13 digits."
+        return "ISBN must be exactly 13 digits."
     
     if not isinstance(total_copies, int) or total_copies <= 0:
-        return False, "Total copies must be a positive integer."
+        return "Total copies must be a positive integer."
+    
+    return None
+
+
+def add_book_to_catalog(title: str, author: str, isbn: str, total_copies: int) -> Tuple[bool, str]:
+    """
+    Add a new book to the catalog.
+    Implements R1: Book Catalog Management.
+    
+    Args:
+        title: Book title (max 200 chars)
+        author: Book author (max 100 chars)
+        isbn: 13-digit ISBN
+        total_copies: Number of copies (positive integer)
+        
+    Returns:
+        tuple: (success: bool, message: str)
+    """
+    # Input validation
+    error = validate_book_fields(title, author, isbn, total_copies)
+    if error:
+        return False, error
     
     # Check for duplicate ISBN
     existing = get_book_by_isbn(isbn)
@@ -80,33 +115,29 @@ def borrow_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
         return False, "Invalid patron ID. Must be exactly 6 digits."
     
-    # Check if book exists and is available
-    book = get_book_by_id(book_id)
-    if not book:
+    # Create borrow record
+    borrow_date = datetime.now()
+    due_date = borrow_date + timedelta(days=14)
+    
+    # Availability check, limit check, record insert and decrement run as one transaction
+    status, book = borrow_book_transaction(patron_id, book_id, borrow_date, due_date, MAX_BORROWED_BOOKS)
+    return _borrow_outcome(status, book, due_date)
+
+
+def _borrow_outcome(status: str, book: Optional[Dict], due_date: datetime) -> Tuple[bool, str]:
+    """Turn a borrow transaction status into the R3 (success, message) result."""
+    if status == 'not_found':
         return False, "Book not found."
     
-    if book['available_copies'] <= 0:
+    if status == 'unavailable':
         return False, "This book is currently not available."
     
-    # Check patron's current borrowed books count
-    current_borrowed = get_patron_borrow_count(patron_id)
-    
-    if current_borrowed >= 5:  # A2: Modified to check for exactly 5 books limit. 
+    if status == 'limit_reached':  # A2: Modified to check for exactly 5 books limit. 
         return False, "You have reached the maximum borrowing limit of 5 books."
     
-    # Create borrow record
-    borrow_date = datetime.now()
-    due_date = borrow_date + timedelta(days=14)
-    
-    # Insert borrow record and update availability
-    borrow_success = insert_borrow_record(patron_id, book_id, borrow_date, due_date)
-    if not borrow_success:
+    if status != 'borrowed':
         return False, "Database error occurred while creating borrow record."
     
-    availability_success = update_book_availability(book_id, -1)
-    if not availability_success:
-        return False, "Database error occurred while updating book availability."
-    
     return True, f'Successfully borrowed "{book["title"]}". Due date: {due_date.strftime("%Y-%m-%d")}.'
 
 
@@ -122,31 +153,132 @@ def return_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     Returns:
         tuple: (success: bool, message: str)
     """
-    patron_borrowed = get_patron_borrowed_books(patron_id)  # Returns a list of dictionaries. 
-    # Check if no books were borrowed at all, list would be empty. 
-    if not patron_borrowed:
+    # Locate the loan, stamp the return date and late fee, and restock the copy in one transaction. 
+    status, late_fees = return_book_transaction(patron_id, book_id, datetime.now(), assess_late_fee)
+    return _return_outcome(status, late_fees, book_id)
+
+
+def _return_outcome(status: str, late_fees: Optional[Dict], book_id: int) -> Tuple[bool, str]:
+    """Turn a return transaction status into the R4 (success, message) result."""
+    if status == 'no_active_loans':  # No books were borrowed at all. 
         return False, "Error, no active borrow record found for this patron."
     
-    # Verify if the specific book was currently borrowed by patron.
-    for book in patron_borrowed: 
-        if book['book_id'] == book_id:
-            late_fees = calculate_late_fee_for_book(patron_id, book_id)  # Returns a dictionary. 
-            return_success = update_borrow_record_return_date(patron_id, book_id, datetime.now())  # Book was borrowed, record its return date. 
-            if not return_success:
-                return False, "Database error occurred while updating book return date."
-            
-            # Update availabile book copies. 
-            update_success = update_book_availability(book_id, 1)
-            if not update_success:
-                return False, "Database error occurred while updating book availability."
-            
-            # Calculate late fees owed. Assume user pays late fees of a book after returning it. 
-            if late_fees['fee_amount'] > 0:
-                return True, f'Book with id={book_id} successfully returned. Late fee ${late_fees["fee_amount"]:.2f} for being {late_fees["days_overdue"]} days overdue.'
-            else:
-                return True, f"Book with id={book_id} returned successfully. No late fees."
+    if status == 'not_borrowed':
+        return False, f"No active borrow record found for this patron and book with id={book_id}."
+    
+    if status != 'returned':
+        return False, "Database error occurred while updating book return date."
+    
+    # Late fees owed are recorded with the return. Assume user pays late fees of a book after returning it. 
+    if late_fees['fee_amount'] > 0:
+        return True, f'Book with id={book_id} successfully returned. Late fee ${late_fees["fee_amount"]:.2f} for being {late_fees["days_overdue"]} days overdue.'
+    else:
+        return True, f"Book with id={book_id} returned successfully. No late fees."
+
+
+def _validate_batch_request(patron_id: str, book_ids: List[int]) -> Optional[str]:
+    """Check a batch borrow/return request, returning the error message or None."""
+    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+        return "Invalid patron ID. Must be exactly 6 digits."
+    
+    if not book_ids:
+        return "At least one book ID is required."
+    
+    if len(book_ids) > MAX_BATCH_BOOKS:
+        return f"At most {MAX_BATCH_BOOKS} books can be processed at once."
+    
+    return None
+
+
+def borrow_books_by_patron(patron_id: str, book_ids: List[int]) -> Tuple[bool, str, List[Dict]]:
+    """
+    Borrow a stack of books for one patron, e.g. at a self-checkout kiosk.
+    All books are borrowed in one transaction and the 5 book limit is checked once;
+    each book gets the same result R3 would give it on its own.
+    
+    Args:
+        patron_id: 6-digit library card ID
+        book_ids: IDs of the books to borrow, in scan order
+        
+    Returns:
+        tuple: (success: bool, message: str, results: list of {'book_id', 'success', 'message'}),
+        success is True only if every book was borrowed
+    """
+    error = _validate_batch_request(patron_id, book_ids)
+    if error:
+        return False, error, []
+    
+    borrow_date = datetime.now()
+    due_date = borrow_date + timedelta(days=14)
+    
+    outcomes = borrow_books_transaction(patron_id, book_ids, borrow_date, due_date, MAX_BORROWED_BOOKS)
+    results = []
+    for book_id, (status, book) in zip(book_ids, outcomes):
+        success, message = _borrow_outcome(status, book, due_date)
+        results.append({'book_id': book_id, 'success': success, 'message': message})
+    
+    borrowed = sum(1 for result in results if result['success'])
+    return borrowed == len(book_ids), f"Borrowed {borrowed} of {len(book_ids)} books.", results
 
-    return False, f"No active borrow record found for this patron and book with id={book_id}."
+
+def return_books_by_patron(patron_id: str, book_ids: List[int]) -> Tuple[bool, str, List[Dict]]:
+    """
+    Return a stack of books for one patron, e.g. at a self-checkout kiosk.
+    All books are returned in one transaction; each gets the same result R4 would give it on its own.
+    
+    Args:
+        patron_id: 6-digit library card ID
+        book_ids: IDs of the books to return, in scan order
+        
+    Returns:
+        tuple: (success: bool, message: str, results: list of {'book_id', 'success', 'message', 'fee_amount'}),
+        success is True only if every book was returned
+    """
+    error = _validate_batch_request(patron_id, book_ids)
+    if error:
+        return False, error, []
+    
+    outcomes = return_books_transaction(patron_id, book_ids, datetime.now(), assess_late_fee)
+    results = []
+    for book_id, (status, late_fees) in zip(book_ids, outcomes):
+        success, message = _return_outcome(status, late_fees, book_id)
+        results.append({
+            'book_id': book_id,
+            'success': success,
+            'message': message,
+            'fee_amount': late_fees['fee_amount'] if late_fees else 0.00
+        })
+    
+    returned = sum(1 for result in results if result['success'])
+    return returned == len(book_ids), f"Returned {returned} of {len(book_ids)} books.", results
+
+
+def assess_late_fee(due_date: datetime, as_of: datetime) -> Dict:
+    """
+    Apply the R5 fee schedule to a loan with the given due date.
+    $0.50/day for the first 7 days overdue, $1.00/day after that, capped at $15.00 per book.
+
+    Args:
+        due_date: When the book was due
+        as_of: Date to measure lateness against (now, or the return date)
+
+    Returns:
+        dict: {'fee_amount': float, 'days_overdue': int}
+    """
+    if as_of <= due_date:  # Book is not overdue, no fees. 
+        return {'fee_amount': 0.00, 'days_overdue': 0}
+
+    fee = 0.00
+    days_overdue = (as_of - due_date).days  # Current date - due date. 
+    if 0 < days_overdue <= 7:
+        fee = days_overdue * LATE_FEE_FIRST_WEEK_RATE  # First 7 days, $0.50 per day.
+    elif days_overdue > 7:
+        fee = (7 * LATE_FEE_FIRST_WEEK_RATE) + ((days_overdue - 7) * LATE_FEE_DAILY_RATE)  # After 7 days, $1.00 per day. 
+        
+        if fee >= MAX_LATE_FEE:
+            fee = MAX_LATE_FEE  # Maximum fee of $15.00 per book. 
+
+    return {'fee_amount': round(fee, 2), 'days_overdue': days_overdue}
 
 
 def calculate_late_fee_for_book(patron_id: str, book_id: int) -> Dict:
@@ -163,7 +295,6 @@ def calculate_late_fee_for_book(patron_id: str, book_id: int) -> Dict:
     """
     patron_borrowed = get_patron_borrowed_books(patron_id)
     due_date = None
-    fee = 0.00
 
     for book in patron_borrowed: 
         if book['book_id'] == book_id: 
@@ -184,23 +315,38 @@ def calculate_late_fee_for_book(patron_id: str, book_id: int) -> Dict:
             'status': 'No active borrow record found for this patron and book.'
         }
     
-    days_overdue = (datetime.now() - due_date).days  # Current date - due date. 
-    if 0 < days_overdue <= 7:
-        fee = days_overdue * 0.50  # First 7 days, $0.50 per day.
-    elif days_overdue > 7:
-        fee = (7 * 0.50) + ((days_overdue - 7) * 1.00)  # After 7 days, $1.00 per day. 
-        
-        if fee >= 15.00:
-            fee = 15.00  # Maximum fee of $15.00 per book. 
-
+    fee = assess_late_fee(due_date, datetime.now())
     return {
-        'fee_amount': round(fee, 2),
-        'days_overdue': days_overdue,
-        'status': f'Overdue. Late fee of ${fee:.2f} is currently applied.'
+        'fee_amount': fee['fee_amount'],
+        'days_overdue': fee['days_overdue'],
+        'status': f'Overdue. Late fee of ${fee["fee_amount"]:.2f} is currently applied.'
     }
 
 
-def search_books_in_catalog(search_term: str, search_type: str) -> List[Dict]:
+def get_overdue_report(as_of: Optional[datetime] = None, patron_id: Optional[str] = None,
+                       limit: Optional[int] = OVERDUE_REPORT_PAGE_SIZE, offset: int = 0) -> Dict:
+    """
+    Late fees owed across the whole library (or one patron), computed for all active loans in one pass.
+    Uses the same R5 fee schedule as calculate_late_fee_for_book.
+
+    Args:
+        as_of: Date to measure lateness against (defaults to now)
+        patron_id: Only report this patron's loans (None for everyone)
+        limit: Maximum number of patrons listed (None for all)
+        offset: Number of patrons to skip, for paging
+
+    Returns:
+        dict: {'as_of': datetime, 'overdue_loans': int, 'patrons': int, 'total_fees': float,
+        'by_patron': list of {'patron_id', 'overdue_loans', 'max_days_overdue', 'total_fees'}}
+    """
+    as_of = as_of or datetime.now()
+    summary, by_patron = get_overdue_fee_totals(
+        as_of, LATE_FEE_FIRST_WEEK_RATE, LATE_FEE_DAILY_RATE, MAX_LATE_FEE, patron_id, limit, offset
+    )
+    return dict(summary, as_of=as_of, by_patron=by_patron)
+
+
+def search_books_in_catalog(search_term: str, search_type: str, limit: Optional[int] = None, offset: int = 0) -> List[Dict]:
     """
     Search for books in the catalog.
     Implement R6 as per requirements.
@@ -208,6 +354,8 @@ def search_books_in_catalog(search_term: str, search_type: str) -> List[Dict]:
     Args:
         search_term: Term that was searched for, as q
         search_type: "title", "author", or "isbn"
+        limit: Maximum number of results to return (None for all)
+        offset: Number of results to skip, for paging
 
     Returns:
         list: List of matching books results (as dictionaries)
@@ -215,20 +363,11 @@ def search_books_in_catalog(search_term: str, search_type: str) -> List[Dict]:
     q = search_term.strip()  # Remove leading and trailing spaces.
     if search_type == "isbn":
         book = get_book_by_isbn(q)  # Exact matching for ISBN. 
-        return [book] if book else []  # Return empty if no match. 
-     
-    all_books = get_all_books()
-    if not search_term or not search_term.strip():
-        return all_books  # If search term is empty or whitespaces. 
-    
-    elif search_type == "title":
-        books = [book for book in all_books if q.lower() in book['title'].lower()]  # Partial matching, case-insensitive. 
-        return books # [] if no matches. 
-    
-    elif search_type == "author":
-        all_books = get_all_books()
-        books = [book for book in all_books if q.lower() in book['author'].lower()]  # Partial matching, case-insensitive.  
-        return books  
+        return [book] if book and offset == 0 else []  # Return empty if no match. 
+    
+    if search_type in ("title", "author"):
+        # Partial matching, case-insensitive, using the full-text index. Empty term returns all books. 
+        return search_books(q, search_type, limit, offset)  # [] if no matches. 
         
     return []  # Search type was invalid.
 
@@ -243,20 +382,33 @@ def get_patron_status_report(patron_id: str) -> Dict:
 
     Returns:
         dict: Patron status report with currently borrowed books (list of dict), total late fees owed, number borrowed, and borrowing history (list of dict).
+        Total late fees owed is the fee ledger's outstanding balance (unpaid fees on any book) plus what
+        books still out have accrued since their fees were last assessed, so it matches what paying all fees charges.
     """ 
     if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
         return {}  # Invalid patron ID.
 
-    current_borrowed = get_patron_borrowed_books(patron_id)  # Currently borrowed books, including due dates of each. 
-    num_borrowed = get_patron_borrow_count(patron_id)  # Number of books currently borrowed.
-    borrowing_history = get_patron_borrowing_history(patron_id)  # List of all past (returned) borrow records. 
-    
-    # Total late fees owed currently. 
-    total_fees = 0.00
-    for book in current_borrowed:
-        if book['is_overdue']:
-            late_fee_info = calculate_late_fee_for_book(patron_id, book['book_id'])
-            total_fees += late_fee_info['fee_amount']
+    # One query for all loans, split into current loans and history in memory. 
+    now = datetime.now()
+    current_borrowed, borrowing_history = [], []
+    total_fees, assessed = get_patron_assessed_fees(patron_id)  # Unpaid fees in the ledger. 
+    for loan in get_patron_loans(patron_id, now):
+        if loan['return_date'] is None:  # Currently borrowed books, including due dates of each. 
+            is_overdue = loan['is_overdue']  # Compared in SQL against now.
+            if is_overdue:  # Plus fees accrued since the loan was last assessed. 
+                fee_to_date = assess_late_fee(loan['due_date'], now)['fee_amount']
+                total_fees += max(0.0, fee_to_date - assessed.get(loan['book_id'], 0.0))
+            current_borrowed.append({
+                'book_id': loan['book_id'],
+                'title': loan['title'],
+                'author': loan['author'],
+                'borrow_date': loan['borrow_date'],
+                'due_date': loan['due_date'],
+                'is_overdue': is_overdue
+            })
+        else:  # All past (returned) borrow records. 
+            borrowing_history.append(dict(loan))
+    num_borrowed = get_patron_borrow_count(patron_id)  # Maintained counter, kept in step with current_borrowed.
 
     return {
         'current_borrowed': current_borrowed,
@@ -267,7 +419,55 @@ def get_patron_status_report(patron_id: str) -> Dict:
 
 
 # NEW FUNCTIONs PASTED FOR ASSIGNMENT 3.
-def pay_late_fees(patron_id: str, book_id: int, payment_gateway: PaymentGateway = None) -> Tuple[bool, str, Optional[str]]:  # type: ignore
+def _run_idempotent(idempotency_key: str, request: Dict, call) -> Tuple[bool, str, Optional[str], Optional[float], Optional[List[Dict]]]:
+    """
+    Run a payment or refund request once per idempotency key. The first request claims the key,
+    makes the gateway call and stores the outcome; retries with the key get the stored outcome
+    without calling the gateway again. If the gateway call fails in a way that doesn't say whether
+    it went through (e.g. a timeout), the outcome is stored as unknown until it is settled.
+
+    Args:
+        idempotency_key: Client-supplied key identifying the request across retries
+        request: The request's fields for begin_payment_request; a retry must send the same ones
+        call: Makes the request, returning (success, message, transaction_id, amount, items)
+
+    Returns:
+        tuple: (success, message, transaction_id, amount, items), stored or fresh
+    """
+    stored = begin_payment_request(idempotency_key, **request)
+    if stored:
+        if any(stored[field] != value for field, value in request.items()):
+            return False, IDEMPOTENCY_KEY_REUSED, None, None, None
+        if stored['status'] == 'pending':
+            return False, "A request with this idempotency key is still being processed.", None, None, None
+        return (stored['status'] == 'succeeded', stored['message'], stored['result_transaction_id'],
+                stored['amount'], stored['items'])
+    
+    try:
+        result = call()
+    except Exception as e:
+        if _may_have_been_processed(e):
+            mark_payment_request_unknown(idempotency_key, OUTCOME_UNKNOWN)
+            return False, OUTCOME_UNKNOWN, None, None, None
+        release_payment_request(idempotency_key)  # No outcome to store; let the client retry.
+        raise
+    success, message, transaction_id, amount, items = result
+    finish_payment_request(idempotency_key, success, message, transaction_id, amount, items)
+    return result
+
+
+def _may_have_been_processed(error: Exception) -> bool:
+    """Whether a gateway call that raised `error` may still have gone through: a timeout or server error, not a refusal."""
+    return isinstance(error, GatewayError) and not isinstance(error, GatewayUnavailable)
+
+
+def _new_request_key() -> str:
+    """Key a request sent without one is stored under, so its outcome is kept like any other's."""
+    return f"auto-{uuid.uuid4().hex}"
+
+
+def pay_late_fees(patron_id: str, book_id: int, payment_gateway: PaymentGateway = None,  # type: ignore
+                  idempotency_key: Optional[str] = None) -> Tuple[bool, str, Optional[str]]:
     """
     Process payment for late fees using external payment gateway.
     
@@ -278,6 +478,8 @@ def pay_late_fees(patron_id: str, book_id: int, payment_gateway: PaymentGateway
         patron_id: 6-digit library card ID
         book_id: ID of the book with late fees
         payment_gateway: Payment gateway instance (injectable for testing)
+        idempotency_key: Client-supplied key; retries with it return the first attempt's result
+            instead of charging again (without one, the request is stored under a generated key)
         
     Returns:
         tuple: (success: bool, message: str, transaction_id: Optional[str])
@@ -292,26 +494,46 @@ def pay_late_fees(patron_id: str, book_id: int, payment_gateway: PaymentGateway
     if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
         return False, "Invalid patron ID. Must be exactly 6 digits.", None
     
+    if idempotency_key is None:
+        idempotency_key = _new_request_key()
+    
+    request = {'request_type': 'payment', 'patron_id': patron_id, 'book_id': book_id}
+    success, message, transaction_id, _, _ = _run_idempotent(
+        idempotency_key, request, lambda: _pay_book_late_fees(patron_id, book_id, payment_gateway) + (None,)
+    )
+    return success, message, transaction_id
+
+
+def _pay_book_late_fees(patron_id: str, book_id: int, payment_gateway: Optional[PaymentGateway]) -> Tuple[bool, str, Optional[str], Optional[float]]:
+    """Charge and record one book's late fees for pay_late_fees. Returns (success, message, transaction_id, amount charged)."""
+    # A charge that may or may not have gone through is settled before the patron is charged again.
+    if get_unsettled_payment_requests(patron_id=patron_id):
+        return False, UNSETTLED_PAYMENT, None, None
+    
     # Calculate late fee first
     fee_info = calculate_late_fee_for_book(patron_id, book_id)
     
     # Check if there's a fee to pay
     if not fee_info or 'fee_amount' not in fee_info:
-        return False, "Unable to calculate late fees.", None
+        return False, "Unable to calculate late fees.", None, None
     
-    fee_amount = fee_info.get('fee_amount', 0.0)
+    # What is owed is anything still unpaid in the fee ledger for this book, plus whatever the
+    # active loan has accrued since it was last assessed.
+    balance = get_book_fee_balance(patron_id, book_id)
+    accrued = fee_info.get('fee_amount', 0.0)
+    fee_amount = round(balance['outstanding'] + max(0.0, accrued - balance['assessed_on_active']), 2)
     
     if fee_amount <= 0:
-        return False, "No late fees to pay for this book.", None
+        return False, "No late fees to pay for this book.", None, None
     
     # Get book details for payment description
     book = get_book_by_id(book_id)
     if not book:
-        return False, "Book not found.", None
+        return False, "Book not found.", None, None
     
     # Use provided gateway or create new one
     if payment_gateway is None:
-        payment_gateway = PaymentGateway()
+        payment_gateway = default_payment_gateway()
     
     # Process payment through external gateway
     # THIS IS WHAT YOU SHOULD MOCK IN THEIR TESTS!
@@ -322,17 +544,116 @@ def pay_late_fees(patron_id: str, book_id: int, payment_gateway: PaymentGateway
             description=f"Late fees for '{book['title']}'"
         )
         
-        if success:
-            return True, f"Payment successful! {message}", transaction_id
-        else:
-            return False, f"Payment failed: {message}", None
+        if not success:
+            return False, f"Payment failed: {message}", None, None
             
     except Exception as e:
+        if _may_have_been_processed(e):
+            raise  # Stored as an unknown outcome by _run_idempotent.
         # Handle payment gateway errors
-        return False, f"Payment processing error: {str(e)}", None
+        return False, f"Payment processing error: {str(e)}", None, None
+    
+    # The patron has been charged, so the payment is reported as successful even if recording it fails.
+    if not record_fee_payment(patron_id, book_id, accrued, fee_amount, transaction_id):
+        return True, f"Payment successful! {message} (The payment could not be recorded yet. It will be recorded when payments are next reconciled.)", transaction_id, fee_amount
+    return True, f"Payment successful! {message}", transaction_id, fee_amount
+
+
+def pay_all_late_fees(patron_id: str, payment_gateway: PaymentGateway = None,  # type: ignore
+                      idempotency_key: Optional[str] = None) -> Tuple[bool, str, Optional[str], List[Dict]]:
+    """
+    Pay every late fee a patron owes with a single gateway charge, itemized per book.
+    Covers unpaid fees in the fee ledger and fees accrued so far on books still out.
+
+    Args:
+        patron_id: 6-digit library card ID
+        payment_gateway: Payment gateway instance (injectable for testing)
+        idempotency_key: Client-supplied key; retries with it return the first attempt's result
+            instead of charging again (without one, the request is stored under a generated key)
+
+    Returns:
+        tuple: (success: bool, message: str, transaction_id: Optional[str],
+        items: list of dict with 'book_id', 'title' and 'amount' charged for each book)
+    """
+    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+        return False, "Invalid patron ID. Must be exactly 6 digits.", None, []
+
+    if idempotency_key is None:
+        idempotency_key = _new_request_key()
+
+    def call():
+        success, message, transaction_id, items = _pay_all_late_fees(patron_id, payment_gateway)
+        amount = round(sum(item['amount'] for item in items), 2) if success else None
+        return success, message, transaction_id, amount, items
+
+    request = {'request_type': 'payment', 'patron_id': patron_id, 'book_id': None}
+    success, message, transaction_id, _, items = _run_idempotent(idempotency_key, request, call)
+    return success, message, transaction_id, items or []
+
 
+def _late_fee_items(patron_id: str, now: datetime) -> Tuple[List[Dict], List[Tuple[int, int, float]]]:
+    """
+    Everything a patron owes as of now, per book, for a payment of all their late fees.
+
+    Returns:
+        tuple: (items: list of dict with 'book_id', 'title', 'amount' and 'loan_id', loan_fees:
+        (loan_id, book_id, fee_to_date) for active loans to assess when the payment is recorded)
+    """
+    balances, overdue_loans = get_unpaid_fee_sources(patron_id, now)
+    items = {}  # book_id -> item; the charge is allocated per book.
+    for balance in balances:
+        items[balance['book_id']] = {'book_id': balance['book_id'], 'title': balance['title'],
+                                     'amount': balance['outstanding'], 'loan_id': None}
+    loan_fees = []  # Fees accrued on loans still out, assessed when the payment is recorded.
+    for loan in overdue_loans:
+        fee_amount = assess_late_fee(loan['due_date'], now)['fee_amount']
+        item = items.setdefault(loan['book_id'], {'book_id': loan['book_id'], 'title': loan['title'],
+                                                  'amount': 0.0, 'loan_id': None})
+        if item['loan_id'] is None:
+            item['loan_id'] = loan['loan_id']
+        if fee_amount > loan['assessed']:
+            loan_fees.append((loan['loan_id'], loan['book_id'], fee_amount))
+            item['amount'] += fee_amount - loan['assessed']
+
+    items = [dict(item, amount=round(item['amount'], 2)) for item in items.values() if round(item['amount'], 2) > 0]
+    return items, loan_fees
+
+
+def _pay_all_late_fees(patron_id: str, payment_gateway: Optional[PaymentGateway]) -> Tuple[bool, str, Optional[str], List[Dict]]:
+    """Charge and record all of a patron's late fees for pay_all_late_fees."""
+    if get_unsettled_payment_requests(patron_id=patron_id):
+        return False, UNSETTLED_PAYMENT, None, []
+    items, loan_fees = _late_fee_items(patron_id, datetime.now())
+    if not items:
+        return False, "No late fees to pay.", None, []
+    total = round(sum(item['amount'] for item in items), 2)
+    description = "Late fees for " + ", ".join(f"'{item['title']}' (${item['amount']:.2f})" for item in items)
+
+    if payment_gateway is None:
+        payment_gateway = default_payment_gateway()
+
+    try:
+        success, transaction_id, message = payment_gateway.process_payment(
+            patron_id=patron_id,
+            amount=total,
+            description=description
+        )
+        if not success:
+            return False, f"Payment failed: {message}", None, []
+    except Exception as e:
+        if _may_have_been_processed(e):
+            raise  # Stored as an unknown outcome by _run_idempotent.
+        return False, f"Payment processing error: {str(e)}", None, []
 
-def refund_late_fee_payment(transaction_id: str, amount: float, payment_gateway: PaymentGateway = None) -> Tuple[bool, str]: # type: ignore
+    allocations = [(item['book_id'], item['loan_id'], item['amount']) for item in items]
+    paid_items = [{'book_id': item['book_id'], 'title': item['title'], 'amount': item['amount']} for item in items]
+    if not record_fee_payment_allocations(patron_id, loan_fees, allocations, transaction_id):
+        return True, f"Payment successful! {message} (The payment could not be recorded yet. It will be recorded when payments are next reconciled.)", transaction_id, paid_items
+    return True, f"Payment successful! {message}", transaction_id, paid_items
+
+
+def refund_late_fee_payment(transaction_id: str, amount: float, payment_gateway: PaymentGateway = None, # type: ignore
+                            idempotency_key: Optional[str] = None) -> Tuple[bool, str]:
     """
     Refund a late fee payment (e.g., if book was returned on time but fees were charged in error).
     
@@ -342,6 +663,8 @@ def refund_late_fee_payment(transaction_id: str, amount: float, payment_gateway:
         transaction_id: Original transaction ID to refund
         amount: Amount to refund
         payment_gateway: Payment gateway instance (injectable for testing)
+        idempotency_key: Client-supplied key; retries with it return the first attempt's result
+            instead of refunding again (without one, the request is stored under a generated key)
         
     Returns:
         tuple: (success: bool, message: str)
@@ -353,12 +676,32 @@ def refund_late_fee_payment(transaction_id: str, amount: float, payment_gateway:
     if amount <= 0:
         return False, "Refund amount must be greater than 0."
     
-    if amount > 15.00:  # Maximum late fee per book
+    if idempotency_key is None:
+        idempotency_key = _new_request_key()
+    
+    request = {'request_type': 'refund', 'transaction_id': transaction_id, 'amount': amount}
+    success, message, _, _, _ = _run_idempotent(
+        idempotency_key, request, lambda: _refund_late_fee_payment(transaction_id, amount, payment_gateway) + (None, None, None)
+    )
+    return success, message
+
+
+def _refund_late_fee_payment(transaction_id: str, amount: float, payment_gateway: Optional[PaymentGateway]) -> Tuple[bool, str]:
+    """Refund and record a validated refund for refund_late_fee_payment."""
+    if get_unsettled_payment_requests(transaction_id=transaction_id):
+        return False, UNSETTLED_REFUND
+    
+    # Payments recorded in the fee ledger can't be refunded for more than was paid, which for a
+    # payment of all fees can be more than one book's maximum. Others are held to that maximum.
+    payment = get_fee_payment(transaction_id)
+    if payment and round(amount, 2) > round(payment['amount'] - payment['refunded'], 2):
+        return False, "Refund amount exceeds the amount paid."
+    if not payment and amount > MAX_LATE_FEE:
         return False, "Refund amount exceeds maximum late fee."
     
     # Use provided gateway or create new one
     if payment_gateway is None:
-        payment_gateway = PaymentGateway()
+        payment_gateway = default_payment_gateway()
     
     # Process refund through external gateway
     # THIS IS WHAT YOU SHOULD MOCK IN YOUR TESTS!
@@ -366,10 +709,111 @@ def refund_late_fee_payment(transaction_id: str, amount: float, payment_gateway:
         success, message = payment_gateway.refund_payment(transaction_id, amount)
         
         if success:
+            if payment:
+                record_fee_refund(transaction_id, amount)
             return True, message
         else:
             return False, f"Refund failed: {message}"
             
     except Exception as e:
+        if _may_have_been_processed(e):
+            raise  # Stored as an unknown outcome by _run_idempotent.
         return False, f"Refund processing error: {str(e)}"
-    
\ No newline at end of file
+
+
+def record_late_fee_charge(patron_id: str, book_id: Optional[int], amount: float, transaction_id: str) -> bool:
+    """
+    Record a charge the gateway confirmed after the fact in the fee ledger, against what the
+    patron owes now: for one book, or (book_id None) spread over every book with fees in turn,
+    any amount over what is owed going to the last.
+
+    Returns:
+        bool: True if recorded, False if there was nothing to record it against or the write failed
+    """
+    if book_id is not None:
+        accrued = calculate_late_fee_for_book(patron_id, book_id).get('fee_amount', 0.0)
+        return record_fee_payment(patron_id, book_id, accrued, amount, transaction_id)
+    
+    items, loan_fees = _late_fee_items(patron_id, datetime.now())
+    allocations, remaining = [], round(amount, 2)
+    for position, item in enumerate(items):
+        share = remaining if position == len(items) - 1 else min(item['amount'], remaining)
+        if share > 0:
+            allocations.append((item['book_id'], item['loan_id'], share))
+        remaining = round(remaining - share, 2)
+    if not allocations:
+        return False
+    return record_fee_payment_allocations(patron_id, loan_fees, allocations, transaction_id)
+
+
+def settle_payment_request(idempotency_key: str, processed: bool, transaction_id: Optional[str] = None,
+                           payment_gateway: PaymentGateway = None) -> Tuple[bool, str]:  # type: ignore
+    """
+    Settle a payment or refund whose outcome was unknown, once it has been checked with the
+    gateway, so the patron can be charged (or the payment refunded) again.
+
+    Args:
+        idempotency_key: Key the request is stored under (see get_unsettled_payment_requests)
+        processed: Whether the gateway processed it
+        transaction_id: For a payment that was processed, the gateway transaction ID of the
+            charge; its status is checked with the gateway before it is stored
+        payment_gateway: Payment gateway instance (injectable for testing)
+
+    Returns:
+        tuple: (success: bool, message: str)
+    """
+    stored = get_payment_request(idempotency_key)
+    if not stored or stored['status'] != 'unknown':
+        return False, "No request with an unknown outcome is stored under this key."
+    
+    if not processed:
+        finish_payment_request(idempotency_key, False, "Not processed by the payment gateway.")
+        return True, "Settled as not processed."
+    
+    if stored['request_type'] == 'refund':
+        if get_fee_payment(stored['transaction_id']):
+            record_fee_refund(stored['transaction_id'], stored['amount'])
+        finish_payment_request(idempotency_key, True, "Refund processed by the payment gateway.")
+        return True, "Settled as refunded."
+    
+    if not transaction_id or not transaction_id.startswith("txn_"):
+        return False, "The charge's transaction ID is needed to settle a payment as processed."
+    
+    if payment_gateway is None:
+        payment_gateway = default_payment_gateway()
+    status = payment_gateway.verify_payment_status(transaction_id)
+    if status.get('status') != 'completed' or status.get('amount') is None:
+        return False, f"Gateway reports {transaction_id} as {status.get('status')}, not completed."
+    
+    # Recorded in the ledger first, so the fees it paid aren't charged again once the patron is unblocked.
+    amount = round(status['amount'], 2)
+    recorded = record_late_fee_charge(stored['patron_id'], stored['book_id'], amount, transaction_id)
+    finish_payment_request(idempotency_key, True, "Payment successful! Confirmed with the payment gateway.",
+                           transaction_id, amount)
+    if not recorded:
+        return True, "Settled as charged, but the charge could not be recorded in the fee ledger."
+    return True, "Settled as charged."
+
+
+def get_payment_status(transaction_id: str, payment_gateway: PaymentGateway = None) -> Dict:  # type: ignore
+    """
+    Get a late fee payment's status, answered from the fee ledger and payments table when the
+    payment was recorded here, and from the gateway's verify_payment_status otherwise.
+
+    Args:
+        transaction_id: Gateway transaction ID
+        payment_gateway: Payment gateway instance, only used for transactions not recorded here
+
+    Returns:
+        dict: Payment status information; 'status' is "not_found" for unknown transactions
+    """
+    if not transaction_id or not transaction_id.startswith("txn_"):
+        return {"status": "not_found", "message": "Transaction not found"}
+    
+    status = get_local_payment_status(transaction_id)
+    if status:
+        return status
+    
+    if payment_gateway is None:
+        payment_gateway = default_payment_gateway()
+    return payment_gateway.verify_payment_status(transaction_id)
@@ -0,0 +1,273 @@
+"""
+Load Test Service Module - Throughput of the web routes under concurrent clients
+Drives a weighted mix of catalog, search, borrow, return and late fee requests at a running
+app over HTTP from N client threads, after resetting it to the sample data, and reports
+requests/sec, latency percentiles, latency histograms and error rates per route. Run it at
+several client counts to see where throughput stops growing when sizing worker counts.
+
+Run with `flask --app app load-test --help`.
+"""
+
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from http.cookiejar import DefaultCookiePolicy
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import requests
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from services.benchmark_service import summarize
+
+# Route name -> relative weight in the default mix.
+DEFAULT_MIX = {'catalog': 4, 'search': 2, 'api_search': 2, 'late_fee': 2, 'borrow': 1, 'return': 1}
+LOAD_TEST_CLIENTS = 4
+LOAD_TEST_DURATION = 10.0  # Seconds per run, unless a request count is given.
+REQUEST_TIMEOUT = 10.0  # Seconds before a request counts as failed.
+LOAD_TEST_PATRONS = 50  # Borrows and returns spread over this many patrons, so the 5-book limit rarely applies.
+PATRON_ID_START = 200000  # Clear of the sample data's patron 123456.
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)  # Histogram upper bounds.
+
+RequestSpec = Tuple[str, str, Optional[Dict]]  # (method, path, form data)
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    """
+    Parse a route mix such as "catalog=3,search=1,borrow=1". Routes left out are not requested.
+
+    Returns:
+        dict: route name -> weight
+    """
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.strip().partition('=')
+        if name not in DEFAULT_MIX:
+            raise ValueError(f"Unknown route {name!r} in mix: use {', '.join(DEFAULT_MIX)}.")
+        try:
+            weights[name] = int(weight or 1)
+        except ValueError:
+            raise ValueError(f"Weight for {name!r} must be a whole number.")
+        if weights[name] < 0:
+            raise ValueError(f"Weight for {name!r} must not be negative.")
+    if not any(weights.values()):
+        raise ValueError("The mix needs at least one route with a weight above 0.")
+    return weights
+
+
+def histogram(latencies: List[float]) -> List[Tuple[Optional[int], int]]:
+    """
+    Count latencies (seconds) into LATENCY_BUCKETS_MS.
+
+    Returns:
+        list: (upper bound in ms, count) per bucket, the last bound being None for anything slower
+    """
+    counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+    for latency in latencies:
+        ms = latency * 1000
+        bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS_MS) if ms <= bound), len(LATENCY_BUCKETS_MS))
+        counts[bucket] += 1
+    return list(zip(LATENCY_BUCKETS_MS + (None,), counts))
+
+
+class _Workload:
+    """Builds random requests for each route from the books the app has after its reset."""
+
+    def __init__(self, books: List[Dict]):
+        self.book_ids = [book['id'] for book in books]
+        self.title_words = sorted({word for book in books for word in book['title'].split()})
+        self.authors = sorted({word for book in books for word in book['author'].split()})
+        self.isbns = [book['isbn'] for book in books]
+
+    def _patron(self, rng: random.Random) -> str:
+        return str(PATRON_ID_START + rng.randrange(LOAD_TEST_PATRONS))
+
+    def _search_params(self, rng: random.Random) -> str:
+        kind = rng.choice(('title', 'title', 'author', 'isbn'))
+        if kind == 'title':
+            term = rng.choice(self.title_words)
+        elif kind == 'author':
+            term = rng.choice(self.authors)
+        else:
+            term = rng.choice(self.isbns)
+        return f"q={requests.utils.quote(term)}&type={kind}"
+
+    def build(self, route: str, rng: random.Random) -> RequestSpec:
+        """A (method, path, form data) request for the named route."""
+        if route == 'catalog':
+            return 'GET', '/catalog', None
+        if route == 'search':
+            return 'GET', f"/search?{self._search_params(rng)}", None
+        if route == 'api_search':
+            return 'GET', f"/api/search?{self._search_params(rng)}", None
+        if route == 'late_fee':
+            return 'GET', f"/api/late_fee/{self._patron(rng)}/{rng.choice(self.book_ids)}", None
+        # Borrow and return post the same forms the borrow and return pages do.
+        return 'POST', f"/{route}", {'patron_id': self._patron(rng), 'book_id': rng.choice(self.book_ids)}
+
+
+class _Results:
+    """Latencies and status codes per route, shared by the client threads."""
+
+    def __init__(self, max_requests: Optional[int]):
+        self.latencies: Dict[str, List[float]] = {}
+        self.statuses: Dict[str, Counter] = {}
+        self.remaining = max_requests
+        self._lock = threading.Lock()
+
+    def take_ticket(self) -> bool:
+        """Whether a client may send another request, when the run is limited to a request count."""
+        if self.remaining is None:
+            return True
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+    def record(self, route: str, latency: float, status):
+        with self._lock:
+            self.latencies.setdefault(route, []).append(latency)
+            self.statuses.setdefault(route, Counter())[status] += 1
+
+
+def _client(base_url: str, workload: _Workload, routes: List[str], weights: List[int], seed: int,
+            deadline: float, results: _Results, timeout: float):
+    """One client: send requests from the mix, one at a time, until the deadline or the request count is used up."""
+    rng = random.Random(seed)
+    session = requests.Session()
+    # Don't keep the session cookie: unfollowed borrow redirects would pile flash messages into it.
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    try:
+        while time.perf_counter() < deadline and results.take_ticket():
+            route = rng.choices(routes, weights)[0]
+            method, path, data = workload.build(route, rng)
+            start = time.perf_counter()
+            try:
+                response = session.request(method, base_url + path, data=data, timeout=timeout,
+                                           allow_redirects=False)
+                response.content  # Read the whole body, as a browser would.
+                status = response.status_code
+            except requests.RequestException as e:
+                status = type(e).__name__
+            results.record(route, time.perf_counter() - start, status)
+    finally:
+        session.close()
+
+
+def _is_error(status) -> bool:
+    """Connection failures, timeouts and 5xx answers count as errors (rejected borrows still answer normally)."""
+    return not isinstance(status, int) or status >= 500
+
+
+def _catalog_books(base_url: str, timeout: float) -> List[Dict]:
+    """The first page of the app's catalog, for the workload's book IDs and search terms."""
+    response = requests.get(f"{base_url}/api/books", params={'limit': 100}, timeout=timeout)
+    response.raise_for_status()
+    books = response.json()['books']
+    if not books:
+        raise ValueError("The app has no books to borrow or search for.")
+    return books
+
+
+def reset_app(base_url: str, timeout: float = REQUEST_TIMEOUT) -> List[Dict]:
+    """
+    Reset the app's database to the sample data through its reset endpoint.
+
+    Returns:
+        list: The catalog's books after the reset, as the books API returns them
+    """
+    response = requests.get(f"{base_url}/api/test/reset-db", timeout=timeout)
+    response.raise_for_status()
+    return _catalog_books(base_url, timeout)
+
+
+def run_load_test(base_url: str, clients: int = LOAD_TEST_CLIENTS, mix: Optional[Dict[str, int]] = None,
+                  duration: float = LOAD_TEST_DURATION, max_requests: Optional[int] = None, seed: int = 327,
+                  timeout: float = REQUEST_TIMEOUT, reset: bool = True) -> Dict:
+    """
+    Send a mix of requests to an app from concurrent clients and measure each route.
+
+    Args:
+        base_url: Root URL of the running app, e.g. "http://127.0.0.1:5000"
+        clients: Client threads, each with one request in flight at a time
+        mix: Route name -> weight (default DEFAULT_MIX)
+        duration: Seconds to run for
+        max_requests: Stop after this many requests in total, even before duration is up
+        seed: Seed for each client's choice of routes and arguments
+        timeout: Seconds before a request is given up on and counted as an error
+        reset: Reset the app to the sample data first; otherwise run against its data as it is
+
+    Returns:
+        dict: 'clients', 'seconds', 'requests', 'errors', 'error_rate', 'requests_per_sec', 'histogram' and 'routes':
+        {route: summarize()'s stats with 'requests_per_sec', 'error_rate', 'status_codes' and 'histogram'}
+    """
+    if clients < 1:
+        raise ValueError("At least one client is needed.")
+    mix = {route: weight for route, weight in (mix or DEFAULT_MIX).items() if weight > 0}
+    base_url = base_url.rstrip('/')
+    workload = _Workload(reset_app(base_url, timeout) if reset else _catalog_books(base_url, timeout))
+    results = _Results(max_requests)
+
+    routes, weights = list(mix), list(mix.values())
+    started = time.perf_counter()
+    deadline = started + duration
+    threads = [
+        threading.Thread(target=_client, name=f"load-client-{n}", daemon=True,
+                         args=(base_url, workload, routes, weights, seed + n, deadline, results, timeout))
+        for n in range(clients)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    report_routes = {}
+    for route in routes:
+        latencies = results.latencies.get(route, [])
+        statuses = results.statuses.get(route, Counter())
+        errors = sum(count for status, count in statuses.items() if _is_error(status))
+        stats = summarize(latencies, errors)
+        stats['requests_per_sec'] = round(len(latencies) / elapsed, 1) if elapsed else 0.0
+        stats['error_rate'] = round(errors / len(latencies), 4) if latencies else 0.0
+        stats['status_codes'] = {str(status): count for status, count in sorted(statuses.items(), key=str)}
+        stats['histogram'] = histogram(latencies)
+        report_routes[route] = stats
+
+    total = sum(stats['calls'] for stats in report_routes.values())
+    errors = sum(stats['errors'] for stats in report_routes.values())
+    return {
+        'clients': clients,
+        'seconds': round(elapsed, 2),
+        'requests': total,
+        'errors': errors,
+        'error_rate': round(errors / total, 4) if total else 0.0,
+        'requests_per_sec': round(total / elapsed, 1) if elapsed else 0.0,
+        'histogram': histogram([latency for values in results.latencies.values() for latency in values]),
+        'routes': report_routes,
+    }
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    """Werkzeug's request handler without the access log line per request."""
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+@contextmanager
+def local_app_server(app, host: str = '127.0.0.1', port: int = 0) -> Iterator[str]:
+    """
+    Serve a Flask app on a background thread with werkzeug's threaded server, one thread per request.
+    Yields the base URL; the server is shut down on exit.
+    """
+    server = make_server(host, port, app, threaded=True, request_handler=_QuietRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, name='load-test-app', daemon=True)
+    thread.start()
+    try:
+        yield f"http://{host}:{server.server_port}"
+    finally:
+        server.shutdown()
+        server.server_close()
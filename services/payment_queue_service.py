@@ -0,0 +1,244 @@
+"""
+Payment Queue Service Module - Background late fee payments and refunds
+Web requests queue a payment or refund job and return its ID straight away; worker threads
+make the slow gateway calls. Jobs are stored in the payment_jobs table, so queued work
+survives a restart and any process can report a job's status. The app starts the workers when
+it serves its first request; they first recover jobs a crashed process left running.
+"""
+
+import atexit
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Tuple
+
+from database import insert_payment_job, claim_payment_job, finish_payment_job, recover_stale_payment_jobs
+from services.library_service import pay_late_fees, pay_all_late_fees, refund_late_fee_payment, IDEMPOTENCY_KEY_REUSED
+from services.payment_service import PaymentGateway, default_payment_gateway
+
+PAYMENT_WORKERS = 4  # Gateway calls made at the same time.
+POLL_INTERVAL = 1.0  # Seconds an idle worker waits before checking for jobs queued by other processes.
+STALE_JOB_AFTER = 120.0  # Seconds a job may stay running, well past the gateway deadline, before it's recovered.
+SHUTDOWN_TIMEOUT = 15.0  # Seconds to let running jobs finish when the process exits.
+
+
+class PaymentQueue:
+    """
+    Runs queued payment jobs on background worker threads.
+
+    Args:
+        workers: Number of worker threads
+        gateway_factory: Builds the payment gateway a job uses (injectable for testing)
+        poll_interval: Seconds an idle worker sleeps between checks for new jobs
+        stale_after: Seconds after which a job still running is taken to be abandoned by a dead worker
+    """
+
+    def __init__(self, workers: int = PAYMENT_WORKERS, gateway_factory: Callable[[], PaymentGateway] = default_payment_gateway,
+                 poll_interval: float = POLL_INTERVAL, stale_after: float = STALE_JOB_AFTER):
+        self.workers = workers
+        self.gateway_factory = gateway_factory
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self._next_recovery = 0.0
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        """Whether the worker threads have been started."""
+        with self._lock:
+            return bool(self._threads)
+
+    def start(self):
+        """Recover abandoned jobs, then start the worker threads, if they aren't running yet."""
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            self._recover_if_due()
+            for n in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"payment-worker-{n}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop the worker threads once they finish their current job."""
+        with self._lock:
+            self._stopping.set()
+            self._wakeup.set()
+            for thread in self._threads:
+                thread.join(timeout)
+            self._threads = []
+
+    def submit_payment(self, patron_id: str, book_id: Optional[int] = None, idempotency_key: Optional[str] = None) -> int:
+        """
+        Queue a late fee payment for one book (None pays all the patron's fees). Returns the job ID,
+        which is the existing job's if the same payment was already queued with the idempotency key.
+        Raises ValueError if the key was used for a different job.
+        """
+        job_id = insert_payment_job('payment', patron_id=patron_id, book_id=book_id, idempotency_key=idempotency_key)
+        self._wakeup.set()
+        return job_id
+
+    def submit_refund(self, transaction_id: str, amount: float, idempotency_key: Optional[str] = None) -> int:
+        """
+        Queue a refund of a late fee payment. Returns the job ID (the existing job's for a reused idempotency key).
+        Raises ValueError if the key was used for a different job.
+        """
+        job_id = insert_payment_job('refund', transaction_id=transaction_id, amount=amount, idempotency_key=idempotency_key)
+        self._wakeup.set()
+        return job_id
+
+    def recover_stale_jobs(self) -> Tuple[int, int]:
+        """
+        Queue again, or fail, jobs left running for longer than stale_after (see recover_stale_payment_jobs).
+
+        Returns:
+            tuple: (requeued: int, failed: int)
+        """
+        return recover_stale_payment_jobs(datetime.now() - timedelta(seconds=self.stale_after))
+
+    def _recover_if_due(self):
+        """Recover stale jobs at most once per stale_after, so a job abandoned by another process is picked up."""
+        now = time.monotonic()
+        if now < self._next_recovery:
+            return
+        self._next_recovery = now + self.stale_after
+        try:
+            requeued, _ = self.recover_stale_jobs()
+        except sqlite3.Error:
+            return  # Database busy or being reset; try again at the next recovery.
+        if requeued:
+            self._wakeup.set()
+
+    def run_pending(self) -> int:
+        """
+        Run queued jobs in the calling thread until none are left, e.g. from a CLI command or a test.
+
+        Returns:
+            int: Number of jobs run
+        """
+        count = 0
+        job = claim_payment_job()
+        while job:
+            self._run(job)
+            count += 1
+            job = claim_payment_job()
+        return count
+
+    def _work(self):
+        """Worker thread loop: run queued jobs, then wait to be woken (or poll)."""
+        while not self._stopping.is_set():
+            try:
+                job = claim_payment_job()
+            except sqlite3.Error:
+                job = None  # Database busy or being reset; try again after the poll interval.
+            if job:
+                self._run(job)
+                continue
+            self._recover_if_due()
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _run(self, job: Dict):
+        """Make the gateway call for one claimed job and record its outcome."""
+        transaction_id, key = None, job['idempotency_key']
+        try:
+            gateway = self.gateway_factory()
+            if job['job_type'] == 'payment' and job['book_id'] is None:
+                success, message, transaction_id, _ = pay_all_late_fees(job['patron_id'], gateway, idempotency_key=key)
+            elif job['job_type'] == 'payment':
+                success, message, transaction_id = pay_late_fees(job['patron_id'], job['book_id'], gateway, idempotency_key=key)
+            else:
+                success, message = refund_late_fee_payment(job['transaction_id'], job['amount'], gateway, idempotency_key=key)
+        except Exception as e:
+            success, message = False, f"Payment job error: {str(e)}"
+        finish_payment_job(job['id'], success, message, transaction_id)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_payment_queue() -> PaymentQueue:
+    """
+    Get the process-wide payment queue, without starting its workers. Jobs submitted to it are
+    stored and run by the workers start_payment_queue starts, in this process or another.
+    """
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = PaymentQueue()
+        return _queue
+
+
+def start_payment_queue(workers: int = PAYMENT_WORKERS) -> PaymentQueue:
+    """
+    Start the process-wide payment queue's workers, if they aren't running yet. Called by the app
+    when it serves its first request, so jobs queued before a restart run without waiting for another
+    submission. When the process exits, workers finish their current job rather than leaving it running.
+
+    Args:
+        workers: Number of worker threads
+    """
+    queue = get_payment_queue()
+    with _queue_lock:
+        if not queue.running:
+            queue.workers = workers
+            queue.start()
+            atexit.register(queue.stop, SHUTDOWN_TIMEOUT)
+        return queue
+
+
+def submit_late_fee_payment(patron_id: str, book_id: Optional[int] = None,
+                            idempotency_key: Optional[str] = None) -> Tuple[bool, str, Optional[int]]:
+    """
+    Queue payment of a book's late fees, or of all the patron's late fees in one charge.
+    The fees are calculated and charged by a worker, through pay_late_fees or pay_all_late_fees.
+
+    Args:
+        patron_id: 6-digit library card ID
+        book_id: ID of the book with late fees (None for every book)
+        idempotency_key: Client-supplied key; a retried request gets the same job, which charges at most once.
+            A key already used for a different request is refused with IDEMPOTENCY_KEY_REUSED.
+
+    Returns:
+        tuple: (success: bool, message: str, job_id: Optional[int])
+    """
+    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+        return False, "Invalid patron ID. Must be exactly 6 digits.", None
+
+    try:
+        job_id = get_payment_queue().submit_payment(patron_id, book_id, idempotency_key)
+    except ValueError:
+        return False, IDEMPOTENCY_KEY_REUSED, None
+    return True, "Payment queued.", job_id
+
+
+def submit_late_fee_refund(transaction_id: str, amount: float,
+                           idempotency_key: Optional[str] = None) -> Tuple[bool, str, Optional[int]]:
+    """
+    Queue a refund of a late fee payment, made by a worker through refund_late_fee_payment.
+
+    Args:
+        transaction_id: Original transaction ID to refund
+        amount: Amount to refund
+        idempotency_key: Client-supplied key; a retried request gets the same job, which refunds at most once.
+            A key already used for a different request is refused with IDEMPOTENCY_KEY_REUSED.
+
+    Returns:
+        tuple: (success: bool, message: str, job_id: Optional[int])
+    """
+    if not transaction_id or not transaction_id.startswith("txn_"):
+        return False, "Invalid transaction ID.", None
+
+    if amount <= 0:
+        return False, "Refund amount must be greater than 0.", None
+
+    try:
+        job_id = get_payment_queue().submit_refund(transaction_id, amount, idempotency_key)
+    except ValueError:
+        return False, IDEMPOTENCY_KEY_REUSED, None
+    return True, "Refund queued.", job_id
@@ -7,8 +7,41 @@ since we cannot make actual payment API calls during testing.
 """
 
 import requests
-from typing import Dict, Tuple
+from typing import Callable, Dict, Optional, Tuple
+import os
+import random
+import threading
 import time
+import asyncio
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from functools import partial
+from requests.adapters import HTTPAdapter
+
+MAX_CONCURRENT_GATEWAY_CALLS = 20  # Gateway requests in flight at once per AsyncPaymentGateway.
+GATEWAY_TIMEOUT = 10.0  # Seconds allowed for one gateway call, connecting included.
+GATEWAY_DEADLINE = 10.0  # Seconds a ResilientPaymentGateway call may take, retries included.
+GATEWAY_MAX_RETRIES = 2
+GATEWAY_BACKOFF_BASE = 0.2  # Seconds; the backoff ceiling doubles each retry, the wait is random below it.
+GATEWAY_BACKOFF_MAX = 2.0
+BREAKER_FAILURE_THRESHOLD = 5  # Failures in a row that open the circuit breaker.
+BREAKER_RESET_TIMEOUT = 30.0  # Seconds the breaker fails calls fast before trying the gateway again.
+
+
+class GatewayError(Exception):
+    """The gateway could not be reached or answered with a server error."""
+
+
+class GatewayTimeout(GatewayError):
+    """A gateway call took longer than its timeout. The request may still have been processed."""
+
+
+class GatewayUnavailable(GatewayError):
+    """The gateway refused or never received the request, so it was not processed and can be retried."""
+
+
+class CircuitOpenError(GatewayUnavailable):
+    """The circuit breaker is open: the gateway is failing, so calls fail fast without being made."""
 
 
 class PaymentGateway:
@@ -132,3 +165,374 @@ class PaymentGateway:
             "amount": 10.50,
             "timestamp": time.time()
         }
+
+
+class HttpPaymentGateway:
+    """
+    Blocking client for the payment gateway's HTTP API, with the same methods as PaymentGateway.
+    Requests go through one requests.Session whose connection pool keeps connections to the
+    gateway alive between calls.
+
+    Args:
+        api_key: API key for authentication (default is test key)
+        base_url: Gateway API root, e.g. a local StubGatewayServer in tests
+        timeout: Seconds allowed for each request; slower requests raise GatewayTimeout
+        pool_size: Most connections kept open to the gateway
+    """
+
+    def __init__(self, api_key: str = "test_key_12345", base_url: str = "https://api.payment-gateway.example.com",
+                 timeout: float = GATEWAY_TIMEOUT, pool_size: int = MAX_CONCURRENT_GATEWAY_CALLS):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self._session = requests.Session()
+        self._session.headers['Authorization'] = f"Bearer {api_key}"
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def close(self):
+        """Close pooled connections."""
+        self._session.close()
+
+    def _request(self, method: str, path: str, payload: Dict = None) -> Tuple[int, Dict]:
+        """
+        Make one gateway request. Returns (HTTP status, JSON body).
+
+        Raises GatewayUnavailable if the request was refused without being processed (no connection,
+        429 or 503), GatewayTimeout if no answer came in time and GatewayError for other failures.
+        """
+        try:
+            response = self._session.request(method, f"{self.base_url}{path}", json=payload, timeout=self.timeout)
+        except requests.ConnectTimeout as e:
+            raise GatewayUnavailable(f"Could not connect to the gateway within {self.timeout:g}s") from e
+        except requests.Timeout as e:
+            raise GatewayTimeout(f"Gateway did not answer within {self.timeout:g}s") from e
+        except requests.ConnectionError as e:
+            raise GatewayUnavailable(f"Could not connect to the gateway: {e}") from e
+        except requests.RequestException as e:
+            raise GatewayError(f"Gateway request failed: {e}") from e
+        if response.status_code in (429, 503):
+            raise GatewayUnavailable(f"Gateway error {response.status_code}")
+        if response.status_code >= 500:
+            raise GatewayError(f"Gateway error {response.status_code}")
+        try:
+            return response.status_code, response.json()
+        except ValueError as e:
+            raise GatewayError("Gateway returned a malformed response") from e
+
+    def process_payment(self, patron_id: str, amount: float, description: str = "") -> Tuple[bool, str, str]:
+        """
+        Charge a patron.
+
+        Returns:
+            tuple: (success: bool, transaction_id: str, message: str)
+        """
+        status, body = self._request('POST', '/charges', {
+            "customer_id": patron_id,
+            "amount": amount,
+            "currency": "usd",
+            "description": description
+        })
+        if status == 200:
+            return True, body['id'], body['message']
+        return False, "", body.get('error', f"Payment failed with status {status}")
+
+    def refund_payment(self, transaction_id: str, amount: float) -> Tuple[bool, str]:
+        """
+        Refund a previous payment.
+
+        Returns:
+            tuple: (success: bool, message: str)
+        """
+        status, body = self._request('POST', '/refunds', {"transaction_id": transaction_id, "amount": amount})
+        if status == 200:
+            return True, body['message']
+        return False, body.get('error', f"Refund failed with status {status}")
+
+    def verify_payment_status(self, transaction_id: str) -> Dict:
+        """
+        Check the status of a payment transaction.
+
+        Returns:
+            dict: Payment status information ({"status": "not_found", ...} for unknown transactions)
+        """
+        status, body = self._request('GET', f'/charges/{transaction_id}')
+        return body
+
+
+class AsyncPaymentGateway:
+    """
+    asyncio client for the payment gateway's HTTP API, with the same methods as PaymentGateway
+    (as coroutines), for jobs that make many gateway calls at once.
+
+    Calls are made by an HttpPaymentGateway, whose connection pool keeps connections to the
+    gateway alive between calls. The blocking requests run on a thread pool sized to
+    max_concurrency, and a semaphore bounds how many are in flight, so hundreds of gathered
+    calls queue up instead of opening hundreds of connections.
+
+    Args:
+        api_key: API key for authentication (default is test key)
+        base_url: Gateway API root, e.g. a local StubGatewayServer in tests
+        max_concurrency: Most requests in flight at the same time
+        timeout: Seconds allowed for each call; slower calls raise GatewayTimeout
+    """
+
+    def __init__(self, api_key: str = "test_key_12345", base_url: str = "https://api.payment-gateway.example.com",
+                 max_concurrency: int = MAX_CONCURRENT_GATEWAY_CALLS, timeout: float = GATEWAY_TIMEOUT):
+        self.api_key = api_key
+        self.timeout = timeout
+        self._http = HttpPaymentGateway(api_key, base_url, timeout, pool_size=max_concurrency)
+        self.base_url = self._http.base_url
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='gateway')
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        """Close pooled connections and the request threads."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._http.close()
+
+    async def _call(self, method, *args):
+        """Run one HttpPaymentGateway call on the thread pool, within the concurrency bound and timeout."""
+        async with self._semaphore:
+            try:
+                return await asyncio.wait_for(
+                    asyncio.get_running_loop().run_in_executor(self._executor, partial(method, *args)), self.timeout
+                )
+            except asyncio.TimeoutError as e:
+                raise GatewayTimeout(f"Gateway did not answer within {self.timeout:g}s") from e
+
+    async def process_payment(self, patron_id: str, amount: float, description: str = "") -> Tuple[bool, str, str]:
+        """
+        Charge a patron.
+
+        Returns:
+            tuple: (success: bool, transaction_id: str, message: str)
+        """
+        return await self._call(self._http.process_payment, patron_id, amount, description)
+
+    async def refund_payment(self, transaction_id: str, amount: float) -> Tuple[bool, str]:
+        """
+        Refund a previous payment.
+
+        Returns:
+            tuple: (success: bool, message: str)
+        """
+        return await self._call(self._http.refund_payment, transaction_id, amount)
+
+    async def verify_payment_status(self, transaction_id: str) -> Dict:
+        """
+        Check the status of a payment transaction.
+
+        Returns:
+            dict: Payment status information ({"status": "not_found", ...} for unknown transactions)
+        """
+        return await self._call(self._http.verify_payment_status, transaction_id)
+
+
+class CircuitBreaker:
+    """
+    Tracks the gateway's health across calls and fails calls fast while it is unhealthy.
+
+    Closed: calls go through. After failure_threshold failures in a row it opens: calls are
+    refused with CircuitOpenError for reset_timeout seconds. Then it is half open: one trial
+    call goes through, and closes the breaker if it succeeds or opens it again if it fails.
+
+    Args:
+        failure_threshold: Failures in a row that open the breaker
+        reset_timeout: Seconds the breaker stays open before a trial call
+        clock: Monotonic clock (injectable for testing)
+    """
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_timeout: float = BREAKER_RESET_TIMEOUT,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """'closed', 'open' or 'half_open'."""
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == 'open' and self.clock() - self._opened_at >= self.reset_timeout:
+            self._state = 'half_open'
+        return self._state
+
+    def before_call(self):
+        """Let a call through, or raise CircuitOpenError if the breaker is refusing calls."""
+        with self._lock:
+            state = self._current_state()
+            if state == 'closed':
+                return
+            if state == 'half_open' and not self._trial_running:
+                self._trial_running = True
+                return
+            self._counts['rejected'] += 1
+        raise CircuitOpenError("Payment gateway is unavailable, try again later.")
+
+    def record_success(self):
+        with self._lock:
+            self._counts['successes'] += 1
+            self._failures = 0
+            self._trial_running = False
+            self._state = 'closed'
+
+    def record_failure(self):
+        with self._lock:
+            self._counts['failures'] += 1
+            self._failures += 1
+            self._trial_running = False
+            if self._state == 'half_open' or self._failures >= self.failure_threshold:
+                if self._state != 'open':
+                    self._counts['opened'] += 1
+                self._state = 'open'
+                self._opened_at = self.clock()
+
+    def count(self, event: str):
+        """Count a call event (e.g. 'retries', 'timeouts') in the metrics."""
+        with self._lock:
+            self._counts[event] += 1
+
+    def metrics(self) -> Dict:
+        """
+        Get the breaker's state and call counts.
+
+        Returns:
+            dict: 'state', 'consecutive_failures', and counts of 'successes', 'failures', 'timeouts',
+            'retries', 'rejected' (failed fast while open) and 'opened'
+        """
+        with self._lock:
+            metrics = {'state': self._current_state(), 'consecutive_failures': self._failures}
+            for event in ('successes', 'failures', 'timeouts', 'retries', 'rejected', 'opened'):
+                metrics[event] = self._counts[event]
+        return metrics
+
+
+class ResilientPaymentGateway:
+    """
+    Wraps a payment gateway (PaymentGateway, HttpPaymentGateway or a mock) with a deadline per
+    call, bounded retries with jittered exponential backoff, and a circuit breaker.
+
+    Status checks are retried after any GatewayError. Payments and refunds are only retried after
+    GatewayUnavailable, which means the gateway never processed the request; after a timeout or
+    other error the charge may have gone through, so retrying it could charge twice.
+
+    Args:
+        gateway: The gateway to call (default is a PaymentGateway)
+        deadline: Seconds a call may take, retries and backoff included; slower calls raise GatewayTimeout
+        max_retries: Retries after the first attempt
+        backoff_base: Backoff before the first retry is up to this many seconds, doubling each retry
+        backoff_max: Most seconds to back off before one retry
+        breaker: Circuit breaker shared by calls to the same gateway (default is the process-wide one)
+    """
+
+    def __init__(self, gateway=None, deadline: float = GATEWAY_DEADLINE, max_retries: int = GATEWAY_MAX_RETRIES,
+                 backoff_base: float = GATEWAY_BACKOFF_BASE, backoff_max: float = GATEWAY_BACKOFF_MAX,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.gateway = gateway if gateway is not None else PaymentGateway()
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker if breaker is not None else get_gateway_breaker()
+
+    def process_payment(self, patron_id: str, amount: float, description: str = "") -> Tuple[bool, str, str]:
+        """Charge a patron through the wrapped gateway. Returns (success, transaction_id, message)."""
+        return self._call(self.gateway.process_payment, False, patron_id=patron_id, amount=amount, description=description)
+
+    def refund_payment(self, transaction_id: str, amount: float) -> Tuple[bool, str]:
+        """Refund a previous payment through the wrapped gateway. Returns (success, message)."""
+        return self._call(self.gateway.refund_payment, False, transaction_id, amount)
+
+    def verify_payment_status(self, transaction_id: str) -> Dict:
+        """Check a payment's status through the wrapped gateway."""
+        return self._call(self.gateway.verify_payment_status, True, transaction_id)
+
+    def _call(self, method, idempotent: bool, *args, **kwargs):
+        """Make a gateway call under the breaker, retrying transient failures until the deadline."""
+        deadline_at = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                result = self._attempt(method, args, kwargs, deadline_at - time.monotonic())
+            except GatewayError as e:
+                self.breaker.record_failure()
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                retryable = idempotent or isinstance(e, GatewayUnavailable)
+                if not retryable or attempt >= self.max_retries or time.monotonic() + delay >= deadline_at:
+                    raise
+                self.breaker.count('retries')
+                attempt += 1
+                time.sleep(delay)
+                continue
+            except Exception:
+                self.breaker.record_failure()
+                raise
+            self.breaker.record_success()
+            return result
+
+    def _attempt(self, method, args, kwargs, remaining: float):
+        """One call on the gateway thread pool, abandoned (left to finish in the background) after `remaining` seconds."""
+        if remaining > 0:
+            future = _get_gateway_executor().submit(method, *args, **kwargs)
+            try:
+                return future.result(timeout=remaining)
+            except FuturesTimeout:
+                future.cancel()
+        self.breaker.count('timeouts')
+        raise GatewayTimeout(f"Gateway did not answer within {self.deadline:g}s")
+
+
+_breaker = CircuitBreaker()
+_executor = None
+_executor_lock = threading.Lock()
+_http_gateway = None
+_http_gateway_lock = threading.Lock()
+
+def get_gateway_breaker() -> CircuitBreaker:
+    """Get the process-wide circuit breaker for the payment gateway."""
+    return _breaker
+
+def _get_gateway_executor() -> ThreadPoolExecutor:
+    """Threads ResilientPaymentGateway calls run on, so callers can stop waiting at their deadline."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_GATEWAY_CALLS, thread_name_prefix='gateway-call')
+        return _executor
+
+def _get_http_gateway(api_key: str, base_url: str) -> HttpPaymentGateway:
+    """The process-wide HTTP gateway client, so every call shares its keep-alive connections."""
+    global _http_gateway
+    with _http_gateway_lock:
+        if _http_gateway is None or (_http_gateway.api_key, _http_gateway.base_url) != (api_key, base_url.rstrip('/')):
+            if _http_gateway is not None:
+                _http_gateway.close()  # The gateway settings changed.
+            _http_gateway = HttpPaymentGateway(api_key, base_url)
+        return _http_gateway
+
+def default_payment_gateway() -> ResilientPaymentGateway:
+    """
+    The gateway used when none is injected: the HTTP gateway at PAYMENT_GATEWAY_URL if it is set,
+    otherwise the simulated PaymentGateway, behind the deadline, retries and circuit breaker.
+    """
+    base_url = os.environ.get('PAYMENT_GATEWAY_URL')
+    if base_url:
+        return ResilientPaymentGateway(_get_http_gateway(os.environ.get('PAYMENT_GATEWAY_API_KEY', "test_key_12345"), base_url))
+    return ResilientPaymentGateway(PaymentGateway())
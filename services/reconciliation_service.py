@@ -0,0 +1,186 @@
+"""
+Reconciliation Service Module - Checking recorded payments against the gateway
+Walks the late fee payments recorded in the fee ledger, asks the gateway for each transaction's
+status and stores any disagreement in the payment_discrepancies table. Status checks run
+concurrently under a concurrency bound and a rate limit, a batch at a time; each batch moves the
+run's checkpoint forward, so an interrupted run resumes where it stopped. Once every recorded
+payment is checked, charges missing from the ledger (stored in the payments table when recording
+them failed) are checked too, and recorded if the gateway confirms them.
+"""
+
+import asyncio
+import inspect
+import time
+from typing import Dict, List, Optional, Tuple
+
+from database import (
+    start_reconciliation_run, get_recorded_payments, record_reconciliation_batch, finish_reconciliation_run,
+    get_reconciliation_run, get_unrecorded_payments, record_fee_refund
+)
+from services.library_service import record_late_fee_charge
+from services.payment_service import AsyncPaymentGateway, GatewayError
+
+RECONCILE_BATCH_SIZE = 500  # Payments checked between checkpoints.
+RECONCILE_CONCURRENCY = 20  # Status checks in flight at once.
+RECONCILE_RATE_LIMIT = 50.0  # Status checks started per second, to stay under the gateway's API limits.
+AMOUNT_TOLERANCE = 0.005  # Amounts are cents; anything closer is the same amount.
+
+
+class _RateLimiter:
+    """Spaces out calls so no more than `rate` start per second (no limit if rate is 0 or None)."""
+
+    def __init__(self, rate: Optional[float]):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def compare_payment(payment: Dict, status: Dict) -> Optional[Dict]:
+    """
+    Compare a recorded payment with the gateway's status for its transaction.
+
+    Args:
+        payment: Recorded payment from get_recorded_payments
+        status: verify_payment_status answer
+
+    Returns:
+        dict: The discrepancy to store, or None if they agree
+    """
+    gateway_status = status.get('status')
+    gateway_amount = status.get('amount')
+    kind, detail = None, None
+    if gateway_status == 'not_found':
+        kind, detail = 'not_found', "Gateway has no record of this transaction."
+    elif gateway_status != 'completed':
+        kind, detail = 'not_completed', f"Gateway reports the payment as {gateway_status}."
+    elif gateway_amount is None or abs(gateway_amount - payment['amount']) > AMOUNT_TOLERANCE:
+        kind, detail = 'amount_mismatch', f"Recorded ${payment['amount']:.2f}, gateway charged ${gateway_amount or 0:.2f}."
+    elif 'refunded' in status and abs(status['refunded'] - payment['refunded']) > AMOUNT_TOLERANCE:
+        kind, detail = 'refund_mismatch', f"Recorded ${payment['refunded']:.2f} refunded, gateway refunded ${status['refunded']:.2f}."
+    if kind is None:
+        return None
+    return _discrepancy(payment, kind, detail, gateway_amount, gateway_status)
+
+
+def _discrepancy(payment: Dict, kind: str, detail: str, gateway_amount: Optional[float] = None,
+                 gateway_status: Optional[str] = None) -> Dict:
+    return {
+        'transaction_id': payment['transaction_id'],
+        'patron_id': payment['patron_id'],
+        'kind': kind,
+        'recorded_amount': payment['amount'],
+        'gateway_amount': gateway_amount,
+        'gateway_status': gateway_status,
+        'detail': detail
+    }
+
+
+async def _check_payment(gateway, limiter: _RateLimiter, semaphore: asyncio.Semaphore, payment: Dict) -> Optional[Dict]:
+    """Verify one payment. Gateway failures are stored as 'error' discrepancies so the run can go on."""
+    try:
+        async with semaphore:
+            await limiter.wait()
+            if inspect.iscoroutinefunction(gateway.verify_payment_status):
+                status = await gateway.verify_payment_status(payment['transaction_id'])
+            else:
+                status = await asyncio.to_thread(gateway.verify_payment_status, payment['transaction_id'])
+    except GatewayError as e:
+        return _discrepancy(payment, 'error', str(e))
+    return compare_payment(payment, status)
+
+
+def _record_unrecorded(payment: Dict) -> bool:
+    """Record a confirmed charge missing from the fee ledger, with what was refunded of it."""
+    if not record_late_fee_charge(payment['patron_id'], payment['book_id'], payment['amount'], payment['transaction_id']):
+        return False
+    if payment['refunded'] > 0:
+        record_fee_refund(payment['transaction_id'], payment['refunded'])
+    return True
+
+
+async def _reconcile_unrecorded(gateway, limiter: _RateLimiter, semaphore: asyncio.Semaphore) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Check charges missing from the fee ledger with the gateway, recording those it confirms.
+    Each is a discrepancy: 'unrecorded', or the disagreement the gateway shows.
+
+    Returns:
+        tuple: (payments checked, discrepancies)
+    """
+    payments = await asyncio.to_thread(get_unrecorded_payments)
+    results = await asyncio.gather(*(_check_payment(gateway, limiter, semaphore, payment) for payment in payments))
+    discrepancies = []
+    for payment, discrepancy in zip(payments, results):
+        if discrepancy is None:
+            recorded = await asyncio.to_thread(_record_unrecorded, payment)
+            detail = ("Charged but missing from the fee ledger; recorded now." if recorded
+                      else "Charged but missing from the fee ledger, and recording it failed.")
+            discrepancy = _discrepancy(payment, 'unrecorded', detail, payment['amount'], 'completed')
+        discrepancies.append(discrepancy)
+    return payments, discrepancies
+
+
+async def _reconcile(gateway, run: Dict, batch_size: int, concurrency: int, rate_limit: Optional[float],
+                     max_batches: Optional[int]) -> bool:
+    """Check batches from the run's checkpoint on, then unrecorded charges. Returns True once every payment is checked."""
+    limiter = _RateLimiter(rate_limit)
+    semaphore = asyncio.Semaphore(concurrency)
+    checkpoint, batches = run['checkpoint'], 0
+    while max_batches is None or batches < max_batches:
+        payments = await asyncio.to_thread(get_recorded_payments, checkpoint, batch_size)
+        if not payments:
+            payments, discrepancies = await _reconcile_unrecorded(gateway, limiter, semaphore)
+            if payments:
+                await asyncio.to_thread(record_reconciliation_batch, run['id'], checkpoint, len(payments), discrepancies)
+            return True
+        results = await asyncio.gather(*(_check_payment(gateway, limiter, semaphore, payment) for payment in payments))
+        checkpoint = payments[-1]['ledger_id']
+        await asyncio.to_thread(record_reconciliation_batch, run['id'], checkpoint, len(payments),
+                                [discrepancy for discrepancy in results if discrepancy])
+        batches += 1
+    return False
+
+
+def reconcile_payments(gateway=None, batch_size: int = RECONCILE_BATCH_SIZE,
+                       concurrency: int = RECONCILE_CONCURRENCY, rate_limit: Optional[float] = RECONCILE_RATE_LIMIT,
+                       full: bool = False, max_batches: Optional[int] = None) -> Dict:
+    """
+    Verify recorded late fee payments against the gateway, resuming an interrupted run if there is one.
+    A new run checks payments recorded since the last completed run, or every payment if full is set,
+    then records the charges missing from the fee ledger that the gateway confirms.
+
+    Args:
+        gateway: AsyncPaymentGateway, or a PaymentGateway whose calls are run on threads
+            (default is an AsyncPaymentGateway with `concurrency` connections)
+        batch_size: Payments checked between checkpoints
+        concurrency: Status checks in flight at once
+        rate_limit: Status checks started per second (None for no limit)
+        full: Recheck every recorded payment instead of only new ones
+        max_batches: Stop after this many batches, leaving the run to be resumed (None runs to the end)
+
+    Returns:
+        dict: The run: 'id', 'status', 'checked', 'discrepancies', ... plus 'resumed'
+    """
+    run, resumed = start_reconciliation_run(full)
+
+    async def reconcile():
+        if gateway is not None:
+            return await _reconcile(gateway, run, batch_size, concurrency, rate_limit, max_batches)
+        async with AsyncPaymentGateway(max_concurrency=concurrency) as default_gateway:
+            return await _reconcile(default_gateway, run, batch_size, concurrency, rate_limit, max_batches)
+
+    if asyncio.run(reconcile()):
+        run = finish_reconciliation_run(run['id'])
+    else:
+        run = get_reconciliation_run(run['id'])
+    run['resumed'] = resumed
+    return run
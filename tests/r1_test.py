@@ -5,8 +5,8 @@ AND `student_instructions.md` FILE!!!
 Run this file with venv terminal `python -m pytest tests/r1_test.py` to pytest. 
 '''
 import pytest
-import os
-from database import init_database, add_sample_data, DATABASE
+import database
+from database import add_sample_data
 from services.library_service import (
     add_book_to_catalog  # The only function required for R1. 
 )
@@ -14,10 +14,7 @@ from services.library_service import (
 # MANDATORY: Reset the database before running tests to ensure a clean state with no interference from previous tests!
 @pytest.fixture(autouse=True, scope="module")
 def reset_database():
-    if os.path.exists(DATABASE):
-        os.remove(DATABASE)
-
-    init_database()
+    database.reset_database()
     add_sample_data()
 
 # -------------------------------------------------------------------------
@@ -2,19 +2,18 @@
 Run this file with venv terminal `python -m pytest tests/r2_test.py` to pytest. 
 '''
 import pytest
-import os
-from database import init_database, add_sample_data, DATABASE
+import database
+from database import add_sample_data
 from database import (
-    get_all_books  # The only function of R2. 
+    get_all_books,  # The only function of R2. 
+    get_books_page,  # Paginated catalog listing. 
+    insert_book
 )
 
 # MANDATORY: Reset the database before running tests to ensure a clean state with no interference from previous tests!
 @pytest.fixture(autouse=True, scope="module")
 def reset_database():
-    if os.path.exists(DATABASE):
-        os.remove(DATABASE)
-
-    init_database()
+    database.reset_database()
     add_sample_data()
 
 # -------------------------------------------------------------------------
@@ -59,12 +58,42 @@ def test_get_all_books_copy_consistency():
         assert book['available_copies'] >= 0
 
 
+def test_get_books_page_walks_whole_catalog():
+    """Test that following page cursors visits every book exactly once, in catalog order."""
+    insert_book("a lowercase title", "Zed Author", "1111111111111", 1, 1)  # Sorted case-insensitively.
+    pages, cursor = [], None
+    while True:
+        books, cursor = get_books_page(cursor, limit=1)
+        pages.append(books)
+        if cursor is None:
+            break
+
+    assert all(len(page) == 1 for page in pages)
+    assert [book for page in pages for book in page] == get_all_books()
+    assert pages[0][0]['title'] == "1984"
+    assert pages[1][0]['title'] == "a lowercase title"
+
+
+def test_get_books_page_sort_options():
+    """Test sorting pages by author and by id, and rejecting unknown sorts and cursors."""
+    books, cursor = get_books_page(limit=2, sort='author')
+    assert [book['author'] for book in books] == ["F. Scott Fitzgerald", "George Orwell"]
+    books, _ = get_books_page(cursor, limit=2, sort='author')
+    assert books[0]['author'] == "Harper Lee"
+
+    books, _ = get_books_page(sort='id')
+    assert [book['id'] for book in books] == sorted(book['id'] for book in books)
+
+    with pytest.raises(ValueError):
+        get_books_page(sort='isbn')
+    with pytest.raises(ValueError):
+        get_books_page(after='not-a-cursor')
+
+
 def test_get_all_books_empty():
     """Test getting all books when the catalog is empty."""
     # Reset the database to be empty.
-    if os.path.exists(DATABASE):
-        os.remove(DATABASE)
-    init_database()
+    database.reset_database()
     
     books = get_all_books()
     assert books == []  # Should return an empty list when no books are present.
@@ -5,20 +5,19 @@ AND `student_instructions.md` FILE!!!
 Run this file with venv terminal `python -m pytest tests/r3_test.py` to pytest. 
 '''
 import pytest
-import os
-from database import init_database, add_sample_data, DATABASE
+import database
+from concurrent.futures import ThreadPoolExecutor
+from database import add_sample_data, get_book_by_id
 from services.library_service import (
     borrow_book_by_patron,  # The only function required for R3. 
-    add_book_to_catalog # More books needed for testing. 
+    add_book_to_catalog, # More books needed for testing. 
+    search_books_in_catalog
 )
 
 # MANDATORY: Reset the database before running tests to ensure a clean state with no interference from previous tests!
 @pytest.fixture(autouse=True, scope="module")
 def reset_database():
-    if os.path.exists(DATABASE):
-        os.remove(DATABASE)
-
-    init_database()
+    database.reset_database()
     add_sample_data()
 
 # -------------------------------------------------------------------------
@@ -70,9 +69,7 @@ def test_borrow_book_by_patron_book_available():
 def test_borrow_book_by_patron_max_limit():
     """Test borrowing when the patron reaches maximum borrowing limit. There is an error in the code that previously allowed
     borrowing more than 5 books because of the check `current_borrowed > 5` instead of `current_borrowed >= 5`."""
-    if os.path.exists(DATABASE):
-        os.remove(DATABASE)  # Reset database to ensure a clean state.
-    init_database()
+    database.reset_database()
     
     add_book_to_catalog("Detective Chinatown", "Peak Director", "8888888888888", 6)  # Add new books to borrow.
     patron_id = "666666"
@@ -89,11 +86,9 @@ def test_borrow_book_by_patron_max_limit():
 
 # ASSIGNMENT 3 TESTS. -------------------------------------------------------
 def test_borrow_book_by_patron_creating_DB_error(mocker): 
-    '''Test borrowing a book then creating a borrow record which results in a database error. Database is stubbed.'''
-    # Stub database functions, the book exists and patron isn't over borrow count. 
-    mocker.patch("services.library_service.get_book_by_id", return_value={"title": "Mock Book", "available_copies": 1})  
-    mocker.patch("services.library_service.get_patron_borrow_count", return_value=0)
-    mocker.patch("services.library_service.insert_borrow_record", return_value=False)  # Force DB error to occur. 
+    '''Test borrowing a book when the borrow transaction results in a database error. Database is stubbed.'''
+    # Stub the single borrow transaction, forcing a DB error to occur. 
+    mocker.patch("services.library_service.borrow_book_transaction", return_value=("error", None))
 
     success, msg = borrow_book_by_patron("888888", 9)
 
@@ -101,16 +96,15 @@ def test_borrow_book_by_patron_creating_DB_error(mocker):
     assert msg == "Database error occurred while creating borrow record."
 
 
-def test_borrow_book_by_patron_update_DB_error(mocker): 
-    '''Test borrowing a book then updating book availability which results in a database error. Database is stubbed.'''
-    # STUB database functions, the book exists and patron isn't over borrow count. 
-    mocker.patch("services.library_service.get_book_by_id", return_value={"title": "Mock Book", "available_copies": 1})  
-    mocker.patch("services.library_service.get_patron_borrow_count", return_value=0)
-    mocker.patch("services.library_service.insert_borrow_record", return_value=True)
-
-    mocker.patch("services.library_service.update_book_availability", return_value=False)  # Force DB error to occur. 
+def test_borrow_book_by_patron_concurrent_last_copy(): 
+    '''Test that concurrent borrows of the last copy of a book only succeed once, since the decrement is guarded 
+    inside one transaction.'''
+    add_book_to_catalog("Last Copy", "Only One", "7777777777777", 1)
+    book_id = search_books_in_catalog("7777777777777", "isbn")[0]['id']
+    patrons = ["100001", "100002", "100003", "100004", "100005", "100006"]
 
-    success, msg = borrow_book_by_patron("888888", 9)
+    with ThreadPoolExecutor(max_workers=len(patrons)) as executor:  # Every patron tries at the same time.
+        results = list(executor.map(lambda patron_id: borrow_book_by_patron(patron_id, book_id), patrons))
 
-    assert success is False  # Function failed as expected. 
-    assert msg == "Database error occurred while updating book availability."
+    assert sum(1 for success, _ in results if success) == 1  # Only one patron got the book. 
+    assert get_book_by_id(book_id)['available_copies'] == 0  # Never negative. 
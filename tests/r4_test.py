@@ -5,8 +5,10 @@ AND `student_instructions.md` FILE!!! THIS FILE IS EXPECTED TO ONLY PASS ONE TES
 Run this file with venv terminal `python -m pytest tests/r4_test.py` to pytest. 
 '''
 import pytest
-import os
-from database import init_database, add_sample_data, DATABASE, insert_borrow_record
+import database
+from database import (
+    add_sample_data, insert_borrow_record, update_book_availability, get_book_by_id, connection
+)
 from services.library_service import (
     return_book_by_patron,  # The only function required for R4.
     borrow_book_by_patron,  # To test returning, we need to borrow first. 
@@ -18,10 +20,7 @@ from datetime import datetime, timedelta  # To simulate late return.
 # MANDATORY: Reset the database before running tests to ensure a clean state with no interference from previous tests!
 @pytest.fixture(autouse=True, scope="module")
 def reset_database():
-    if os.path.exists(DATABASE):
-        os.remove(DATABASE)
-
-    init_database()
+    database.reset_database()
     add_sample_data()
     success, message = borrow_book_by_patron("666666", 1)  # Borrow a book first to return.
 
@@ -96,11 +95,9 @@ def test_return_book_by_patron_late():
 
 # ASSIGNMENT 3 TESTS. -------------------------------------------------------
 def test_return_book_by_patron_return_DB_error(mocker): 
-    '''Test returning a book with a database error that occurred while updating the book return date. Uses stubs for database functions.'''
-    # STUB database functions, patron had a borrowed book. 
-    mocker.patch("services.library_service.get_patron_borrowed_books", return_value=[{"book_id": 1, "title": "Mock Book"}]) 
-    mocker.patch("services.library_service.calculate_late_fee_for_book", return_value={"fee_amount": 0.0, "days_overdue": 0})
-    mocker.patch("services.library_service.update_borrow_record_return_date", return_value=False)  # Force DB update return date failure.
+    '''Test returning a book with a database error that occurred in the return transaction. Uses a stub for the database function.'''
+    # STUB the single return transaction, forcing a DB failure. 
+    mocker.patch("services.library_service.return_book_transaction", return_value=("error", None))
 
     success, msg = return_book_by_patron("888888", 1)
 
@@ -108,16 +105,19 @@ def test_return_book_by_patron_return_DB_error(mocker):
     assert msg == "Database error occurred while updating book return date."
 
 
-def test_return_book_by_patron_availablility_DB_error(mocker):
-    '''Test returning a book with a database error that occurred while updating the book availability. Uses stubs for database functions.'''
-    # STUB database functions, patron had a borrowed book and return date was updated. 
-    mocker.patch("services.library_service.get_patron_borrowed_books", return_value=[{"book_id": 1, "title": "Mock Book"}]) 
-    mocker.patch("services.library_service.calculate_late_fee_for_book", return_value={"fee_amount": 0.0, "days_overdue": 0})
-    mocker.patch("services.library_service.update_borrow_record_return_date", return_value=True)
-
-    mocker.patch("services.library_service.update_book_availability", return_value=False)  # Force DB update book availability failure.
+def test_return_book_by_patron_records_late_fee():
+    '''Test that the late fee assessed on return is stored with the borrow record and the copy is restocked.'''
+    days_ago = datetime.now() - timedelta(days=3)
+    insert_borrow_record("555555", 2, days_ago, days_ago)  # Borrowed a book that was due 3 days ago.
+    update_book_availability(2, -1)
+    available = get_book_by_id(2)['available_copies']
 
-    success, msg = return_book_by_patron("888888", 1)
+    success, message = return_book_by_patron("555555", 2)
+    assert success == True
+    assert message == 'Book with id=2 successfully returned. Late fee $1.50 for being 3 days overdue.'
+    assert get_book_by_id(2)['available_copies'] == available + 1
 
-    assert success is False  # Function failed as expected. 
-    assert msg == "Database error occurred while updating book availability."
+    with connection() as conn:
+        record = conn.execute("SELECT return_date, late_fee FROM borrow_records WHERE patron_id = ?", ("555555",)).fetchone()
+    assert record['return_date'] is not None
+    assert record['late_fee'] == 1.50
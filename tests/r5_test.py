@@ -5,9 +5,9 @@ AND `student_instructions.md` FILE!!! ONLY ONE FUNCTION IS EXPECTED TO PASS BECA
 Run this file with venv terminal `python -m pytest tests/r5_test.py` to pytest. 
 '''
 import pytest
-import os
+import database
 from datetime import datetime, timedelta
-from database import init_database, add_sample_data, DATABASE, insert_borrow_record, get_patron_borrowed_books
+from database import add_sample_data, insert_borrow_record, get_patron_borrowed_books
 from services.library_service import (
     calculate_late_fee_for_book,  # The only function required for R5. 
     borrow_book_by_patron
@@ -16,10 +16,7 @@ from services.library_service import (
 # MANDATORY: Reset the database before running tests to ensure a clean state with no interference from previous tests!
 @pytest.fixture(autouse=True, scope="module")
 def reset_database():
-    if os.path.exists(DATABASE):
-        os.remove(DATABASE)
-
-    init_database()
+    database.reset_database()
     add_sample_data()
 
 # -------------------------------------------------------------------------
@@ -5,19 +5,17 @@ AND `student_instructions.md` FILE!!!
 Run this file with venv terminal `python -m pytest tests/r6_test.py` to pytest. 
 '''
 import pytest
-import os
-from database import init_database, add_sample_data, DATABASE
+import database
+from database import add_sample_data
 from services.library_service import (
-    search_books_in_catalog  # The only function required for R6. 
+    search_books_in_catalog,  # The only function required for R6. 
+    add_book_to_catalog  # More books needed for testing. 
 )
 
 # MANDATORY: Reset the database before running tests to ensure a clean state with no interference from previous tests!
 @pytest.fixture(autouse=True, scope="module")
 def reset_database():
-    if os.path.exists(DATABASE):
-        os.remove(DATABASE)
-
-    init_database()
+    database.reset_database()
     add_sample_data()
 
 # -------------------------------------------------------------------------
@@ -92,3 +90,31 @@ def test_search_books_in_catalog_trailing_spaces():
     '''Test searching with leading and trailing spaces in the search term.'''
     result = search_books_in_catalog("   1984   ", "title")  # Leading and trailing spaces.
     assert result[0]['title'] == "1984"
+
+
+def test_search_books_in_catalog_new_book_indexed():
+    '''Test that books added after startup are found by the full-text search index right away.'''
+    add_book_to_catalog("Detective Chinatown", "Peak Director", "8888888888888", 2)
+
+    result = search_books_in_catalog("chinatown", "title")
+    assert [book['title'] for book in result] == ["Detective Chinatown"]
+
+    result = search_books_in_catalog("ak di", "author")  # Substring spanning two words.
+    assert result[0]['author'] == "Peak Director"
+
+
+def test_search_books_in_catalog_limit_offset():
+    '''Test paging through search results with a limit and offset.'''
+    all_results = search_books_in_catalog("", "title")
+    first_page = search_books_in_catalog("", "title", limit=2)
+    second_page = search_books_in_catalog("", "title", limit=2, offset=2)
+
+    assert len(first_page) == 2
+    assert first_page + second_page == all_results[:4]
+
+
+def test_search_books_in_catalog_special_characters():
+    '''Test that quotes and full-text query syntax in the search term are matched literally.'''
+    assert search_books_in_catalog('"', "title") == []
+    assert search_books_in_catalog("AND OR NOT", "title") == []
+    assert search_books_in_catalog("title:1984", "title") == []
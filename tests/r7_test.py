@@ -5,9 +5,9 @@ AND `student_instructions.md` FILE!!!
 Run this file with venv terminal `python -m pytest tests/r7_test.py` to pytest. 
 '''
 import pytest
-import os
+import database
 from datetime import datetime, timedelta
-from database import init_database, add_sample_data, DATABASE, insert_borrow_record
+from database import add_sample_data, insert_borrow_record
 from services.library_service import (
     get_patron_status_report, borrow_book_by_patron, add_book_to_catalog, return_book_by_patron
 )
@@ -15,10 +15,7 @@ from services.library_service import (
 # MANDATORY: Reset the database before running tests to ensure a clean state with no interference from previous tests!
 @pytest.fixture(autouse=True, scope="module")
 def reset_database():
-    if os.path.exists(DATABASE):
-        os.remove(DATABASE)
-
-    init_database()
+    database.reset_database()
     add_sample_data()
     add_book_to_catalog("Detective Chinatown", "Peak Director", "8888888888888", 5)  # Add new books to borrow.
 
@@ -115,3 +112,20 @@ def test_get_patron_status_report_many():
     for book in report['borrow_history']:
         assert book['title'] in ["Detective Chinatown", "Six Sevennn", "Ronaldo Glazing"]  # Titles in history.
         assert book['return_date'] is not None 
+
+
+def test_get_patron_status_report_single_query(mocker):
+    '''Test that the report is built from one loan query, without per-book late fee lookups (no N+1 queries).'''
+    borrowed = datetime.now() - timedelta(days=30)
+    insert_borrow_record("121212", 1, borrowed, borrowed + timedelta(days=14))  # 16 days overdue, $12.50.
+    insert_borrow_record("121212", 2, borrowed, borrowed + timedelta(days=10))  # 20 days overdue, capped $15.00.
+    fee_lookup = mocker.patch("services.library_service.calculate_late_fee_for_book")
+    borrowed_lookup = mocker.patch("services.library_service.get_patron_borrowed_books")
+
+    report = get_patron_status_report("121212")
+
+    assert report['total_late_fees'] == 27.50
+    assert report['current_borrowed_count'] == 2
+    assert all(book['is_overdue'] for book in report['current_borrowed'])
+    fee_lookup.assert_not_called()
+    borrowed_lookup.assert_not_called()
@@ -0,0 +1,74 @@
+'''
+Tests for the asyncio payment gateway client, against the local stand-in gateway server.
+
+Run this file with venv terminal `python -m pytest tests/test_async_gateway.py` to pytest.
+'''
+import pytest
+import asyncio
+import time
+from gateway_stub import StubGatewayServer
+from services.payment_service import AsyncPaymentGateway, GatewayError, GatewayTimeout
+
+# No database here, the gateway server keeps its transactions in memory.
+@pytest.fixture
+def gateway_server():
+    with StubGatewayServer() as server:
+        yield server
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+# -------------------------------------------------------------------------
+
+def test_payment_refund_and_status(gateway_server):
+    '''Test the three gateway calls over HTTP, including declines and unknown transactions.'''
+    async def calls():
+        async with AsyncPaymentGateway(base_url=gateway_server.base_url) as gateway:
+            paid = await gateway.process_payment("123456", 4.50, "Late fees for 'Dune'")
+            declined = await gateway.process_payment("123456", 1001.00)
+            refund = await gateway.refund_payment(paid[1], 1.00)
+            status = await gateway.verify_payment_status(paid[1])
+            missing = await gateway.verify_payment_status("txn_000000_0")
+            return paid, declined, refund, status, missing
+
+    paid, declined, refund, status, missing = run(calls())
+    assert paid[0] is True and paid[1].startswith("txn_123456_")
+    assert paid[2] == "Payment of $4.50 processed successfully"
+    assert declined == (False, "", "Payment declined: amount exceeds limit")
+    assert refund[0] is True
+    assert status['status'] == 'completed' and status['amount'] == 4.50 and status['refunded'] == 1.00
+    assert missing['status'] == 'not_found'
+
+
+def test_concurrency_is_bounded(gateway_server):
+    '''Test that gathered calls run concurrently, but never more than max_concurrency at once.'''
+    gateway_server.latency = 0.05
+
+    async def calls():
+        async with AsyncPaymentGateway(base_url=gateway_server.base_url, max_concurrency=10) as gateway:
+            return await asyncio.gather(*(gateway.process_payment("123456", 1.00) for _ in range(50)))
+
+    start = time.perf_counter()
+    results = run(calls())
+    elapsed = time.perf_counter() - start
+
+    assert all(success for success, _, _ in results)
+    assert len({transaction_id for _, transaction_id, _ in results}) == 50
+    assert gateway_server.max_in_flight <= 10
+    assert elapsed < 50 * 0.05 / 2  # Far quicker than one call after another.
+
+
+def test_timeout_and_server_errors(gateway_server):
+    '''Test that slow calls time out and 5xx answers raise GatewayError instead of returning.'''
+    async def slow_call():
+        async with AsyncPaymentGateway(base_url=gateway_server.base_url, timeout=0.1) as gateway:
+            return await gateway.process_payment("123456", 1.00)
+
+    gateway_server.latency = 0.5
+    with pytest.raises(GatewayTimeout):
+        run(slow_call())
+
+    gateway_server.latency = 0.0
+    gateway_server.fail_next = 1
+    with pytest.raises(GatewayError):
+        run(slow_call())
@@ -0,0 +1,82 @@
+'''
+Tests for batch borrowing and returning (self-checkout kiosks).
+
+Run this file with venv terminal `python -m pytest tests/test_batch_kiosk.py` to pytest.
+'''
+import pytest
+import database
+from database import (
+    add_sample_data, get_book_by_id, get_patron_borrow_count, rebuild_patron_loan_counts,
+    connection
+)
+from services.library_service import (
+    borrow_books_by_patron, return_books_by_patron, add_book_to_catalog, MAX_BATCH_BOOKS
+)
+
+# MANDATORY: Reset the database before running tests to ensure a clean state with no interference from previous tests!
+@pytest.fixture(autouse=True, scope="module")
+def reset_database():
+    database.reset_database()
+    add_sample_data()
+    add_book_to_catalog("Detective Chinatown", "Peak Director", "8888888888888", 10)  # Book ID 4.
+
+# -------------------------------------------------------------------------
+
+def test_borrow_books_by_patron_per_item_results():
+    '''Test that each book in the batch gets its own R3 result and failures don't block the others.'''
+    success, message, results = borrow_books_by_patron("222222", [1, 3, 999, 4])
+
+    assert success is False  # Not every book could be borrowed.
+    assert message == "Borrowed 2 of 4 books."
+    assert [result['success'] for result in results] == [True, False, False, True]
+    assert results[1]['message'] == "This book is currently not available."
+    assert results[2]['message'] == "Book not found."
+    assert get_patron_borrow_count("222222") == 2
+
+
+def test_borrow_books_by_patron_limit_checked_once():
+    '''Test that the 5 book limit applies across the batch, refusing only the books past it.'''
+    success, message, results = borrow_books_by_patron("333333", [4, 4, 4, 4, 4, 4, 4])
+
+    assert message == "Borrowed 5 of 7 books."
+    assert [result['success'] for result in results] == [True] * 5 + [False] * 2
+    assert results[-1]['message'] == "You have reached the maximum borrowing limit of 5 books."
+    assert get_book_by_id(4)['available_copies'] == 4  # 10 copies - 1 (previous test) - 5.
+
+
+def test_return_books_by_patron():
+    '''Test returning a stack of books in one call.'''
+    success, message, results = return_books_by_patron("222222", [1, 4])
+
+    assert success is True
+    assert message == "Returned 2 of 2 books."
+    assert results[0]['message'] == "Book with id=1 returned successfully. No late fees."
+    assert results[1]['fee_amount'] == 0.0
+    assert get_patron_borrow_count("222222") == 0
+
+    success, message, results = return_books_by_patron("222222", [1])  # Nothing left to return.
+    assert success is False
+    assert results[0]['message'] == "Error, no active borrow record found for this patron."
+
+
+def test_batch_invalid_requests():
+    '''Test that invalid patron IDs, empty batches and oversized batches are rejected before touching the database.'''
+    assert borrow_books_by_patron("12345", [1]) == (False, "Invalid patron ID. Must be exactly 6 digits.", [])
+    assert return_books_by_patron("222222", []) == (False, "At least one book ID is required.", [])
+
+    success, message, results = borrow_books_by_patron("222222", [1] * (MAX_BATCH_BOOKS + 1))
+    assert success is False
+    assert message == f"At most {MAX_BATCH_BOOKS} books can be processed at once."
+    assert results == []
+
+
+def test_active_loan_counter_rebuild():
+    '''Test that the maintained active loan counter matches borrow_records, and can be rebuilt if it drifts.'''
+    assert get_patron_borrow_count("333333") == 5  # Kept in step by the batch borrows above.
+    with connection() as conn:
+        conn.execute("UPDATE patrons SET active_loans = 0 WHERE patron_id = '333333'")  # Simulate drift.
+    assert get_patron_borrow_count("333333") == 0
+
+    rebuild_patron_loan_counts()
+    assert get_patron_borrow_count("333333") == 5
+    assert get_patron_borrow_count("123456") == 1  # Sample data loan.
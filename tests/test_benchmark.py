@@ -0,0 +1,67 @@
+'''
+Tests for the service benchmark suite.
+
+Run this file with venv terminal `python -m pytest tests/test_benchmark.py` to pytest.
+'''
+import pytest
+import os
+import database
+from database import add_sample_data, DATABASE
+from services.benchmark_service import percentile, summarize, parse_size, run_benchmarks, compare_results
+
+# MANDATORY: Reset the database before running tests to ensure a clean state with no interference from previous tests!
+@pytest.fixture(autouse=True, scope="module")
+def reset_database():
+    database.reset_database()
+    add_sample_data()
+
+def report(p50, p95, ops_per_sec):
+    return {'results': {'small': {'operations': {'search_books': {'p50_ms': p50, 'p95_ms': p95, 'ops_per_sec': ops_per_sec}}}}}
+
+# -------------------------------------------------------------------------
+
+def test_percentiles():
+    '''Test nearest-rank percentiles and the summary of a set of latencies.'''
+    values = [n / 1000 for n in range(1, 101)]  # 1ms .. 100ms.
+    assert percentile(values, 0.50) == 0.050
+    assert percentile(values, 0.99) == 0.099
+    assert percentile([], 0.95) == 0.0
+
+    stats = summarize(values, errors=2)
+    assert stats['calls'] == 100 and stats['errors'] == 2
+    assert (stats['p50_ms'], stats['p95_ms'], stats['p99_ms'], stats['max_ms']) == (50.0, 95.0, 99.0, 100.0)
+    assert stats['ops_per_sec'] == round(100 / sum(values), 1)
+
+
+def test_parse_size():
+    '''Test named and custom dataset sizes.'''
+    assert parse_size('small') == ('small', (1000, 200, 10000))
+    assert parse_size('500x50x2000') == ('500x50x2000', (500, 50, 2000))
+    with pytest.raises(ValueError):
+        parse_size('huge')
+
+
+def test_compare_flags_only_regressions():
+    '''Test that slower latencies or lower throughput beyond the threshold are flagged, and improvements are not.'''
+    baseline = report(1.0, 2.0, 1000.0)
+
+    assert compare_results(report(1.05, 1.5, 1200.0), baseline) == []
+    regressions = compare_results(report(1.5, 2.0, 800.0), baseline, threshold=0.10)
+    assert [(r['metric'], r['change']) for r in regressions] == [('p50_ms', 0.5), ('ops_per_sec', 0.2)]
+    assert compare_results(report(1.5, 2.0, 800.0), {'results': {}}) == []
+
+
+def test_run_against_seeded_database(tmp_path):
+    '''Test a small end-to-end run: every operation is timed, the seeded database is kept, and the app database is untouched.'''
+    result = run_benchmarks(['300x40x3000'], iterations=20, warmup=5, data_dir=str(tmp_path))
+
+    operations = result['results']['300x40x3000']['operations']
+    assert set(operations) == {'borrow_book', 'return_book', 'calculate_late_fee', 'search_books', 'patron_status_report'}
+    assert all(stats['calls'] > 0 and stats['p99_ms'] >= stats['p50_ms'] for stats in operations.values())
+    assert operations['calculate_late_fee']['errors'] == 0
+    # Borrows refused under R3 (no copies left, limit reached) are answers, not errors.
+    assert operations['borrow_book']['errors'] == 0 and operations['return_book']['errors'] == 0
+    assert os.path.exists(tmp_path / '300x40x3000-seed327.db')
+
+    assert database.DATABASE == DATABASE
+    assert database.get_book_by_id(1)['title'] == "The Great Gatsby"
@@ -0,0 +1,84 @@
+'''
+Tests for the LRU book lookup cache and its invalidation on writes.
+
+Run this file with venv terminal `python -m pytest tests/test_book_cache.py` to pytest.
+'''
+import pytest
+import database
+from cache import LRUCache
+from database import (
+    add_sample_data, get_book_by_id, get_book_by_isbn, update_book_availability,
+    get_book_cache_stats
+)
+from services.library_service import borrow_book_by_patron, return_book_by_patron
+
+# MANDATORY: Reset the database before running tests to ensure a clean state with no interference from previous tests!
+@pytest.fixture(autouse=True, scope="module")
+def reset_database():
+    database.reset_database()
+    add_sample_data()
+
+# -------------------------------------------------------------------------
+
+def test_lru_cache_evicts_least_recently_used():
+    '''Test that the cache keeps at most `capacity` entries and evicts the least recently used one.'''
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")  # "b" is now the least recently used.
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['hits'] == 3 and stats['misses'] == 1
+
+
+def test_lru_cache_drops_stale_put():
+    '''Test that a value loaded before an invalidation is not stored after it.'''
+    cache = LRUCache(10)
+    generation = cache.generation  # Reader starts loading...
+    cache.invalidate("a")  # ...a writer changes the row...
+    cache.put("a", "stale", generation)  # ...and the reader finishes.
+
+    assert cache.get("a") is None
+
+
+def test_book_lookups_hit_cache():
+    '''Test that repeated lookups by id and by ISBN are served from the cache.'''
+    get_book_by_id(1)
+    before = get_book_cache_stats()
+    assert get_book_by_id(1)['title'] == "The Great Gatsby"
+    assert get_book_by_isbn("9780743273565")['id'] == 1
+    after = get_book_cache_stats()
+
+    assert after['hits'] == before['hits'] + 2
+
+
+def test_cached_book_is_a_copy():
+    '''Test that changing a returned book does not change the cached one.'''
+    book = get_book_by_id(2)
+    book['title'] = "Changed by caller"
+    assert get_book_by_id(2)['title'] == "To Kill a Mockingbird"
+
+
+def test_writes_invalidate_cache():
+    '''Test that availability updates, borrows and returns are visible to the next lookup.'''
+    assert get_book_by_id(1)['available_copies'] == 3
+    update_book_availability(1, -1)
+    assert get_book_by_id(1)['available_copies'] == 2
+    assert get_book_by_isbn("9780743273565")['available_copies'] == 2
+
+    borrow_book_by_patron("444444", 1)
+    assert get_book_by_id(1)['available_copies'] == 1
+    return_book_by_patron("444444", 1)
+    assert get_book_by_isbn("9780743273565")['available_copies'] == 2
+
+
+def test_reset_database_clears_cache():
+    '''Test that resetting the database does not serve books cached from before the reset.'''
+    get_book_by_id(1)
+    database.reset_database()
+
+    assert get_book_by_id(1) is None
@@ -0,0 +1,86 @@
+'''
+Tests for the pooled SQLite connections in `database.py`.
+
+Run this file with venv terminal `python -m pytest tests/test_connection_pool.py` to pytest.
+'''
+import pytest
+import database
+from database import (
+    add_sample_data, DATABASE, ConnectionPool, connection, transaction,
+    checkout_connection, release_connection, get_all_books
+)
+
+# MANDATORY: Reset the database before running tests to ensure a clean state with no interference from previous tests!
+@pytest.fixture(autouse=True, scope="module")
+def reset_database():
+    database.reset_database()
+    add_sample_data()
+
+# -------------------------------------------------------------------------
+
+def test_connection_is_reused():
+    '''Test that consecutive helper calls share one long-lived connection instead of reconnecting.'''
+    with connection() as first:
+        pass
+    with connection() as second:
+        pass
+    assert first is second
+
+
+def test_connection_pragmas_applied():
+    '''Test that the tuned PRAGMAs are set on pooled connections.'''
+    with connection() as conn:
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL.
+        assert conn.execute('PRAGMA busy_timeout').fetchone()[0] == 5000
+
+
+def test_pool_size_limits_idle_connections():
+    '''Test that the pool never keeps more idle connections than its configured size.'''
+    pool = ConnectionPool(DATABASE, size=2)
+    conns = [pool.acquire() for _ in range(4)]  # Pool opens extra connections when empty.
+    for conn in conns:
+        pool.release(conn)
+
+    assert pool._idle.qsize() == 2
+    pool.close()
+    assert pool._idle.qsize() == 0
+
+
+def test_transaction_rolls_back_on_error():
+    '''Test that a failed transaction leaves no partial writes behind.'''
+    with pytest.raises(RuntimeError):
+        with transaction() as conn:
+            conn.execute("UPDATE books SET available_copies = 0 WHERE id = 1")
+            raise RuntimeError("Simulated failure.")
+
+    assert database.get_book_by_id(1)['available_copies'] == 3  # Unchanged sample data.
+
+
+def test_checkout_pins_connection_to_thread():
+    '''Test that a checked-out (request-scoped) connection is used by every helper until released.'''
+    pinned = checkout_connection()
+    try:
+        with connection() as conn:
+            assert conn is pinned
+        assert len(get_all_books()) == 3
+    finally:
+        release_connection()
+
+    assert getattr(database._local, 'pinned', None) is None
+
+
+def test_reset_empties_database_in_place():
+    '''Test that resetting keeps the file, so connections another process has open stay valid, and restarts the IDs.'''
+    other = database.get_db_connection()  # Stands in for a running app's connection.
+    try:
+        assert other.execute('SELECT COUNT(*) FROM books').fetchone()[0] == 3
+        database.reset_database()
+        assert other.execute('SELECT COUNT(*) FROM books').fetchone()[0] == 0
+        assert other.execute('PRAGMA integrity_check').fetchone()[0] == 'ok'
+    finally:
+        other.close()
+
+    add_sample_data()
+    assert database.get_book_by_id(1)['title'] == "The Great Gatsby"
+    assert database.search_books("Gatsby", "title")[0]['id'] == 1
@@ -0,0 +1,88 @@
+'''
+Tests for the synthetic dataset generator.
+
+Run this file with venv terminal `python -m pytest tests/test_dataset.py` to pytest.
+'''
+import pytest
+import database
+from datetime import datetime
+from database import add_sample_data, connection
+from services.dataset_service import generate_dataset
+from services.library_service import get_patron_status_report
+
+AS_OF = datetime(2025, 6, 1, 12, 0)
+
+def fresh_database():
+    database.reset_database()
+
+# MANDATORY: Reset the database before running tests to ensure a clean state with no interference from previous tests!
+@pytest.fixture(autouse=True, scope="module")
+def reset_database():
+    fresh_database()
+    yield
+    fresh_database()  # Leave the usual sample data for whatever runs next.
+    add_sample_data()
+
+def dataset_checksum():
+    '''Digest of the generated rows, to compare two runs.'''
+    with connection() as conn:
+        return (
+            conn.execute('SELECT COUNT(*), SUM(id * total_copies), GROUP_CONCAT(title) FROM books').fetchone()[:],
+            conn.execute('SELECT SUM(book_id * borrow_date), SUM(COALESCE(return_date, 0)), SUM(late_fee) FROM borrow_records').fetchone()[:],
+        )
+
+# -------------------------------------------------------------------------
+
+def test_counters_match_generated_loans():
+    '''Test that copies, loan counters and balances agree with the generated loans and ledger.'''
+    result = generate_dataset(books=300, patrons=60, loans=5000, seed=7, as_of=AS_OF, batch_size=1000)
+    assert (result['books'], result['patrons'], result['loans']) == (300, 60, 5000)
+    assert 0 < result['overdue_loans'] <= result['active_loans']
+
+    with connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM borrow_records').fetchone()[0] == 5000
+        assert conn.execute('''
+            SELECT COUNT(*) FROM books b
+            WHERE b.available_copies != b.total_copies -
+                  (SELECT COUNT(*) FROM borrow_records r WHERE r.book_id = b.id AND r.return_date IS NULL)
+               OR b.available_copies < 0
+        ''').fetchone()[0] == 0
+        assert conn.execute('''
+            SELECT COUNT(*) FROM patrons p
+            WHERE p.active_loans != (SELECT COUNT(*) FROM borrow_records r
+                                     WHERE r.patron_id = p.patron_id AND r.return_date IS NULL)
+               OR p.active_loans > 5
+        ''').fetchone()[0] == 0
+        assert conn.execute('''
+            SELECT COUNT(*) FROM patrons p
+            WHERE ABS(p.outstanding_fees - COALESCE((SELECT SUM(CASE entry_type WHEN 'assessed' THEN amount ELSE -amount END)
+                                                     FROM fee_ledger l WHERE l.patron_id = p.patron_id), 0)) > 0.001
+        ''').fetchone()[0] == 0
+        # Popularity is skewed: the busiest 1% of books account for far more than 1% of loans.
+        top = conn.execute('''
+            SELECT SUM(loans) FROM (SELECT COUNT(*) AS loans FROM borrow_records GROUP BY book_id ORDER BY loans DESC LIMIT 3)
+        ''').fetchone()[0]
+        assert top > 5000 * 0.10
+
+    report = get_patron_status_report("100000")  # The most active patron.
+    assert len(report['borrow_history']) > 0
+    assert report['current_borrowed_count'] == len(report['current_borrowed'])
+
+
+def test_same_seed_same_dataset():
+    '''Test that a seed and as_of reproduce the dataset exactly, and a different seed does not.'''
+    first = dataset_checksum()
+
+    fresh_database()
+    generate_dataset(books=300, patrons=60, loans=5000, seed=7, as_of=AS_OF, batch_size=700)
+    assert dataset_checksum() == first
+
+    fresh_database()
+    generate_dataset(books=300, patrons=60, loans=5000, seed=8, as_of=AS_OF)
+    assert dataset_checksum() != first
+
+
+def test_refuses_non_empty_database():
+    '''Test that generating on top of existing books is refused.'''
+    with pytest.raises(ValueError):
+        generate_dataset(books=10, patrons=10, loans=10)
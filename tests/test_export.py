@@ -0,0 +1,56 @@
+'''
+Tests for the streaming NDJSON/CSV exports.
+
+Run this file with venv terminal `python -m pytest tests/test_export.py` to pytest.
+'''
+import pytest
+import database
+import csv
+import io
+import json
+from database import add_sample_data, iter_books, iter_loans, BOOK_COLUMNS, LOAN_COLUMNS
+from services.export_service import stream_ndjson, stream_csv, stream_export
+
+# MANDATORY: Reset the database before running tests to ensure a clean state with no interference from previous tests!
+@pytest.fixture(autouse=True, scope="module")
+def reset_database():
+    database.reset_database()
+    add_sample_data()
+
+# -------------------------------------------------------------------------
+
+def test_iter_books_streams_in_chunks():
+    '''Test that books are streamed lazily, with every sample book present.'''
+    rows = iter_books(chunk_size=1)
+    first = next(rows)  # Nothing else has to be fetched yet.
+    assert first['title'] == "The Great Gatsby"
+    assert [first] + list(rows) == [dict(zip(BOOK_COLUMNS, book)) for book in [
+        (1, 'The Great Gatsby', 'F. Scott Fitzgerald', '9780743273565', 3, 3),
+        (2, 'To Kill a Mockingbird', 'Harper Lee', '9780061120084', 2, 2),
+        (3, '1984', 'George Orwell', '9780451524935', 1, 0),
+    ]]
+
+
+def test_stream_ndjson_one_object_per_line():
+    '''Test that NDJSON output parses back to the same rows, split into several chunks.'''
+    chunks = list(stream_ndjson(iter_books(), rows_per_chunk=2))
+    assert len(chunks) == 2  # 3 books, 2 rows per chunk.
+
+    lines = "".join(chunks).splitlines()
+    assert [json.loads(line)['isbn'] for line in lines] == ['9780743273565', '9780061120084', '9780451524935']
+
+
+def test_stream_csv_header_and_rows():
+    '''Test that CSV output has a header line even when there are no rows.'''
+    output = "".join(stream_csv(iter_loans(), LOAN_COLUMNS))
+    rows = list(csv.DictReader(io.StringIO(output)))
+    assert len(rows) == 1  # The sample borrow record for 1984.
+    assert rows[0]['patron_id'] == "123456"
+
+    assert "".join(stream_csv([], LOAN_COLUMNS)).strip() == ",".join(LOAN_COLUMNS)
+
+
+def test_stream_export_invalid_format():
+    '''Test that unsupported export formats are rejected.'''
+    with pytest.raises(ValueError):
+        stream_export(iter_books(), BOOK_COLUMNS, "xml")
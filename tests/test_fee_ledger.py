@@ -0,0 +1,144 @@
+'''
+Tests for the fee ledger and maintained outstanding balances.
+
+Run this file with venv terminal `python -m pytest tests/test_fee_ledger.py` to pytest.
+'''
+import pytest
+import database
+from unittest.mock import Mock
+from datetime import datetime, timedelta
+from database import (
+    add_sample_data, insert_borrow_record, update_book_availability,
+    get_patron_balance, get_fee_ledger
+)
+from services.library_service import (
+    return_book_by_patron, pay_late_fees, pay_all_late_fees, refund_late_fee_payment, get_patron_status_report
+)
+from services.payment_service import PaymentGateway
+
+# MANDATORY: Reset the database before running tests to ensure a clean state with no interference from previous tests!
+@pytest.fixture(autouse=True, scope="module")
+def reset_database():
+    database.reset_database()
+    add_sample_data()
+
+def borrow_overdue(patron_id, book_id, days_overdue):
+    '''Record a loan that went overdue `days_overdue` days ago.'''
+    due_date = datetime.now() - timedelta(days=days_overdue)
+    insert_borrow_record(patron_id, book_id, due_date - timedelta(days=14), due_date)
+    update_book_availability(book_id, -1)
+
+def mock_gateway(transaction_id):
+    gateway = Mock(spec=PaymentGateway)
+    gateway.process_payment.return_value = (True, transaction_id, "Payment processed successfully")
+    gateway.refund_payment.return_value = (True, "Refund processed successfully")
+    return gateway
+
+# -------------------------------------------------------------------------
+
+def test_return_assesses_fee():
+    '''Test that returning an overdue book records the fee in the ledger and the patron's balance.'''
+    borrow_overdue("510000", 1, 3)
+    return_book_by_patron("510000", 1)  # $1.50.
+
+    assert get_patron_balance("510000") == 1.50
+    ledger = get_fee_ledger("510000")
+    assert [(entry['entry_type'], entry['amount']) for entry in ledger] == [('assessed', 1.50)]
+
+
+def test_pay_fee_for_returned_book():
+    '''Test that a fee assessed at return can be paid, and is not charged again afterwards.'''
+    gateway = mock_gateway("txn_510000_1")
+    success, msg, txn = pay_late_fees("510000", 1, gateway)
+
+    assert success is True and txn == "txn_510000_1"
+    gateway.process_payment.assert_called_with(patron_id="510000", amount=1.50, description="Late fees for 'The Great Gatsby'")
+    assert get_patron_balance("510000") == 0.0
+
+    success, msg, txn = pay_late_fees("510000", 1, mock_gateway("txn_510000_2"))
+    assert success is False
+    assert msg == "No late fees to pay for this book."
+
+
+def test_fee_paid_before_return_not_charged_twice():
+    '''Test that paying the fee on a loan still out and then returning it only assesses the fee once.'''
+    borrow_overdue("520000", 2, 3)
+    success, _, _ = pay_late_fees("520000", 2, mock_gateway("txn_520000_1"))
+    assert success is True
+    assert get_patron_balance("520000") == 0.0
+
+    return_book_by_patron("520000", 2)  # Returned the same day, so nothing more has accrued.
+
+    assert get_patron_balance("520000") == 0.0
+    ledger = get_fee_ledger("520000")
+    assert [(entry['entry_type'], entry['amount']) for entry in ledger] == [('assessed', 1.50), ('paid', 1.50)]
+
+
+def test_refund_recorded_against_payment():
+    '''Test that refunds can't exceed what was paid and are recorded in the ledger.'''
+    gateway = mock_gateway("txn_520000_1")
+    assert refund_late_fee_payment("txn_520000_1", 2.00, gateway) == (False, "Refund amount exceeds the amount paid.")
+    gateway.refund_payment.assert_not_called()
+
+    success, _ = refund_late_fee_payment("txn_520000_1", 1.50, gateway)
+    assert success is True
+    assert get_fee_ledger("520000")[-1]['entry_type'] == 'refunded'
+    assert get_patron_balance("520000") == 0.0  # Refunding a fee charged in error waives it.
+
+    success, msg = refund_late_fee_payment("txn_520000_1", 0.50, gateway)
+    assert (success, msg) == (False, "Refund amount exceeds the amount paid.")
+
+
+def test_pay_all_late_fees_single_charge():
+    '''Test that returned and still borrowed books' fees are paid with one itemized gateway charge.'''
+    borrow_overdue("530000", 1, 10)
+    return_book_by_patron("530000", 1)  # $6.50 assessed at return.
+    borrow_overdue("530000", 2, 3)  # $1.50 accrued so far, still out.
+
+    gateway = mock_gateway("txn_530000_1")
+    success, msg, txn, items = pay_all_late_fees("530000", gateway)
+
+    assert success is True and txn == "txn_530000_1"
+    gateway.process_payment.assert_called_once_with(
+        patron_id="530000", amount=8.00,
+        description="Late fees for 'The Great Gatsby' ($6.50), 'To Kill a Mockingbird' ($1.50)"
+    )
+    assert items == [{'book_id': 1, 'title': "The Great Gatsby", 'amount': 6.50},
+                     {'book_id': 2, 'title': "To Kill a Mockingbird", 'amount': 1.50}]
+    assert get_patron_balance("530000") == 0.0
+
+    return_book_by_patron("530000", 2)  # Nothing more accrued, so nothing more is owed.
+    assert get_patron_balance("530000") == 0.0
+    assert pay_all_late_fees("530000", mock_gateway("txn_530000_2")) == (False, "No late fees to pay.", None, [])
+
+    success, _ = refund_late_fee_payment("txn_530000_1", 7.00, gateway)  # Refundable up to the whole charge.
+    assert success is True
+
+
+def test_refund_pay_all_charge_above_book_maximum():
+    '''Test that a payment covering several books can be refunded in one call beyond one book's $15 maximum.'''
+    borrow_overdue("540000", 1, 20)  # $15.00, the maximum.
+    borrow_overdue("540000", 2, 14)  # $10.50.
+    gateway = mock_gateway("txn_540000_1")
+    assert pay_all_late_fees("540000", gateway)[0] is True
+
+    assert refund_late_fee_payment("txn_540000_1", 25.50, gateway) == (True, "Refund processed successfully")
+    assert get_fee_ledger("540000")[-1]['entry_type'] == 'refunded'
+
+    # Payments not in the ledger are still held to one book's maximum.
+    assert refund_late_fee_payment("txn_unknown_1", 16.00, gateway) == (False, "Refund amount exceeds maximum late fee.")
+    gateway.refund_payment.assert_called_once()
+
+
+def test_status_report_total_matches_ledger():
+    '''Test that the status report's total owed counts unpaid fees on returned books, and not fees already paid on books still out.'''
+    borrow_overdue("560000", 1, 3)
+    return_book_by_patron("560000", 1)  # $1.50 assessed and unpaid.
+    borrow_overdue("560000", 2, 5)
+    pay_late_fees("560000", 2, mock_gateway("txn_560000_1"))  # $2.50 accrued so far, paid.
+
+    assert get_patron_status_report("560000")['total_late_fees'] == get_patron_balance("560000") == 1.50
+    gateway = mock_gateway("txn_560000_2")
+    pay_all_late_fees("560000", gateway)
+    assert gateway.process_payment.call_args.kwargs['amount'] == 1.50
+    assert get_patron_status_report("560000")['total_late_fees'] == 0.0
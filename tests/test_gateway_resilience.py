@@ -0,0 +1,148 @@
+'''
+Tests for the payment gateway deadline, retries and circuit breaker, against the local stand-in gateway server.
+
+Run this file with venv terminal `python -m pytest tests/test_gateway_resilience.py` to pytest.
+'''
+import pytest
+import time
+from gateway_stub import StubGatewayServer
+from services.library_service import pay_late_fees
+from services.payment_service import (
+    HttpPaymentGateway, ResilientPaymentGateway, CircuitBreaker, CircuitOpenError, GatewayTimeout, GatewayUnavailable,
+    default_payment_gateway
+)
+from app import create_app
+
+# No database here, the gateway server keeps its transactions in memory.
+@pytest.fixture
+def gateway_server():
+    with StubGatewayServer() as server:
+        yield server
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def resilient(server, breaker=None, **options):
+    options.setdefault('backoff_base', 0.01)
+    return ResilientPaymentGateway(HttpPaymentGateway(base_url=server.base_url), breaker=breaker or CircuitBreaker(),
+                                   **options)
+
+# -------------------------------------------------------------------------
+
+def test_transient_failures_retried(gateway_server):
+    '''Test that 503s are retried with backoff until the gateway answers.'''
+    gateway_server.fail_next = 2
+    gateway = resilient(gateway_server, max_retries=3)
+
+    success, transaction_id, _ = gateway.process_payment("123456", 2.50, "Late fees")
+
+    assert success is True and transaction_id in gateway_server.charges
+    assert gateway_server.requests == 3
+    metrics = gateway.breaker.metrics()
+    assert metrics['retries'] == 2 and metrics['failures'] == 2 and metrics['state'] == 'closed'
+
+
+def test_retries_are_bounded(gateway_server):
+    '''Test that a gateway that keeps failing is given up on after max_retries.'''
+    gateway_server.failure_rate = 1.0
+    gateway = resilient(gateway_server, max_retries=2)
+
+    with pytest.raises(GatewayUnavailable):
+        gateway.verify_payment_status("txn_123456_1")
+    assert gateway_server.requests == 3
+
+
+def test_deadline_and_no_retry_of_timed_out_charges(gateway_server):
+    '''Test that slow calls give up at the deadline, and a timed-out charge is not retried (it may have gone through).'''
+    gateway_server.latency = 0.5
+    gateway = resilient(gateway_server, deadline=0.2, max_retries=3)
+
+    start = time.perf_counter()
+    with pytest.raises(GatewayTimeout):
+        gateway.process_payment("123456", 2.50)
+    assert time.perf_counter() - start < 0.4
+    assert gateway.breaker.metrics()['timeouts'] == 1
+
+    time.sleep(0.4)  # Let the abandoned request finish.
+    assert gateway_server.requests == 1
+
+
+def test_breaker_opens_fails_fast_and_recovers(gateway_server):
+    '''Test that repeated failures open the breaker, which fails calls without calling the gateway until a trial call succeeds.'''
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30.0, clock=clock)
+    gateway = resilient(gateway_server, breaker, max_retries=0)
+    gateway_server.failure_rate = 1.0
+
+    for _ in range(3):
+        with pytest.raises(GatewayUnavailable):
+            gateway.refund_payment("txn_123456_1", 1.00)
+    with pytest.raises(CircuitOpenError):
+        gateway.refund_payment("txn_123456_1", 1.00)
+    assert gateway_server.requests == 3
+    assert breaker.metrics()['state'] == 'open' and breaker.metrics()['rejected'] == 1
+
+    clock.now += 30.0
+    assert breaker.state == 'half_open'
+    gateway_server.failure_rate = 0.0
+    assert gateway.refund_payment("txn_123456_1", 1.00)[0] is True
+    assert breaker.metrics() == {'state': 'closed', 'consecutive_failures': 0, 'successes': 1, 'failures': 3,
+                                 'timeouts': 0, 'retries': 0, 'rejected': 1, 'opened': 1}
+
+
+def test_failed_trial_reopens_breaker(gateway_server):
+    '''Test that a failed trial call while half open opens the breaker again straight away.'''
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10.0, clock=clock)
+    gateway = resilient(gateway_server, breaker, max_retries=0)
+    gateway_server.fail_next = 2
+
+    with pytest.raises(GatewayUnavailable):
+        gateway.process_payment("123456", 1.00)
+    clock.now += 10.0
+    with pytest.raises(GatewayUnavailable):
+        gateway.process_payment("123456", 1.00)
+    assert breaker.state == 'open' and breaker.metrics()['opened'] == 2
+
+
+def test_pay_late_fees_fails_fast_when_open(mocker, gateway_server):
+    '''Test that fee payments report the gateway as unavailable at once while the breaker is open.'''
+    mocker.patch("services.library_service.calculate_late_fee_for_book", return_value={"fee_amount": 1.00})
+    mocker.patch("services.library_service.get_book_fee_balance",
+                 return_value={'outstanding': 0.0, 'active_loan_id': None, 'assessed_on_active': 0.0})
+    mocker.patch("services.library_service.get_book_by_id", return_value={"title": "Mock Book"})
+    breaker = CircuitBreaker(failure_threshold=1)
+    breaker.record_failure()
+    gateway_server.latency = 1.0
+
+    start = time.perf_counter()
+    success, msg, txn = pay_late_fees("888888", 9, resilient(gateway_server, breaker))
+
+    assert (success, txn) == (False, None)
+    assert msg == "Payment processing error: Payment gateway is unavailable, try again later."
+    assert time.perf_counter() - start < 0.1
+    assert gateway_server.requests == 0
+
+
+def test_default_gateway_shares_one_http_client(monkeypatch, gateway_server):
+    '''Test that every default gateway wraps the same HTTP client, so calls reuse its keep-alive connections.'''
+    monkeypatch.setenv('PAYMENT_GATEWAY_URL', gateway_server.base_url)
+    first, second = default_payment_gateway(), default_payment_gateway()
+
+    assert isinstance(first.gateway, HttpPaymentGateway) and first.gateway is second.gateway
+    assert first.process_payment("123456", 1.00)[0] is True
+    assert second.verify_payment_status(next(iter(gateway_server.charges)))['status'] == 'completed'
+
+    monkeypatch.setenv('PAYMENT_GATEWAY_URL', gateway_server.base_url + '/v2')
+    assert default_payment_gateway().gateway is not first.gateway
+
+
+def test_gateway_status_endpoint():
+    '''Test that the breaker's metrics are served for monitoring.'''
+    response = create_app({'TESTING': True}).test_client().get('/api/gateway/status')
+    assert response.status_code == 200
+    assert response.get_json()['state'] in ('closed', 'open', 'half_open')
@@ -0,0 +1,180 @@
+'''
+Tests for idempotency keys on late fee payments and refunds, and local payment status lookups.
+
+Run this file with venv terminal `python -m pytest tests/test_idempotency.py` to pytest.
+'''
+import pytest
+import database
+import sqlite3
+from unittest.mock import Mock
+from datetime import datetime, timedelta
+from database import (
+    add_sample_data, insert_borrow_record, update_book_availability, get_fee_ledger,
+    begin_payment_request, get_payment_request, get_unsettled_payment_requests, get_patron_balance
+)
+from services.library_service import (
+    pay_late_fees, pay_all_late_fees, refund_late_fee_payment, get_payment_status, settle_payment_request,
+    OUTCOME_UNKNOWN, UNSETTLED_PAYMENT, UNSETTLED_REFUND
+)
+from services.payment_service import PaymentGateway, GatewayTimeout
+from services.payment_queue_service import PaymentQueue
+from app import create_app
+
+# MANDATORY: Reset the database before running tests to ensure a clean state with no interference from previous tests!
+@pytest.fixture(autouse=True, scope="module")
+def reset_database():
+    database.reset_database()
+    add_sample_data()
+
+def borrow_overdue(patron_id, book_id, days_overdue):
+    '''Record a loan that went overdue `days_overdue` days ago.'''
+    due_date = datetime.now() - timedelta(days=days_overdue)
+    insert_borrow_record(patron_id, book_id, due_date - timedelta(days=14), due_date)
+    update_book_availability(book_id, -1)
+
+def mock_gateway(transaction_id, success=True):
+    gateway = Mock(spec=PaymentGateway)
+    gateway.process_payment.return_value = (success, transaction_id, "Payment processed successfully" if success else "Payment declined")
+    gateway.refund_payment.return_value = (True, "Refund processed successfully")
+    return gateway
+
+# -------------------------------------------------------------------------
+
+def test_retried_payment_charges_once():
+    '''Test that a payment retried with the same key returns the first result without charging again.'''
+    borrow_overdue("810000", 1, 3)
+    gateway = mock_gateway("txn_810000_1")
+
+    first = pay_late_fees("810000", 1, gateway, idempotency_key="pay-810000-1")
+    retry = pay_late_fees("810000", 1, gateway, idempotency_key="pay-810000-1")
+
+    assert first == (True, "Payment successful! Payment processed successfully", "txn_810000_1")
+    assert retry == first
+    gateway.process_payment.assert_called_once()
+    assert [entry['entry_type'] for entry in get_fee_ledger("810000")] == ['assessed', 'paid']
+
+    stored = get_payment_request("pay-810000-1")
+    assert stored['status'] == 'succeeded' and stored['amount'] == 1.50
+    assert stored['result_transaction_id'] == "txn_810000_1"
+
+
+def test_declined_payment_replayed():
+    '''Test that a declined payment is stored too, so a retry gets the decline instead of a second attempt.'''
+    borrow_overdue("820000", 1, 3)
+    gateway = mock_gateway("", success=False)
+
+    assert pay_late_fees("820000", 1, gateway, idempotency_key="pay-820000-1") == (False, "Payment failed: Payment declined", None)
+    assert pay_late_fees("820000", 1, gateway, idempotency_key="pay-820000-1") == (False, "Payment failed: Payment declined", None)
+    gateway.process_payment.assert_called_once()
+
+
+def test_reused_or_pending_key_rejected():
+    '''Test that a key can't be reused for a different request, or while its request is still running.'''
+    gateway = mock_gateway("txn_810000_2")
+    assert pay_late_fees("810000", 2, gateway, idempotency_key="pay-810000-1") == \
+        (False, "Idempotency key was already used for a different request.", None)
+
+    begin_payment_request("pay-830000-1", 'payment', patron_id="830000", book_id=None)
+    assert pay_all_late_fees("830000", gateway, idempotency_key="pay-830000-1") == \
+        (False, "A request with this idempotency key is still being processed.", None, [])
+    gateway.process_payment.assert_not_called()
+
+
+def test_unexpected_error_releases_key(mocker):
+    '''Test that a request that fails without a result frees its key for a retry.'''
+    mocker.patch("services.library_service.get_unpaid_fee_sources", side_effect=sqlite3.OperationalError("database is locked"))
+    with pytest.raises(sqlite3.OperationalError):
+        pay_all_late_fees("840000", mock_gateway("txn_840000_1"), idempotency_key="pay-840000-1")
+    assert get_payment_request("pay-840000-1") is None
+
+
+def test_pay_all_and_refund_replayed():
+    '''Test that pay-all retries return the stored items, and refund retries refund once.'''
+    borrow_overdue("850000", 1, 3)
+    borrow_overdue("850000", 2, 3)
+    gateway = mock_gateway("txn_850000_1")
+
+    first = pay_all_late_fees("850000", gateway, idempotency_key="pay-850000-1")
+    assert pay_all_late_fees("850000", gateway, idempotency_key="pay-850000-1") == first
+    assert len(first[3]) == 2
+    gateway.process_payment.assert_called_once()
+
+    assert refund_late_fee_payment("txn_850000_1", 1.00, gateway, idempotency_key="refund-850000-1")[0] is True
+    assert refund_late_fee_payment("txn_850000_1", 1.00, gateway, idempotency_key="refund-850000-1")[0] is True
+    gateway.refund_payment.assert_called_once()
+    assert [entry['entry_type'] for entry in get_fee_ledger("850000")].count('refunded') == 1
+
+
+def test_status_answered_locally():
+    '''Test that recorded payments' status comes from the database, and only unknown ones go to the gateway.'''
+    gateway = mock_gateway("txn_unused")
+    gateway.verify_payment_status.return_value = {"status": "not_found", "message": "Transaction not found"}
+
+    status = get_payment_status("txn_850000_1", gateway)
+    assert status['status'] == 'completed' and status['amount'] == 3.00 and status['refunded'] == 1.00
+    gateway.verify_payment_status.assert_not_called()
+
+    assert get_payment_status("txn_999999_1", gateway)['status'] == 'not_found'
+    gateway.verify_payment_status.assert_called_once_with("txn_999999_1")
+
+
+def test_timed_out_payment_blocks_new_charges():
+    '''Test that a timed-out charge is stored as unknown, not failed, and the patron can't be charged again until it is settled.'''
+    borrow_overdue("870000", 1, 3)
+    gateway = mock_gateway("txn_870000_1")
+    gateway.process_payment.side_effect = GatewayTimeout("Gateway did not answer within 10s")
+
+    assert pay_late_fees("870000", 1, gateway, idempotency_key="pay-870000-1") == (False, OUTCOME_UNKNOWN, None)
+    assert get_payment_request("pay-870000-1")['status'] == 'unknown'
+    # Neither a retry, a new key nor a request without a key charges again.
+    assert pay_late_fees("870000", 1, gateway, idempotency_key="pay-870000-1") == (False, OUTCOME_UNKNOWN, None)
+    assert pay_late_fees("870000", 1, gateway, idempotency_key="pay-870000-2") == (False, UNSETTLED_PAYMENT, None)
+    assert pay_all_late_fees("870000", gateway) == (False, UNSETTLED_PAYMENT, None, [])
+    gateway.process_payment.assert_called_once()
+
+    # Checked with the gateway: it went through, so the fee is recorded as paid and charging is allowed again.
+    gateway.verify_payment_status.return_value = {"transaction_id": "txn_870000_1", "status": "completed", "amount": 1.50}
+    assert settle_payment_request("pay-870000-1", True, "txn_870000_1", gateway) == (True, "Settled as charged.")
+    assert get_payment_request("pay-870000-1")['status'] == 'succeeded'
+    assert get_patron_balance("870000") == 0.0
+    assert pay_late_fees("870000", 1, gateway, idempotency_key="pay-870000-3") == \
+        (False, "No late fees to pay for this book.", None)
+    assert settle_payment_request("pay-870000-1", True, "txn_870000_1", gateway)[0] is False  # Already settled.
+
+
+def test_timed_out_refund_blocks_new_refunds():
+    '''Test that a timed-out refund blocks further refunds of the payment until it is settled as not processed.'''
+    gateway = mock_gateway("txn_unused")
+    gateway.refund_payment.side_effect = GatewayTimeout("Gateway did not answer within 10s")
+
+    assert refund_late_fee_payment("txn_850000_1", 0.50, gateway) == (False, OUTCOME_UNKNOWN)
+    unsettled, = get_unsettled_payment_requests(transaction_id="txn_850000_1")
+    assert refund_late_fee_payment("txn_850000_1", 0.50, gateway, idempotency_key="refund-850000-2") == (False, UNSETTLED_REFUND)
+    gateway.refund_payment.assert_called_once()
+
+    assert settle_payment_request(unsettled['idempotency_key'], False) == (True, "Settled as not processed.")
+    gateway.refund_payment.side_effect = None
+    assert refund_late_fee_payment("txn_850000_1", 0.50, gateway, idempotency_key="refund-850000-3")[0] is True
+
+
+def test_api_idempotency_key_header(mocker):
+    '''Test that retried API requests with the same Idempotency-Key get the same job.'''
+    queue = PaymentQueue(gateway_factory=lambda: mock_gateway("txn_860000_1"))
+    mocker.patch("services.payment_queue_service.get_payment_queue", return_value=queue)
+    client = create_app({'TESTING': True}).test_client()
+
+    headers = {'Idempotency-Key': 'pay-860000-1'}
+    first = client.post('/api/patron/860000/pay', json={'book_id': 1}, headers=headers)
+    retry = client.post('/api/patron/860000/pay', json={'book_id': 1}, headers=headers)
+    assert first.status_code == retry.status_code == 202
+    assert first.get_json()['job_id'] == retry.get_json()['job_id']
+
+    # The same key for a different payment or a refund is refused rather than answered with the first job.
+    for response in (client.post('/api/patron/860000/pay', json={'book_id': 2}, headers=headers),
+                     client.post('/api/patron/860000/pay-all', headers=headers),
+                     client.post('/api/refunds', json={'transaction_id': "txn_860000_1", 'amount': 1.50}, headers=headers)):
+        assert response.status_code == 422
+        assert response.get_json()['error'] == "Idempotency key was already used for a different request."
+
+    assert client.post('/api/patron/860000/pay-all', headers={'Idempotency-Key': ' '}).status_code == 400
+    assert client.get('/api/transactions/txn_810000_1').get_json()['amount'] == 1.50
@@ -0,0 +1,87 @@
+'''
+Tests for the bulk catalog importer.
+
+Run this file with venv terminal `python -m pytest tests/test_import.py` to pytest.
+'''
+import pytest
+import database
+import io
+from database import add_sample_data, get_book_by_isbn
+from services.import_service import import_books
+
+# MANDATORY: Reset the database before running tests to ensure a clean state with no interference from previous tests!
+@pytest.fixture(autouse=True, scope="module")
+def reset_database():
+    database.reset_database()
+    add_sample_data()
+
+# -------------------------------------------------------------------------
+
+def test_import_books_csv():
+    '''Test importing valid CSV rows across several batches.'''
+    csv_file = io.StringIO(
+        "title,author,isbn,total_copies\n"
+        "Dune,Frank Herbert,1000000000001,2\n"
+        "Emma,Jane Austen,1000000000002,1\n"
+        "Ulysses,James Joyce,1000000000003,4\n"
+    )
+    result = import_books(csv_file, "csv", batch_size=2)
+
+    assert result == {'imported': 3, 'failed': 0, 'errors': []}
+    book = get_book_by_isbn("1000000000003")
+    assert book['title'] == "Ulysses"
+    assert book['available_copies'] == 4  # All copies start available, like add_book_to_catalog.
+
+
+def test_import_books_reports_row_errors():
+    '''Test that invalid and duplicate rows are reported per row and don't stop the rest of the import.'''
+    csv_file = io.StringIO(
+        "title,author,isbn,total_copies\n"
+        ",No Title,1000000000010,1\n"  # Same R1 rules as add_book_to_catalog.
+        "Short ISBN,Someone,12345,1\n"
+        "Sample Dup,Someone,9780743273565,1\n"  # Already in the sample data.
+        "Valid,Someone,1000000000011,1\n"
+        "In File Dup,Someone,1000000000011,1\n"  # Duplicate of an earlier row.
+        "Bad Copies,Someone,1000000000012,zero\n"
+    )
+    result = import_books(csv_file, "csv")
+
+    assert result['imported'] == 1
+    assert result['failed'] == 5
+    errors = {error['row']: error['error'] for error in result['errors']}
+    assert errors == {
+        1: "Title is required.",
+        2: "ISBN must be exactly 13 digits.",
+        3: "A book with this ISBN already exists.",
+        5: "A book with this ISBN already exists.",
+        6: "Total copies must be a positive integer.",
+    }
+    assert get_book_by_isbn("1000000000011")['title'] == "Valid"
+
+
+def test_import_books_jsonl():
+    '''Test importing JSON Lines, including a malformed line.'''
+    jsonl_file = io.StringIO(
+        '{"title": "Beloved", "author": "Toni Morrison", "isbn": "1000000000020", "total_copies": 2}\n'
+        'this is not json\n'
+        '\n'
+        '{"title": "Middlemarch", "author": "George Eliot", "isbn": "1000000000021", "total_copies": 1}\n'
+    )
+    result = import_books(jsonl_file, "jsonl")
+
+    assert result['imported'] == 2
+    assert result['errors'] == [{'row': 2, 'isbn': None, 'error': "Row could not be parsed."}]
+
+
+def test_import_books_worker_processes():
+    '''Test that validating in a process pool gives the same result as validating in-process.'''
+    rows = "".join(f"Book {n},Author {n},{2000000000000 + n},1\n" for n in range(50))
+    result = import_books(io.StringIO("title,author,isbn,total_copies\n" + rows), "csv", batch_size=10, workers=2)
+
+    assert result == {'imported': 50, 'failed': 0, 'errors': []}
+
+
+def test_import_books_invalid_format():
+    '''Test that unsupported formats are rejected.'''
+    with pytest.raises(ValueError):
+        import_books(io.StringIO(""), "xml")
@@ -0,0 +1,51 @@
+'''
+Tests for the HTTP load generator, against the app served on a local port.
+
+Run this file with venv terminal `python -m pytest tests/test_loadtest.py` to pytest.
+'''
+import pytest
+import database
+from database import add_sample_data, get_book_by_id
+from services.loadtest_service import parse_mix, histogram, run_load_test, local_app_server, DEFAULT_MIX
+from app import create_app
+
+# MANDATORY: Reset the database before running tests to ensure a clean state with no interference from previous tests!
+@pytest.fixture(autouse=True, scope="module")
+def reset_database():
+    database.reset_database()
+    add_sample_data()
+
+# -------------------------------------------------------------------------
+
+def test_parse_mix():
+    '''Test route weights, defaulting to 1, and that unknown routes and empty mixes are refused.'''
+    assert parse_mix("catalog=3, borrow, late_fee=0") == {'catalog': 3, 'borrow': 1, 'late_fee': 0}
+    with pytest.raises(ValueError):
+        parse_mix("catalog=3,checkout=1")
+    with pytest.raises(ValueError):
+        parse_mix("catalog=x")
+    with pytest.raises(ValueError):
+        parse_mix("search=0")
+
+
+def test_histogram_buckets():
+    '''Test that latencies land in the first bucket at or above them, and slower ones in the last.'''
+    buckets = dict(histogram([0.0005, 0.001, 0.0011, 0.3, 9.0]))
+    assert buckets[1] == 2 and buckets[2] == 1 and buckets[500] == 1 and buckets[None] == 1
+    assert sum(buckets.values()) == 5
+
+
+def test_run_against_local_app():
+    '''Test a short run of every route from several clients: all requests are answered and counted per route.'''
+    with local_app_server(create_app({'TESTING': True})) as base_url:
+        result = run_load_test(base_url, clients=3, duration=30.0, max_requests=120, seed=1)
+
+    assert result['requests'] == 120 and result['errors'] == 0
+    assert set(result['routes']) == set(DEFAULT_MIX)
+    assert sum(count for _, count in result['histogram']) == 120
+    for stats in result['routes'].values():
+        assert stats['calls'] > 0 and stats['error_rate'] == 0.0
+        assert stats['p99_ms'] >= stats['p50_ms'] > 0
+    assert set(result['routes']['borrow']['status_codes']) == {'302'}
+    # The run started from the sample data the reset endpoint loads.
+    assert get_book_by_id(1)['title'] == "The Great Gatsby"
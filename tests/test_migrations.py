@@ -0,0 +1,109 @@
+'''
+Tests for the versioned schema migrations run by `init_database()`.
+
+Run this file with venv terminal `python -m pytest tests/test_migrations.py` to pytest.
+'''
+import pytest
+import sqlite3
+import database
+from database import (
+    init_database, add_sample_data, MIGRATIONS, migrate_database, get_schema_version,
+    connection, close_pool, invalidate_book_cache, get_all_books, get_patron_loans, get_patron_borrow_count
+)
+from datetime import datetime
+
+# MANDATORY: Reset the database before running tests to ensure a clean state with no interference from previous tests!
+@pytest.fixture(autouse=True, scope="module")
+def reset_database():
+    database.reset_database()
+    add_sample_data()
+
+@pytest.fixture
+def legacy_database(tmp_path, monkeypatch):
+    '''Point the app at a new database file of its own, so an old schema can be built without touching library.db.'''
+    path = str(tmp_path / 'legacy.db')
+    close_pool()
+    monkeypatch.setattr(database, 'DATABASE', path)
+    yield path
+    close_pool()
+    invalidate_book_cache()  # Books cached from the legacy file.
+
+# -------------------------------------------------------------------------
+
+def test_all_migrations_applied():
+    '''Test that a fresh database is migrated to the latest schema version.'''
+    assert get_schema_version() == MIGRATIONS[-1][0]
+
+
+def test_migrations_are_idempotent():
+    '''Test that running the migrations again changes nothing.'''
+    assert migrate_database() == MIGRATIONS[-1][0]
+    with connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM schema_version').fetchone()[0] == len(MIGRATIONS)
+
+
+def test_patron_lookups_use_indexes():
+    '''Test that active loan lookups use an index instead of scanning borrow_records.'''
+    with connection() as conn:
+        plan = conn.execute('''
+            EXPLAIN QUERY PLAN SELECT COUNT(*) FROM borrow_records
+            WHERE patron_id = ? AND return_date IS NULL
+        ''', ('123456',)).fetchall()
+    details = " ".join(row['detail'] for row in plan)
+    assert "USING" in details and "INDEX" in details
+    assert "SCAN borrow_records" not in details
+
+
+def test_upgrade_unversioned_database(legacy_database):
+    '''Test that a database created before migrations existed keeps its data and gains the new schema.'''
+    conn = sqlite3.connect(legacy_database)  # Original schema, with no schema_version table.
+    conn.execute('''
+        CREATE TABLE books (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, author TEXT NOT NULL,
+        isbn TEXT UNIQUE NOT NULL, total_copies INTEGER NOT NULL, available_copies INTEGER NOT NULL)
+    ''')
+    conn.execute('''
+        CREATE TABLE borrow_records (id INTEGER PRIMARY KEY AUTOINCREMENT, patron_id TEXT NOT NULL,
+        book_id INTEGER NOT NULL, borrow_date TEXT NOT NULL, due_date TEXT NOT NULL, return_date TEXT)
+    ''')
+    conn.execute("INSERT INTO books VALUES (1, 'Legacy Book', 'Old Author', '1234567890123', 1, 1)")
+    conn.commit()
+    conn.close()
+
+    init_database()
+
+    assert get_schema_version() == MIGRATIONS[-1][0]
+    assert get_all_books()[0]['title'] == "Legacy Book"
+    with connection() as conn:
+        columns = [row['name'] for row in conn.execute('PRAGMA table_info(borrow_records)')]
+    assert 'late_fee' in columns
+
+
+def test_upgrade_converts_loan_dates_to_epoch(legacy_database):
+    '''Test that ISO text loan dates from before version 9 become integer epoch seconds with the same values.'''
+    conn = sqlite3.connect(legacy_database)
+    conn.execute('''
+        CREATE TABLE books (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, author TEXT NOT NULL,
+        isbn TEXT UNIQUE NOT NULL, total_copies INTEGER NOT NULL, available_copies INTEGER NOT NULL)
+    ''')
+    conn.execute('''
+        CREATE TABLE borrow_records (id INTEGER PRIMARY KEY AUTOINCREMENT, patron_id TEXT NOT NULL,
+        book_id INTEGER NOT NULL, borrow_date TEXT NOT NULL, due_date TEXT NOT NULL, return_date TEXT)
+    ''')
+    conn.execute("INSERT INTO books VALUES (1, 'Legacy Book', 'Old Author', '1234567890123', 2, 0)")
+    conn.execute("INSERT INTO borrow_records VALUES (1, '123456', 1, '2025-01-01T09:30:00.250000', '2025-01-15T09:30:00', '2025-01-20T10:00:00')")
+    conn.execute("INSERT INTO borrow_records VALUES (2, '123456', 1, '2025-02-01T09:30:00', '2025-02-15T09:30:00', NULL)")
+    conn.commit()
+    conn.close()
+
+    init_database()
+
+    with connection() as conn:
+        types = conn.execute("SELECT DISTINCT typeof(borrow_date), typeof(due_date) FROM borrow_records").fetchall()
+    assert [tuple(row) for row in types] == [('integer', 'integer')]
+
+    returned, active = get_patron_loans("123456", datetime(2025, 3, 1))
+    assert returned['borrow_date'] == datetime(2025, 1, 1, 9, 30)  # Stored to the whole second.
+    assert returned['return_date'] == datetime(2025, 1, 20, 10, 0)
+    assert returned['was_overdue'] is True
+    assert active['due_date'] == datetime(2025, 2, 15, 9, 30) and active['return_date'] is None
+    assert get_patron_borrow_count("123456") == 1
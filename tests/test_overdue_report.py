@@ -0,0 +1,63 @@
+'''
+Tests for the library-wide overdue and late fee report.
+
+Run this file with venv terminal `python -m pytest tests/test_overdue_report.py` to pytest.
+'''
+import pytest
+import database
+from datetime import datetime, timedelta
+from database import insert_book, insert_borrow_record, update_borrow_record_return_date
+from services.library_service import get_overdue_report, assess_late_fee
+
+AS_OF = datetime(2025, 6, 1, 12, 0, 0)  # Fixed "now", so results don't depend on when tests run.
+
+# MANDATORY: Reset the database before running tests to ensure a clean state with no interference from previous tests!
+@pytest.fixture(autouse=True, scope="module")
+def reset_database():
+    database.reset_database()
+    insert_book("Overdue Book", "Late Author", "5555555555555", 100, 100)
+
+# -------------------------------------------------------------------------
+
+def test_overdue_report_matches_per_book_fees():
+    '''Test that fees computed in one SQL pass match assess_late_fee for every day overdue, including the cap.'''
+    for days in range(0, 40):
+        patron_id = f"{300000 + days}"  # One patron per number of days overdue.
+        due_date = AS_OF - timedelta(days=days, hours=1)
+        insert_borrow_record(patron_id, 1, due_date - timedelta(days=14), due_date)
+
+    report = get_overdue_report(AS_OF, limit=None)
+
+    expected = {f"{300000 + days}": assess_late_fee(AS_OF - timedelta(days=days, hours=1), AS_OF) for days in range(0, 40)}
+    assert report['overdue_loans'] == 40
+    assert report['patrons'] == 40
+    assert report['total_fees'] == round(sum(fee['fee_amount'] for fee in expected.values()), 2)
+    for patron in report['by_patron']:
+        assert patron['total_fees'] == expected[patron['patron_id']]['fee_amount']
+        assert patron['max_days_overdue'] == expected[patron['patron_id']]['days_overdue']
+
+
+def test_overdue_report_totals_per_patron():
+    '''Test that a patron's overdue loans are summed, and returned or not yet due loans are left out.'''
+    insert_borrow_record("400000", 1, AS_OF - timedelta(days=30), AS_OF - timedelta(days=3))  # $1.50.
+    insert_borrow_record("400000", 1, AS_OF - timedelta(days=40), AS_OF - timedelta(days=10))  # $6.50.
+    insert_borrow_record("400000", 1, AS_OF - timedelta(days=1), AS_OF + timedelta(days=13))  # Not due yet.
+    insert_borrow_record("400001", 1, AS_OF - timedelta(days=30), AS_OF - timedelta(days=5))
+    update_borrow_record_return_date("400001", 1, AS_OF - timedelta(days=1))  # Returned, not owed here.
+
+    report = get_overdue_report(AS_OF, patron_id="400000")
+    assert report['overdue_loans'] == 2
+    assert report['by_patron'] == [
+        {'patron_id': "400000", 'overdue_loans': 2, 'max_days_overdue': 10, 'total_fees': 8.00}
+    ]
+    assert get_overdue_report(AS_OF, patron_id="400001")['overdue_loans'] == 0
+
+
+def test_overdue_report_paging_and_order():
+    '''Test that patrons are listed highest total first and can be paged.'''
+    first_page = get_overdue_report(AS_OF, limit=3)['by_patron']
+    second_page = get_overdue_report(AS_OF, limit=3, offset=3)['by_patron']
+
+    assert len(first_page) == 3 and len(second_page) == 3
+    totals = [patron['total_fees'] for patron in first_page + second_page]
+    assert totals == sorted(totals, reverse=True)
@@ -3,6 +3,15 @@ from services.library_service import pay_late_fees, refund_late_fee_payment
 from unittest.mock import Mock
 from services.payment_service import PaymentGateway
 
+# The fee ledger is a database dependency too, so it is STUBBED for every test: nothing owed or paid before, writes succeed.
+@pytest.fixture(autouse=True)
+def stub_fee_ledger(mocker):
+    mocker.patch("services.library_service.get_book_fee_balance",
+                 return_value={'outstanding': 0.0, 'active_loan_id': None, 'assessed_on_active': 0.0})
+    mocker.patch("services.library_service.record_fee_payment", return_value=True)
+    mocker.patch("services.library_service.get_fee_payment", return_value=None)
+    mocker.patch("services.library_service.record_fee_refund", return_value=True)
+
 # ASSIGNMENT 3. 
 # Only required test scenarios are implemented for Task 2.1 so far. -------------------------------------------------------------------------
 def test_pay_late_fees_successful_payment(mocker):
@@ -108,7 +117,7 @@ def test_pay_late_fees_network_error(mocker):
     )
 
 
-# refund_late_fee_payment() never calls database functions so no stubbing is needed. 
+# refund_late_fee_payment() only reads the fee ledger, which is stubbed above. 
 def test_refund_late_fee_payment_successful_refund(): 
     '''Test successful refund scenario.'''
     # MOCK payment gateway, refund_payment() returns tuple (success: bool, message: str). 
@@ -0,0 +1,182 @@
+'''
+Tests for the background payment job queue.
+
+Run this file with venv terminal `python -m pytest tests/test_payment_queue.py` to pytest.
+'''
+import pytest
+import database
+import sqlite3
+import time
+from unittest.mock import Mock
+from datetime import datetime, timedelta
+from database import (
+    add_sample_data, insert_borrow_record, update_book_availability, get_payment_job, insert_payment_job,
+    claim_payment_job, finish_payment_job, connection, begin_payment_request, get_payment_request
+)
+from services.payment_service import PaymentGateway
+from services.payment_queue_service import PaymentQueue, submit_late_fee_payment, get_payment_queue
+from app import create_app
+
+# MANDATORY: Reset the database before running tests to ensure a clean state with no interference from previous tests!
+@pytest.fixture(autouse=True, scope="module")
+def reset_database():
+    database.reset_database()
+    add_sample_data()
+    for patron_id in ("610000", "620000", "630000", "640000"):  # Each owes $1.50 on The Great Gatsby.
+        due_date = datetime.now() - timedelta(days=3)
+        insert_borrow_record(patron_id, 1, due_date - timedelta(days=14), due_date)
+        update_book_availability(1, -1)
+
+def mock_gateway_factory():
+    gateway = Mock(spec=PaymentGateway)
+    gateway.process_payment.return_value = (True, "txn_queued_1", "Payment of $1.50 processed successfully")
+    gateway.refund_payment.return_value = (True, "Refund of $1.50 processed successfully")
+    return lambda: gateway
+
+# -------------------------------------------------------------------------
+
+def test_queued_payment_runs_later():
+    '''Test that submitting only queues the job, and running it records the gateway result.'''
+    queue = PaymentQueue(gateway_factory=mock_gateway_factory())
+    job_id = queue.submit_payment("610000", 1)
+    assert get_payment_job(job_id)['status'] == 'queued'
+
+    assert queue.run_pending() == 1
+    job = get_payment_job(job_id)
+    assert job['status'] == 'succeeded'
+    assert job['result_transaction_id'] == "txn_queued_1"
+    assert job['message'] == "Payment successful! Payment of $1.50 processed successfully"
+
+
+def test_failed_jobs_record_message():
+    '''Test that declined payments and refunds end up failed with the reason.'''
+    queue = PaymentQueue(gateway_factory=mock_gateway_factory())
+    payment_id = queue.submit_payment("610000", 1)  # Already paid in the previous test.
+    refund_id = queue.submit_refund("txn_queued_1", 5.00)  # More than was paid.
+    queue.run_pending()
+
+    assert get_payment_job(payment_id)['status'] == 'failed'
+    assert get_payment_job(payment_id)['message'] == "No late fees to pay for this book."
+    assert get_payment_job(refund_id)['message'] == "Refund amount exceeds the amount paid."
+
+
+def test_invalid_job_raises():
+    '''Test that an invalid job is refused by the table's constraints, with or without an idempotency key.'''
+    with pytest.raises(sqlite3.IntegrityError):
+        insert_payment_job('charge', patron_id="610000", book_id=1)
+    with pytest.raises(sqlite3.IntegrityError):
+        insert_payment_job('charge', patron_id="610000", book_id=1, idempotency_key="bad-job")
+
+
+def test_worker_threads_run_jobs():
+    '''Test that started workers pick up queued jobs on their own.'''
+    queue = PaymentQueue(workers=2, gateway_factory=mock_gateway_factory(), poll_interval=0.05)
+    queue.start()
+    try:
+        job_id = queue.submit_payment("620000", 1)
+        deadline = time.time() + 5
+        while get_payment_job(job_id)['status'] in ('queued', 'running') and time.time() < deadline:
+            time.sleep(0.02)
+    finally:
+        queue.stop()
+
+    assert get_payment_job(job_id)['status'] == 'succeeded'
+
+
+def test_payment_endpoints(mocker):
+    '''Test that the pay endpoint answers 202 with a job to poll, and the status endpoint reports it.'''
+    queue = PaymentQueue(gateway_factory=mock_gateway_factory())  # Not started, jobs are run below.
+    mocker.patch("services.payment_queue_service.get_payment_queue", return_value=queue)
+    client = create_app({'TESTING': True}).test_client()
+
+    response = client.post('/api/patron/630000/pay', json={'book_id': 1})
+    assert response.status_code == 202
+    status_url = response.get_json()['status_url']
+    assert client.get(status_url).get_json()['status'] == 'queued'
+
+    queue.run_pending()
+    assert client.get(status_url).get_json()['status'] == 'succeeded'
+
+    assert client.post('/api/patron/63000/pay', json={'book_id': 1}).status_code == 400
+    assert client.post('/api/patron/630000/pay', json={}).status_code == 400
+    assert client.get('/api/payments/999999').status_code == 404
+
+
+def test_pay_all_job(mocker):
+    '''Test that the pay-all endpoint queues a job that pays every outstanding fee in one charge.'''
+    queue = PaymentQueue(gateway_factory=mock_gateway_factory())
+    mocker.patch("services.payment_queue_service.get_payment_queue", return_value=queue)
+    client = create_app({'TESTING': True}).test_client()
+
+    response = client.post('/api/patron/640000/pay-all')
+    assert response.status_code == 202
+    queue.run_pending()
+
+    job = get_payment_job(response.get_json()['job_id'])
+    assert job['book_id'] is None
+    assert job['status'] == 'succeeded'
+
+
+def test_submit_validates_before_queueing(mocker):
+    '''Test that an invalid patron ID is rejected without queueing a job.'''
+    get_queue = mocker.patch("services.payment_queue_service.get_payment_queue")
+    assert submit_late_fee_payment("abc", 1) == (False, "Invalid patron ID. Must be exactly 6 digits.", None)
+    get_queue.assert_not_called()
+
+
+def test_stale_running_jobs_recovered():
+    '''Test that jobs a dead worker left running are queued again if they have an idempotency key, and failed if not,
+    and that a payment request it claimed but never finished is marked unknown instead of staying pending.'''
+    gateway_factory = mock_gateway_factory()
+    queue = PaymentQueue(gateway_factory=gateway_factory, stale_after=60)
+    keyed = insert_payment_job('refund', transaction_id="txn_queued_1", amount=0.50, idempotency_key="stale-refund")
+    unclaimed = insert_payment_job('refund', transaction_id="txn_other_1", amount=0.50, idempotency_key="stale-refund-2")
+    unkeyed = insert_payment_job('refund', transaction_id="txn_queued_1", amount=0.50)
+    fresh = insert_payment_job('refund', transaction_id="txn_queued_1", amount=0.50)
+    assert [claim_payment_job()['id'] for _ in range(4)] == [keyed, unclaimed, unkeyed, fresh]
+    # The worker claimed the first job's key, and may have called the gateway, before dying five minutes ago.
+    begin_payment_request("stale-refund", 'refund', transaction_id="txn_queued_1", amount=0.50)
+    long_ago = (datetime.now() - timedelta(minutes=5)).isoformat()
+    with connection() as conn:
+        conn.execute('UPDATE payment_jobs SET updated_at = ? WHERE id IN (?, ?, ?)', (long_ago, keyed, unclaimed, unkeyed))
+        conn.execute("UPDATE payments SET updated_at = ? WHERE idempotency_key = 'stale-refund'", (long_ago,))
+
+    assert queue.recover_stale_jobs() == (2, 1)
+    assert get_payment_job(keyed)['status'] == get_payment_job(unclaimed)['status'] == 'queued'
+    assert get_payment_job(unkeyed)['status'] == 'failed'
+    assert get_payment_job(unkeyed)['message'].startswith("Interrupted before the outcome was recorded.")
+    assert get_payment_job(fresh)['status'] == 'running'  # Could still be running in another process.
+    assert get_payment_request("stale-refund")['status'] == 'unknown'
+
+    # The retried job gets the unknown outcome without refunding again; the job that never reached the gateway runs.
+    assert queue.run_pending() == 2
+    assert get_payment_job(keyed)['status'] == 'failed'
+    assert get_payment_job(keyed)['message'].startswith("Interrupted before the outcome was recorded.")
+    assert get_payment_job(unclaimed)['status'] == 'succeeded'
+    gateway_factory().refund_payment.assert_called_once_with("txn_other_1", 0.50)
+    finish_payment_job(fresh, False, "Not run.")
+
+
+def test_app_starts_workers_when_serving(mocker):
+    '''Test that the app starts the payment workers with its first request, not when built (e.g. for a CLI command), and never when testing.'''
+    start = mocker.patch("app.start_payment_queue")
+    create_app({'TESTING': True}).test_client().get('/catalog')
+    start.assert_not_called()
+
+    app = create_app({'PAYMENT_WORKERS': 2})
+    start.assert_not_called()
+    app.test_client().get('/catalog')
+    start.assert_called_with(2)
+    create_app({'PAYMENT_WORKERS': 0}).test_client().get('/catalog')
+    start.assert_called_once()
+
+
+def test_submit_does_not_start_workers(mocker):
+    '''Test that submitting a job only stores it: starting the workers is left to the app.'''
+    mocker.patch("services.payment_queue_service._queue", None)
+    success, _, job_id = submit_late_fee_payment("650000", 1)
+    try:
+        assert success and get_payment_job(job_id)['status'] == 'queued'
+        assert not get_payment_queue().running
+    finally:
+        finish_payment_job(job_id, False, "Not run.")
@@ -0,0 +1,117 @@
+'''
+Tests for the payment reconciliation job, against the local stand-in gateway server.
+
+Run this file with venv terminal `python -m pytest tests/test_reconciliation.py` to pytest.
+'''
+import pytest
+import database
+import time
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+from database import (
+    add_sample_data, record_fee_payment, get_payment_discrepancies, get_reconciliation_run, insert_borrow_record,
+    update_book_availability, get_fee_payment, get_patron_balance
+)
+from services.library_service import pay_late_fees
+from gateway_stub import StubGatewayServer
+from services.payment_service import AsyncPaymentGateway, PaymentGateway
+from services.reconciliation_service import reconcile_payments
+
+# MANDATORY: Reset the database before running tests to ensure a clean state with no interference from previous tests!
+@pytest.fixture(autouse=True, scope="module")
+def reset_database():
+    database.reset_database()
+    add_sample_data()
+
+@pytest.fixture
+def gateway_server():
+    with StubGatewayServer() as server:
+        yield server
+
+def record_payment(server, transaction_id, patron_id, amount, gateway_amount=None):
+    '''Record a paid late fee, and (unless gateway_amount is False) the gateway's charge for it.'''
+    record_fee_payment(patron_id, 1, amount, amount, transaction_id)
+    if gateway_amount is not False:
+        server.charges[transaction_id] = {
+            'transaction_id': transaction_id, 'status': 'completed', 'amount': gateway_amount or amount,
+            'refunded': 0.0, 'description': '', 'timestamp': time.time()
+        }
+
+# -------------------------------------------------------------------------
+
+def test_interrupted_run_resumes_from_checkpoint(gateway_server):
+    '''Test that discrepancies are stored, and a run stopped part way resumes without repeating payments.'''
+    record_payment(gateway_server, "txn_710000_1", "710000", 1.50)
+    record_payment(gateway_server, "txn_710000_2", "710000", 2.00, gateway_amount=20.00)
+    record_payment(gateway_server, "txn_720000_1", "720000", 3.50, gateway_amount=False)
+    record_payment(gateway_server, "txn_720000_2", "720000", 0.50)
+
+    gateway = AsyncPaymentGateway(base_url=gateway_server.base_url)
+    run = reconcile_payments(gateway, batch_size=2, rate_limit=None, max_batches=1)
+    assert run['status'] == 'running' and run['checked'] == 2 and run['discrepancies'] == 1
+
+    run = reconcile_payments(gateway, batch_size=2, rate_limit=None)
+    assert run['resumed'] is True
+    assert run['status'] == 'completed' and run['checked'] == 4 and run['discrepancies'] == 2
+    assert gateway_server.requests == 4  # Each payment checked once across both sittings.
+
+    discrepancies = get_payment_discrepancies(run['id'])
+    assert [(d['transaction_id'], d['kind']) for d in discrepancies] == [
+        ("txn_710000_2", 'amount_mismatch'), ("txn_720000_1", 'not_found')
+    ]
+    assert discrepancies[0]['recorded_amount'] == 2.00 and discrepancies[0]['gateway_amount'] == 20.00
+
+
+def test_new_run_checks_only_new_payments(gateway_server):
+    '''Test that the next run starts after the last completed run, and --full style runs recheck everything.'''
+    record_payment(gateway_server, "txn_730000_1", "730000", 1.00)
+    gateway = AsyncPaymentGateway(base_url=gateway_server.base_url)
+
+    run = reconcile_payments(gateway, rate_limit=None)
+    assert run['resumed'] is False and run['checked'] == 1 and run['discrepancies'] == 0
+
+    run = reconcile_payments(gateway, rate_limit=None, full=True)
+    assert run['checked'] == 5
+    assert run['discrepancies'] == 4  # This server instance only knows the newest charge.
+
+
+def test_gateway_errors_recorded_and_rate_limited(gateway_server):
+    '''Test that failed status checks are stored as errors, and the rate limit spaces checks out.'''
+    for n in range(5):
+        record_payment(gateway_server, f"txn_740000_{n}", "740000", 1.00)
+    gateway_server.fail_next = 1
+
+    start = time.perf_counter()
+    run = reconcile_payments(AsyncPaymentGateway(base_url=gateway_server.base_url), rate_limit=20)
+    elapsed = time.perf_counter() - start
+
+    assert run['checked'] == 5
+    assert [d['kind'] for d in get_payment_discrepancies(run['id'])] == ['error']
+    assert elapsed >= 4 / 20
+    assert get_reconciliation_run(run['id'])['status'] == 'completed'
+
+
+def test_unrecorded_charge_recorded(gateway_server, mocker):
+    '''Test that a charge whose recording failed is found by the next run and recorded once the gateway confirms it.'''
+    due_date = datetime.now() - timedelta(days=3)
+    insert_borrow_record("750000", 2, due_date - timedelta(days=14), due_date)
+    update_book_availability(2, -1)
+    gateway = Mock(spec=PaymentGateway)
+    gateway.process_payment.return_value = (True, "txn_750000_1", "Payment of $1.50 processed successfully")
+    mocker.patch("services.library_service.record_fee_payment", return_value=False)
+    success, msg, _ = pay_late_fees("750000", 2, gateway)
+    assert success and msg.endswith("It will be recorded when payments are next reconciled.)")
+    assert get_fee_payment("txn_750000_1") is None
+    mocker.stopall()
+    gateway_server.charges["txn_750000_1"] = {
+        'transaction_id': "txn_750000_1", 'status': 'completed', 'amount': 1.50, 'refunded': 0.0,
+        'description': '', 'timestamp': time.time()
+    }
+
+    run = reconcile_payments(AsyncPaymentGateway(base_url=gateway_server.base_url), rate_limit=None)
+    assert [(d['transaction_id'], d['kind']) for d in get_payment_discrepancies(run['id'])] == [("txn_750000_1", 'unrecorded')]
+    assert get_fee_payment("txn_750000_1")['amount'] == 1.50
+    assert get_patron_balance("750000") == 0.0
+
+    run = reconcile_payments(AsyncPaymentGateway(base_url=gateway_server.base_url), rate_limit=None)
+    assert run['discrepancies'] == 0
@@ -0,0 +1,73 @@
+'''
+Tests for the slotted Book and Loan record types returned by the database helpers.
+
+Run this file with venv terminal `python -m pytest tests/test_records.py` to pytest.
+'''
+import pytest
+import database
+from datetime import datetime
+from records import Book, Loan, ReturnedLoan, to_epoch
+from database import add_sample_data, get_all_books, get_patron_borrowed_books, get_patron_borrowing_history, insert_borrow_record, update_borrow_record_return_date
+from app import create_app
+
+# MANDATORY: Reset the database before running tests to ensure a clean state with no interference from previous tests!
+@pytest.fixture(autouse=True, scope="module")
+def reset_database():
+    database.reset_database()
+    add_sample_data()
+
+# -------------------------------------------------------------------------
+
+def test_book_behaves_like_a_dict():
+    '''Test that a Book can be read, changed and converted like the dictionary it replaces, but not grown.'''
+    book = Book(1, "Dune", "Frank Herbert", "1000000000001", 2, 1)
+
+    assert book['title'] == book.title == "Dune"
+    assert dict(book) == {'id': 1, 'title': "Dune", 'author': "Frank Herbert", 'isbn': "1000000000001",
+                          'total_copies': 2, 'available_copies': 1}
+    assert book == dict(book) and len(book) == 6 and 'isbn' in book
+    book['available_copies'] = 2
+    assert book.available_copies == 2
+    with pytest.raises(KeyError):
+        book['publisher'] = "Ace"
+    assert not hasattr(book, '__dict__')  # Slotted, no per-record dictionary.
+
+
+def test_loan_dates_converted_on_read():
+    '''Test that a Loan keeps its stored epoch dates and turns them into datetimes when read.'''
+    due = datetime(2025, 1, 15, 9, 30)
+    loan = Loan(1, "Dune", "Frank Herbert", to_epoch(datetime(2025, 1, 1)), to_epoch(due), None, 0)
+
+    assert loan['due_date'] == due
+    assert loan['return_date'] is None and loan['is_overdue'] is False
+    loan['return_date'] = datetime(2025, 1, 20)
+    assert loan.return_date == datetime(2025, 1, 20)
+
+
+def test_helpers_return_records():
+    '''Test that catalog and loan helpers build records directly from their queries.'''
+    assert all(isinstance(book, Book) for book in get_all_books())
+    borrowed = get_patron_borrowed_books("123456")  # Sample data: 1984 borrowed 5 days ago.
+    assert isinstance(borrowed[0], Loan)
+    assert borrowed[0]['title'] == "1984"
+    assert borrowed[0]['is_overdue'] is False
+
+
+def test_history_rows_keep_was_overdue():
+    '''Test that returned loans in the borrowing history report was_overdue, as they always have.'''
+    insert_borrow_record("654321", 2, datetime(2025, 1, 1), datetime(2025, 1, 15))
+    update_borrow_record_return_date("654321", 2, datetime(2025, 1, 20))
+
+    returned, = get_patron_borrowing_history("654321")
+    assert isinstance(returned, ReturnedLoan)
+    assert returned.to_dict()['was_overdue'] is True and 'is_overdue' not in returned
+    assert returned.copy()['title'] == returned['title']
+
+
+def test_records_serialize_as_json():
+    '''Test that API responses serialize records as JSON objects.'''
+    client = create_app({'TESTING': True}).test_client()
+    response = client.get('/api/books?limit=1')
+
+    assert response.status_code == 200
+    assert set(response.get_json()['books'][0]) == set(Book._fields)